@@ -0,0 +1,9 @@
+import os
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+app = Celery('config')
+# CELERY_* settings; without a broker tasks run inline (CELERY_TASK_ALWAYS_EAGER)
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -15,6 +15,7 @@ from datetime import timedelta
 import os
 from decouple import config
 import dj_database_url
+from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
 
 # Middleware (Security + WhiteNoise early)
 MIDDLEWARE = [
+    'core.middleware.RequestStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -54,6 +56,9 @@ MIDDLEWARE = [
 ]
 ROOT_URLCONF = 'config.urls'
 
+# Per-endpoint latency / query statistics at /api/stats/ (off by default)
+REQUEST_STATS_ENABLED = config('REQUEST_STATS_ENABLED', default=False, cast=bool)
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -118,6 +123,10 @@ STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Uploads queued for background imports and finished background exports
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # CORS / CSRF (dev-friendly defaults)
 CORS_ALLOW_ALL_ORIGINS = config('CORS_ALLOW_ALL', default=True, cast=bool)
 CORS_ALLOW_CREDENTIALS = True
@@ -137,10 +146,10 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'rest_framework.filters.SearchFilter',
-        'rest_framework.filters.OrderingFilter',
+        'core.filters.IndexedOrderingFilter',
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.StandardPagination',
     'PAGE_SIZE': 20,
     'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler',
 }
@@ -191,5 +200,26 @@ else:
         }
     }
 
+# Background tasks (core/tasks.py): Celery on the Redis broker when one is configured,
+# otherwise tasks run inline in the calling process (tests, local development)
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default=REDIS_URL)
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=not CELERY_BROKER_URL, cast=bool)
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    'enforce-gps-retention': {
+        'task': 'core.tasks.enforce_gps_retention',
+        # Every night at 03:00 in TIME_ZONE (CELERY_TIMEZONE), off-peak
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'delete-expired-exports': {
+        'task': 'core.tasks.delete_expired_exports',
+        'schedule': crontab(minute=30),
+    },
+}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
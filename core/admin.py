@@ -2,7 +2,7 @@ from django.contrib import admin
 from .models import (
     Bus, Admin, Supervisor, Driver, Student, Guardian, Attendance, Announcement,
     BusAssignment, BusRoute, BusRoutePoint, Trip, TripStudent, Feedback,
-    MaintenanceLog, Notification, Reminder, GPSTracking, Class
+    MaintenanceLog, Notification, NotificationRecipient, Reminder, GPSTracking, BusLocation, GPSDailySummary, Class
 )
 
 @admin.register(Bus)
@@ -26,6 +26,9 @@ admin.site.register(TripStudent)
 admin.site.register(Feedback)
 admin.site.register(MaintenanceLog)
 admin.site.register(Notification)
+admin.site.register(NotificationRecipient)
 admin.site.register(Reminder)
 admin.site.register(GPSTracking)
+admin.site.register(BusLocation)
+admin.site.register(GPSDailySummary)
 admin.site.register(Class)
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.checks import Error, register
+from .filters import filter_field_names, is_indexed, ordering_supported
+
+
+@register()
+def check_viewset_indexes(app_configs, **kwargs):
+    """Every filter and ordering a core endpoint offers must be backed by an index."""
+    from .urls import router
+    errors = []
+    for prefix, viewset, _ in router.registry:
+        model = viewset.queryset.model
+        filters = filter_field_names(viewset)
+        if getattr(viewset, 'filterset_fields', None) == '__all__' or getattr(viewset, 'ordering_fields', None) == '__all__':
+            errors.append(Error(
+                f"{viewset.__name__} exposes every column for filtering or ordering.",
+                hint="List the supported fields explicitly.",
+                obj=viewset, id='core.E001',
+            ))
+            continue
+        for name in filters:
+            field = model._meta.get_field(name)
+            if not is_indexed(model, field.name):
+                errors.append(Error(
+                    f"{viewset.__name__} filters on {model.__name__}.{name}, which has no index.",
+                    obj=viewset, id='core.E002',
+                ))
+        for name in getattr(viewset, 'ordering_fields', None) or []:
+            if not ordering_supported(model, name, filters):
+                errors.append(Error(
+                    f"{viewset.__name__} orders by {model.__name__}.{name}, which no index covers.",
+                    obj=viewset, id='core.E003',
+                ))
+    return errors
+
+
+# Caches that each process keeps to itself
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """With a broker, tasks run in worker processes: job records and task metrics need a cache they all share."""
+    if getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', True):
+        return []
+    if settings.CACHES['default']['BACKEND'] in PROCESS_LOCAL_CACHES:
+        return [Error(
+            "Celery tasks run in worker processes, but the default cache is local to each process.",
+            hint="Set REDIS_URL (or configure another shared cache) when CELERY_BROKER_URL is set.",
+            id='core.E004',
+        )]
+    return []
@@ -1,13 +1,37 @@
+import asyncio
 import json
+import logging
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
-from django.utils import timezone
-from .models import Bus, GPSTracking, Trip, BusRoute, BusRoutePoint, TripStudent, Student
+from django.db import DatabaseError
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from .ingest import GPS_BATCH_MAX, GPS_BUFFER_MAX, GPS_FLUSH_INTERVAL, GPS_FLUSH_SIZE, parse_fix, save_fixes
+from .live import (
+    get_snapshot, get_static, get_position, group_name, positions, fleet_row,
+    FLEET_GROUP, FLEET_FIELDS, FLEET_PUSH_INTERVAL,
+)
+from .inbox import group_name as inbox_group
+from .models import Bus, NotificationRecipient
+
+logger = logging.getLogger(__name__)
 
 class BusLiveConsumer(AsyncWebsocketConsumer):
+    """
+    Live map for one bus.
+    By default every message is the full FeatureCollection. With ``?layers=split`` the
+    client gets the static layer once (``type: static``) and then only small
+    ``type: position`` messages; the static layer is re-sent when its version changes.
+    """
     async def connect(self):
         self.bus_id = self.scope['url_route']['kwargs'].get('bus_id')
-        self.group_name = f"bus_{self.bus_id}"
+        self.group_name = group_name(self.bus_id)
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.split = query.get('layers', [''])[0] == 'split'
+        self.static_version = None
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.accept()
         await self._send_snapshot()
@@ -17,115 +41,235 @@ class BusLiveConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data=None, bytes_data=None):
         # Optional: allow client to request a refresh
+        self.static_version = None
         await self._send_snapshot()
 
     async def bus_update(self, event):
-        # Triggered by signals when new GPS point comes in
-        await self._send_snapshot()
+        # Sent by live.publish() when a new GPS point comes in; the payload is already serialized
+        if not self.split:
+            await self.send(text_data=event["snapshot"])
+            return
+        if event["version"] != self.static_version:
+            static = await sync_to_async(get_static)(self.bus_id)
+            if static is None:
+                return
+            self.static_version = static["version"]
+            await self.send(text_data=json.dumps(dict(static, type="static")))
+        await self.send(text_data=event["position"])
 
     async def _send_snapshot(self):
-        data = await self._build_geojson()
-        await self.send(text_data=json.dumps(data))
+        if not self.split:
+            data = await self._build_geojson()
+            await self.send(text_data=json.dumps(data))
+            return
+        position = await sync_to_async(get_position)(self.bus_id)
+        if position is None:
+            await self.send(text_data=json.dumps({"type": "error", "error": "bus_not_found"}))
+            return
+        if position["version"] != self.static_version:
+            static = await sync_to_async(get_static)(self.bus_id)
+            if static is None:
+                return
+            self.static_version = static["version"]
+            await self.send(text_data=json.dumps(dict(static, type="static")))
+        await self.send(text_data=json.dumps(dict(position, type="position")))
 
     @sync_to_async
     def _build_geojson(self):
-        try:
-            bus = Bus.objects.get(id=self.bus_id)
-        except Bus.DoesNotExist:
+        data = get_snapshot(self.bus_id)
+        if data is None:
             return {"type": "FeatureCollection", "features": [], "error": "bus_not_found"}
+        return data
+
+
+class FleetLiveConsumer(AsyncWebsocketConsumer):
+    """
+    Positions of the whole fleet for dispatch dashboards.
+    Sends a full ``type: fleet`` snapshot on connect, then ``type: delta`` messages with only
+    the buses that moved, coalesced to at most one message per FLEET_PUSH_INTERVAL.
+    Accepts the same ``?status=`` / ``?ids=`` filters as ``/api/buses/fleet/`` and, like it,
+    only authenticated users (session or ``?token=<JWT access token>``).
+    """
+    async def connect(self):
+        self.flush_task = None
+        if await authenticate(self.scope) is None:
+            await self.close(code=4003)
+            return
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        status = query.get('status', ['active'])[0]
+        try:
+            ids = [int(i) for i in query.get('ids', [''])[0].split(',') if i] or None
+        except ValueError:
+            await self.close(code=4000)
+            return
+        self.pending = {}
+        self.last_flush = 0.0
+        self.bus_ids = await database_sync_to_async(_fleet_bus_ids)(ids, status)
+        await self.channel_layer.group_add(FLEET_GROUP, self.channel_name)
+        await self.accept()
+        rows = await database_sync_to_async(_fleet_rows)(self.bus_ids)
+        await self.send(text_data=json.dumps({"type": "fleet", "fields": FLEET_FIELDS, "buses": rows}))
+
+    async def disconnect(self, close_code):
+        if self.flush_task:
+            self.flush_task.cancel()
+        await self.channel_layer.group_discard(FLEET_GROUP, self.channel_name)
+
+    async def fleet_update(self, event):
+        # Sent by live.publish_fleet(); only the latest row per bus is kept until the next push
+        for row in event["rows"]:
+            if self.bus_ids is None or row[0] in self.bus_ids:
+                self.pending[row[0]] = row
+        if self.pending and self.flush_task is None:
+            delay = max(0.0, self.last_flush + FLEET_PUSH_INTERVAL - asyncio.get_running_loop().time())
+            self.flush_task = asyncio.create_task(self._flush_later(delay))
+
+    async def _flush_later(self, delay):
+        await asyncio.sleep(delay)
+        rows, self.pending = list(self.pending.values()), {}
+        self.flush_task = None
+        self.last_flush = asyncio.get_running_loop().time()
+        await self.send(text_data=json.dumps({"type": "delta", "fields": FLEET_FIELDS, "buses": rows}))
+
+
+def _fleet_bus_ids(ids, status):
+    if status == 'all':
+        return set(ids) if ids else None
+    buses = Bus.objects.filter(status=status)
+    if ids:
+        buses = buses.filter(id__in=ids)
+    return set(buses.values_list('id', flat=True))
+
+
+def _fleet_rows(bus_ids):
+    return [fleet_row(p) for p in positions(bus_ids)]
+
+
+class DriverGPSConsumer(AsyncWebsocketConsumer):
+    """
+    Streaming GPS ingestion for one bus over a long-lived connection.
+    Authenticates with the session or ``?token=<JWT access token>``. Each message is a fix
+    ``{latitude, longitude, timestamp?}``, a list of fixes or ``{"points": [...]}``.
+    Valid fixes are buffered and written in bulk by a background task every
+    GPS_FLUSH_INTERVAL seconds or once GPS_FLUSH_SIZE fixes are queued.
+    At most GPS_BUFFER_MAX fixes wait unsaved (e.g. while the database is down): fixes beyond
+    that are rejected so the device keeps and resends them. On disconnect everything is flushed.
+    """
+    async def connect(self):
+        self.bus_id = self.scope['url_route']['kwargs'].get('bus_id')
+        self.buffer = []
+        self.flusher = None
+        self.closing = False
+        user = await authenticate(self.scope)
+        if user is None or not await database_sync_to_async(Bus.objects.filter(id=self.bus_id).exists)():
+            await self.close(code=4003)
+            return
+        self.flush_requested = asyncio.Event()
+        await self.accept()
+        self.flusher = asyncio.create_task(self._flush_loop())
+
+    async def disconnect(self, close_code):
+        if self.flusher:
+            # Let the flush loop finish the batch it may be writing rather than cancelling it half-way
+            self.closing = True
+            self.flush_requested.set()
+            await self.flusher
+        while self.buffer and await self._flush(ack=False):
+            pass
+        if self.buffer:
+            logger.error("Dropped %d unsaved GPS fixes for bus %s on disconnect", len(self.buffer), self.bus_id)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            payload = json.loads(text_data or bytes_data)
+        except ValueError:
+            await self.send(text_data=json.dumps({"type": "error", "detail": "Invalid JSON."}))
+            return
+        if isinstance(payload, dict) and 'points' in payload:
+            payload = payload['points']
+        items = payload if isinstance(payload, list) else [payload]
+        rejected = []
+        for index, item in enumerate(items):
+            fix, errors = parse_fix(item, {self.bus_id}, self.bus_id)
+            if fix is not None and len(self.buffer) >= GPS_BUFFER_MAX:
+                fix, errors = None, {"non_field_errors": ["Too many unsaved fixes; resend later."]}
+                self.flush_requested.set()
+            if fix is None:
+                rejected.append({"index": index, "errors": errors})
+            else:
+                self.buffer.append(fix)
+        if rejected:
+            await self.send(text_data=json.dumps({"type": "error", "rejected": rejected}))
+        if len(self.buffer) >= GPS_FLUSH_SIZE:
+            self.flush_requested.set()
 
-        now = timezone.localtime()
-        today = now.date()
-        latest = GPSTracking.objects.filter(bus=bus).order_by('-timestamp').first()
-        trip = Trip.objects.select_related('route').filter(
-            bus=bus, date=today, start_time__lte=now.time(), end_time__gte=now.time()
-        ).first()
-        if not trip:
-            trip = Trip.objects.select_related('route').filter(bus=bus).order_by('-date', '-start_time').first()
-        route = trip.route if trip else BusRoute.objects.filter(bus=bus).order_by('-id').first()
-        route_points = list(BusRoutePoint.objects.filter(route=route).order_by('order')) if route else []
-
-        if trip:
-            trip_students = TripStudent.objects.select_related('student').filter(trip=trip)
-            students = [ts.student for ts in trip_students]
-        else:
-            students = list(Student.objects.filter(busassignment__bus=bus).distinct())
-
-        features = []
-        if latest:
+    async def _flush_loop(self):
+        while not self.closing:
             try:
-                bus_lon = float(latest.longitude)
-                bus_lat = float(latest.latitude)
-                features.append({
-                    "type": "Feature",
-                    "geometry": {"type": "Point", "coordinates": [bus_lon, bus_lat]},
-                    "properties": {
-                        "kind": "bus",
-                        "bus_id": bus.id,
-                        "title": bus.title,
-                        "number": bus.number,
-                        "timestamp": latest.timestamp.isoformat(),
-                    },
-                })
-            except (TypeError, ValueError):
+                await asyncio.wait_for(self.flush_requested.wait(), GPS_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_requested.clear()
+            while self.buffer and not self.closing and await self._flush():
                 pass
 
-        if route_points:
-            coords = []
-            for p in route_points:
-                try:
-                    coords.append([float(p.longitude), float(p.latitude)])
-                except (TypeError, ValueError):
-                    continue
-            if coords:
-                features.append({
-                    "type": "Feature",
-                    "geometry": {"type": "LineString", "coordinates": coords},
-                    "properties": {"kind": "route", "route_name": route.route_name if route else None},
-                })
-            for p in route_points:
-                try:
-                    lon = float(p.longitude)
-                    lat = float(p.latitude)
-                except (TypeError, ValueError):
-                    continue
-                features.append({
-                    "type": "Feature",
-                    "geometry": {"type": "Point", "coordinates": [lon, lat]},
-                    "properties": {"kind": "stop", "order": p.order, "location_name": p.location_name},
-                })
-
-        for s in students:
-            if s.latitude is not None and s.longitude is not None:
-                try:
-                    lon = float(s.longitude)
-                    lat = float(s.latitude)
-                except (TypeError, ValueError):
-                    continue
-                features.append({
-                    "type": "Feature",
-                    "geometry": {"type": "Point", "coordinates": [lon, lat]},
-                    "properties": {
-                        "kind": "student",
-                        "id": s.id,
-                        "name": f"{s.fname} {s.lname}".strip(),
-                        "registration_code": s.registration_code,
-                    },
-                })
-
-        data = {
-            "type": "FeatureCollection",
-            "features": features,
-            "meta": {
-                "bus": {"id": bus.id, "title": bus.title, "number": bus.number, "status": bus.status, "bus_id": bus.bus_id},
-                "trip": ({
-                    "id": trip.id,
-                    "date": trip.date.isoformat(),
-                    "start_time": trip.start_time.isoformat(),
-                    "end_time": trip.end_time.isoformat(),
-                    "route_name": trip.route.route_name if trip and trip.route else None,
-                } if trip else None),
-                "counts": {"route_points": len(route_points) if route_points else 0, "students": len(students)},
-            },
-        }
-        return data
+    async def _flush(self, ack=True):
+        """Save up to one batch from the buffer; returns False if the database refused it."""
+        if not self.buffer:
+            return True
+        fixes, self.buffer = self.buffer[:GPS_BATCH_MAX], self.buffer[GPS_BATCH_MAX:]
+        try:
+            await database_sync_to_async(save_fixes)(fixes)
+        except DatabaseError:
+            logger.exception("Could not store %d GPS fixes for bus %s", len(fixes), self.bus_id)
+            # Keep them for the next flush; receive() keeps the buffer within GPS_BUFFER_MAX
+            self.buffer = fixes + self.buffer
+            return False
+        if ack:
+            await self.send(text_data=json.dumps({"type": "ack", "saved": len(fixes)}))
+        return True
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """
+    Notification inbox of the connected user (session or ``?token=<JWT access token>``).
+    Starts with ``{type: unread, count}``, then every new notification as ``{type: notification, inbox_id, ...}``.
+    """
+    async def connect(self):
+        self.group_name = None
+        user = await authenticate(self.scope)
+        if user is None:
+            await self.close(code=4003)
+            return
+        self.group_name = inbox_group(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        count = await database_sync_to_async(
+            NotificationRecipient.objects.filter(user_id=user.id, read_at__isnull=True).count)()
+        await self.send(text_data=json.dumps({"type": "unread", "count": count}))
+
+    async def disconnect(self, close_code):
+        if self.group_name:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def notification(self, event):
+        # Sent by inbox.fan_out(); the payload is already serialized
+        await self.send(text_data=event["text"])
+
+
+async def authenticate(scope):
+    user = scope.get('user')
+    if user is not None and user.is_authenticated:
+        return user
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+    if not token:
+        return None
+    return await database_sync_to_async(_user_from_token)(token)
+
+
+def _user_from_token(token):
+    authentication = JWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from . import live
+from .geometry import get_geometry
+from .models import Bus, BusLocation, GPSTracking
+
+# ETA state lives in the cache per bus; it is rebuilt from the database on a miss
+# and at the latest this many seconds after it was built (new fixes do not extend it)
+ETA_TIMEOUT = getattr(settings, 'ETA_TIMEOUT', 600)
+# Trips start and end with the clock, not with a save: the current route is checked again this often
+ETA_ROUTE_CHECK = getattr(settings, 'ETA_ROUTE_CHECK', 60)
+# Seconds of GPS history used to seed the speed on a cold start
+ETA_SPEED_WINDOW = getattr(settings, 'ETA_SPEED_WINDOW', 300)
+# Speeds in m/s: used when there is no history / lower bound so a stopped bus still gets an ETA
+ETA_DEFAULT_SPEED = getattr(settings, 'ETA_DEFAULT_SPEED', 8.0)
+ETA_MIN_SPEED = getattr(settings, 'ETA_MIN_SPEED', 1.0)
+# Weight of the newest speed sample in the moving average
+ETA_SMOOTHING = getattr(settings, 'ETA_SMOOTHING', 0.3)
+
+
+def _key(bus_id):
+    # Route or trip changes bump the live generation, which retires the state
+    return f"eta:{bus_id}:{live.generation(bus_id)}"
+
+
+def _geometry(state):
+    return get_geometry(state["route"]) if state["route"] else None
+
+
+def _route_id(bus_id):
+    bus = Bus(id=bus_id)
+    route = live.current_route(bus, live.current_trip(bus))
+    return route.id if route else None
+
+
+def build_state(bus_id):
+    """Current route, last position projected onto it and a speed seeded from recent fixes."""
+    now = timezone.now().timestamp()
+    state = {"route": _route_id(bus_id), "along": None, "timestamp": None, "speed": ETA_DEFAULT_SPEED,
+             "checked": now, "expires": now + ETA_TIMEOUT}
+    geometry = _geometry(state)
+    location = BusLocation.objects.filter(bus_id=bus_id).first()
+    if location is None or not geometry:
+        return state
+    recent = list(
+        GPSTracking.objects.filter(bus_id=bus_id, timestamp__gte=location.timestamp - timedelta(seconds=ETA_SPEED_WINDOW),
+                                   timestamp__lte=location.timestamp)
+        .order_by('timestamp').values_list('timestamp', 'latitude', 'longitude')
+    )
+    if len(recent) >= 2:
+        first, last = recent[0], recent[-1]
+        elapsed = (last[0] - first[0]).total_seconds()
+        if elapsed > 0:
+            moved = (geometry.project(float(last[1]), float(last[2]))
+                     - geometry.project(float(first[1]), float(first[2])))
+            state["speed"] = max(moved / elapsed, 0.0)
+    state["along"] = geometry.project(float(location.latitude), float(location.longitude))
+    state["timestamp"] = location.timestamp.isoformat()
+    return state
+
+
+def advance(state, fix):
+    """Move ``state`` to a newer fix, updating the smoothed speed. Returns False for stale fixes."""
+    geometry = _geometry(state)
+    if not geometry:
+        return False
+    along = geometry.project(float(fix.latitude), float(fix.longitude))
+    if state["timestamp"] is not None:
+        elapsed = (fix.timestamp - datetime.fromisoformat(state["timestamp"])).total_seconds()
+        if elapsed <= 0:
+            return False
+        sample = max((along - state["along"]) / elapsed, 0.0)
+        state["speed"] = (1 - ETA_SMOOTHING) * state["speed"] + ETA_SMOOTHING * sample
+    state["along"] = along
+    state["timestamp"] = fix.timestamp.isoformat()
+    return True
+
+
+def eta_payload(bus_id, state):
+    """Per-stop ETAs for the stops still ahead of the bus."""
+    payload = {"bus": bus_id, "route": state["route"], "timestamp": state["timestamp"],
+               "speed": round(state["speed"], 2), "stops": []}
+    geometry = _geometry(state)
+    if state["along"] is None or not geometry:
+        return payload
+    speed = max(state["speed"], ETA_MIN_SPEED)
+    start = datetime.fromisoformat(state["timestamp"])
+    for i, along in enumerate(geometry.cumulative):
+        distance = along - state["along"]
+        if distance < 0:
+            continue
+        seconds = distance / speed
+        payload["stops"].append({
+            "id": geometry.ids[i], "order": geometry.orders[i], "location_name": geometry.names[i],
+            "distance": round(distance, 1), "eta_seconds": round(seconds),
+            "eta": (start + timedelta(seconds=seconds)).isoformat(),
+        })
+    return payload
+
+
+def _store(key, state):
+    # Only for what is left of the state's lifetime
+    remaining = state["expires"] - timezone.now().timestamp()
+    if remaining > 0:
+        cache.set(key, state, remaining)
+
+
+def _cached_state(key, bus_id):
+    """The cached state of a bus, or None (and dropped) if it expired or the bus is on another route now."""
+    state = cache.get(key)
+    if state is None:
+        return None
+    now = timezone.now().timestamp()
+    if now < state["expires"] and now - state["checked"] < ETA_ROUTE_CHECK:
+        return state
+    if now < state["expires"] and _route_id(bus_id) == state["route"]:
+        state["checked"] = now
+        _store(key, state)
+        return state
+    cache.delete(key)
+    return None
+
+
+def get_eta(bus_id):
+    """ETAs for a bus from its cached state (built on a miss), or None if the bus does not exist."""
+    key = _key(bus_id)
+    state = _cached_state(key, bus_id)
+    if state is None:
+        if not Bus.objects.filter(id=bus_id).exists():
+            return None
+        state = build_state(bus_id)
+        _store(key, state)
+    return eta_payload(bus_id, state)
+
+
+def record_fix(fix):
+    """Advance the cached state of a bus by one new fix; buses nobody asked about are skipped."""
+    key = _key(fix.bus_id)
+    state = _cached_state(key, fix.bus_id)
+    if state is not None and advance(state, fix):
+        _store(key, state)
+
+
+def forget(bus_id):
+    cache.delete(_key(bus_id))
@@ -0,0 +1,97 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+# serializer class -> compiled plan (or None when the serializer cannot be served from values())
+_plans = {}
+
+
+def _identity(value):
+    return value
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+def _iso_output(field):
+    default = api_settings.DATE_FORMAT if isinstance(field, serializers.DateField) else api_settings.TIME_FORMAT
+    return getattr(field, 'format', default) == ISO_8601
+
+
+def _file_url(field, request):
+    storage = field.storage
+
+    def convert(name):
+        if not name:
+            return None
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+    return convert
+
+
+def compile_plan(serializer, model):
+    """
+    Map every serializer field to a values_list() column and a converter that reproduces
+    its ``to_representation`` output. Returns None if any field needs a model instance.
+    Each plan entry is ``(field_name, column, converter)``; converter is None for identity,
+    or a ``('file', model_field)`` marker for file fields bound to the request later.
+    """
+    plan = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if field.source != name:
+            return None
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if model_field.many_to_many or model_field.one_to_many or not model_field.concrete:
+            return None
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            if field.pk_field is not None:
+                return None
+            plan.append((name, model_field.attname, None))
+        elif isinstance(field, serializers.FileField):
+            if not getattr(field, 'use_url', True):
+                return None
+            plan.append((name, name, ('file', model_field)))
+        elif type(field) in (serializers.DateField, serializers.TimeField) and _iso_output(field):
+            plan.append((name, name, _isoformat))
+        elif type(field) in (serializers.CharField, serializers.EmailField, serializers.IntegerField,
+                             serializers.BooleanField, serializers.FloatField, serializers.ReadOnlyField) \
+                or (type(field) is serializers.ChoiceField and all(isinstance(key, str) for key in field.choices)):
+            # Values coming back from the database already have the type these fields render
+            plan.append((name, name, None))
+        else:
+            plan.append((name, name, field.to_representation))
+    return plan
+
+
+def get_plan(serializer_class, model, context):
+    if serializer_class not in _plans:
+        _plans[serializer_class] = compile_plan(serializer_class(context=context), model)
+    return _plans[serializer_class]
+
+
+def row_builder(plan, request):
+    """Build the function that turns one values_list() row into the serializer's output dict."""
+    names = [name for name, _, _ in plan]
+    converters = []
+    for _, _, converter in plan:
+        if isinstance(converter, tuple):
+            converter = _file_url(converter[1], request)
+        converters.append(converter)
+    pairs = list(zip(names, converters))
+
+    def build(row):
+        return {
+            name: value if converter is None or value is None else converter(value)
+            for (name, converter), value in zip(pairs, row)
+        }
+    return build
+
+
+def plan_columns(plan):
+    return [column for _, column, _ in plan]
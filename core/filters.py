@@ -0,0 +1,87 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import CursorPagination
+
+
+def index_columns(model):
+    """Column lists (field names, leading column first) of every index the database has for ``model``."""
+    meta = model._meta
+    columns = [[meta.pk.name]]
+    for field in meta.concrete_fields:
+        if field.db_index or field.unique:
+            columns.append([field.name])
+    for index in meta.indexes:
+        columns.append([name.lstrip('-') for name in index.fields])
+    for constraint in meta.constraints:
+        fields = getattr(constraint, 'fields', None)
+        if fields:
+            columns.append(list(fields))
+    for fields in meta.unique_together:
+        columns.append(list(fields))
+    return columns
+
+
+def is_indexed(model, field):
+    """True if ``field`` is the leading column of some index."""
+    return any(columns[0] == field for columns in index_columns(model))
+
+
+def ordering_supported(model, field, filters=()):
+    """
+    True if rows matching equality ``filters`` can be read in ``field`` order straight from an index:
+    some index must start with a subset of the filtered columns followed by ``field``.
+    Ordering by the primary key is always allowed.
+    """
+    if field in ('pk', model._meta.pk.name):
+        return True
+    filters = set(filters)
+    for columns in index_columns(model):
+        for position, column in enumerate(columns):
+            if column == field:
+                return True
+            if column not in filters:
+                break
+    return False
+
+
+def filter_field_names(view):
+    fields = getattr(view, 'filterset_fields', None) or []
+    return [] if fields == '__all__' else list(fields)
+
+
+class IndexedOrderingFilter(OrderingFilter):
+    """
+    OrderingFilter that answers 400 for an ``?ordering=`` the indexes cannot serve
+    together with the equality filters of the same request (see ``ordering_supported``).
+    """
+    def get_ordering(self, request, queryset, view):
+        if self.ordering_param in request.query_params:
+            self._check_cursor_key(request, queryset, view)
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering and self.ordering_param in request.query_params:
+            filters = [name for name in filter_field_names(view) if name in request.query_params]
+            for term in ordering:
+                field = term.lstrip('-')
+                if not ordering_supported(queryset.model, field, filters):
+                    raise ValidationError({self.ordering_param: [
+                        f"Ordering by '{field}' is not supported"
+                        + (f" together with filters {', '.join(filters)}." if filters else " without a filter.")
+                    ]})
+        return ordering
+
+    def _check_cursor_key(self, request, queryset, view):
+        # CursorPagination positions on the first ordering key only and falls back to offsets within
+        # runs of equal values, so a cursor-paginated list must lead with a unique key (or its own time key).
+        paginator = getattr(view, 'paginator', None)
+        terms = [term.strip() for term in request.query_params[self.ordering_param].split(',') if term.strip()]
+        if not isinstance(paginator, CursorPagination) or not terms:
+            return
+        model = queryset.model
+        default = paginator.ordering if isinstance(paginator.ordering, str) else paginator.ordering[0]
+        keys = {'pk', model._meta.pk.name, default.lstrip('-')}
+        keys.update(field.name for field in model._meta.concrete_fields if field.unique)
+        field = terms[0].lstrip('-')
+        if field not in keys:
+            raise ValidationError({self.ordering_param: [
+                f"Ordering by '{field}' is not supported: this list pages on a unique key."
+            ]})
@@ -0,0 +1,81 @@
+import math
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between two (lat, lon) points in degrees."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+# Geohash: a base32 string where every extra character narrows the cell, so points that
+# share a prefix are close and "near X" becomes a few indexed ``LIKE 'prefix%'`` scans.
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # ~4.8m x 4.8m cells
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                value = value * 2 + 1
+                lon_range[0] = mid
+            else:
+                value *= 2
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                value = value * 2 + 1
+                lat_range[0] = mid
+            else:
+                value *= 2
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """Height and width of a geohash cell in degrees."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def geohash_cover(latitude, longitude, radius_m):
+    """
+    Geohash prefixes whose cells together contain every point within ``radius_m`` of the point:
+    the cell of the point and its 8 neighbours, at the finest precision where a cell is at
+    least ``radius_m`` across. Returns an empty list when the radius is too large to narrow anything.
+    """
+    cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = geohash_cell_size(precision)
+        if radius_m <= min(height * math.pi / 180 * EARTH_RADIUS_M, width * math.pi / 180 * EARTH_RADIUS_M * cos_lat):
+            break
+    else:
+        return []
+    cells = set()
+    for dlat in (-height, 0, height):
+        for dlon in (-width, 0, width):
+            lat = min(max(latitude + dlat, -90.0), 90.0)
+            lon = (longitude + dlon + 180.0) % 360.0 - 180.0
+            cells.add(geohash_encode(lat, lon, precision))
+    return sorted(cells)
@@ -0,0 +1,121 @@
+import json
+import math
+from array import array
+from django.conf import settings
+from django.core.cache import cache
+from .geo import EARTH_RADIUS_M, haversine
+from .models import BusRoute, BusRoutePoint
+
+# Geometry is invalidated explicitly when a route or its points change; this only bounds memory
+ROUTE_GEOMETRY_TIMEOUT = getattr(settings, 'ROUTE_GEOMETRY_TIMEOUT', 24 * 3600)
+
+_K = math.pi / 180 * EARTH_RADIUS_M
+
+
+class RouteGeometry:
+    """
+    Everything derived from the points of a route, computed once per route change:
+    packed coordinates in route order, the distance along the route at each point,
+    the bounding box and the GeoJSON features (LineString + stops) of the live map,
+    both as dicts and pre-serialized.
+    """
+
+    def __init__(self, route_id, route_name, points):
+        self.route_id = route_id
+        self.route_name = route_name
+        self.ids = array('q', (p[0] for p in points))
+        self.orders = [p[1] for p in points]
+        self.names = [p[2] for p in points]
+        self.lats = array('d', (float(p[3]) for p in points))
+        self.lons = array('d', (float(p[4]) for p in points))
+        self.cumulative = array('d', [0.0])
+        for i in range(1, len(points)):
+            self.cumulative.append(self.cumulative[-1] + _segment_length(
+                self.lats[i - 1], self.lons[i - 1], self.lats[i], self.lons[i]))
+        self.bbox = (min(self.lats), min(self.lons), max(self.lats), max(self.lons)) if points else None
+        self.features = self._features()
+        # The same features as JSON text (comma-separated, no brackets), spliced into live map messages
+        self.features_json = ','.join(json.dumps(feature, separators=(',', ':')) for feature in self.features)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _features(self):
+        if not self.ids:
+            return []
+        features = [{
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": [[lon, lat] for lat, lon in zip(self.lats, self.lons)]},
+            "properties": {"kind": "route", "route_name": self.route_name},
+        }]
+        for i in range(len(self)):
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [self.lons[i], self.lats[i]]},
+                "properties": {"kind": "stop", "order": self.orders[i], "location_name": self.names[i]},
+            })
+        return features
+
+    def stop(self, i):
+        return {"id": self.ids[i], "route": self.route_id, "order": self.orders[i], "location_name": self.names[i],
+                "latitude": self.lats[i], "longitude": self.lons[i]}
+
+    def project(self, lat, lon):
+        """Distance along the route of the point of the polyline closest to (lat, lon)."""
+        if len(self) < 2:
+            return 0.0
+        kx = _K * math.cos(math.radians(lat))
+        best = None
+        for j in range(len(self) - 1):
+            ax, ay = (self.lons[j] - lon) * kx, (self.lats[j] - lat) * _K
+            dx, dy = (self.lons[j + 1] - lon) * kx - ax, (self.lats[j + 1] - lat) * _K - ay
+            length2 = dx * dx + dy * dy
+            s = 0.0 if length2 == 0 else min(1.0, max(0.0, -(ax * dx + ay * dy) / length2))
+            offset = math.hypot(ax + s * dx, ay + s * dy)
+            if best is None or offset < best[0]:
+                best = (offset, j, s)
+        _, i, t = best
+        return self.cumulative[i] + t * (self.cumulative[i + 1] - self.cumulative[i])
+
+    def distances(self, lat, lon):
+        """Great-circle distance in meters from (lat, lon) to every point."""
+        return [haversine(lat, lon, p_lat, p_lon) for p_lat, p_lon in zip(self.lats, self.lons)]
+
+
+def _segment_length(lat1, lon1, lat2, lon2):
+    x = (lon2 - lon1) * _K * math.cos(math.radians(lat1))
+    return math.hypot(x, (lat2 - lat1) * _K)
+
+
+def _generation_key(route_id):
+    return f"route:gen:{route_id}"
+
+
+def build_geometry(route_id):
+    route_name = BusRoute.objects.filter(id=route_id).values_list('route_name', flat=True).first()
+    if route_name is None:
+        return None
+    points = list(
+        BusRoutePoint.objects.filter(route_id=route_id).order_by('order')
+        .values_list('id', 'order', 'location_name', 'latitude', 'longitude')
+    )
+    return RouteGeometry(route_id, route_name, points)
+
+
+def get_geometry(route_id):
+    """The cached RouteGeometry of a route (built on a miss), or None if the route does not exist."""
+    key = f"route:geometry:{route_id}:{cache.get(_generation_key(route_id), 0)}"
+    geometry = cache.get(key)
+    if geometry is None:
+        geometry = build_geometry(route_id)
+        if geometry is not None:
+            cache.set(key, geometry, ROUTE_GEOMETRY_TIMEOUT)
+    return geometry
+
+
+def invalidate(route_id):
+    key = _generation_key(route_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
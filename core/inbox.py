@@ -0,0 +1,68 @@
+import json
+from itertools import islice
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from .models import Guardian, Notification, NotificationRecipient
+
+# Recipients written per INSERT (and pushed per round) by the fan-out
+INBOX_BATCH_SIZE = getattr(settings, 'INBOX_BATCH_SIZE', 1000)
+
+
+def group_name(user_id):
+    return f"user_{user_id}"
+
+
+def recipient_ids(notification):
+    """
+    User ids of the guardians who should see ``notification``: Bus -> BusAssignment -> Student -> Guardian,
+    or every guardian for a notification without a bus. One query, streamed.
+    """
+    guardians = Guardian.objects.all()
+    if notification.bus_id is not None:
+        guardians = guardians.filter(students__busassignment__bus_id=notification.bus_id)
+    return guardians.order_by('user_id').values_list('user_id', flat=True).distinct().iterator(chunk_size=INBOX_BATCH_SIZE)
+
+
+def payload(notification, inbox_id=None):
+    data = {
+        "type": "notification", "id": notification.id, "title": notification.title, "message": notification.message,
+        "bus": notification.bus_id, "created_at": notification.created_at.isoformat(),
+    }
+    if inbox_id is not None:
+        data["inbox_id"] = inbox_id
+    return data
+
+
+def fan_out(notification, batch_size=INBOX_BATCH_SIZE):
+    """
+    Write the inbox rows of ``notification`` in batches and push each new row to its user's group.
+    Safe to run again, or twice at once: each batch is written under a lock on the notification row,
+    so rows that already exist are neither duplicated nor pushed twice.
+    Returns the number of rows written.
+    """
+    channel_layer = get_channel_layer()
+    written = 0
+    users = recipient_ids(notification)
+    while True:
+        batch = list(islice(users, batch_size))
+        if not batch:
+            return written
+        with transaction.atomic():
+            # A concurrent run waits here, then finds this batch's rows in ``existing``
+            if not Notification.objects.select_for_update().filter(id=notification.id).exists():
+                return written
+            existing = set(NotificationRecipient.objects.filter(notification=notification, user_id__in=batch)
+                           .values_list('user_id', flat=True))
+            NotificationRecipient.objects.bulk_create(
+                [NotificationRecipient(notification=notification, user_id=user_id) for user_id in batch if user_id not in existing],
+                batch_size=batch_size, ignore_conflicts=True,
+            )
+            rows = list(NotificationRecipient.objects.filter(notification=notification, user_id__in=batch)
+                        .exclude(user_id__in=existing).values_list('id', 'user_id'))
+        for inbox_id, user_id in rows:
+            written += 1
+            if channel_layer is not None:
+                async_to_sync(channel_layer.group_send)(
+                    group_name(user_id), {"type": "notification", "text": json.dumps(payload(notification, inbox_id))})
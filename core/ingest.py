@@ -0,0 +1,185 @@
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, OuterRef, Q, Subquery, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from . import eta, live, retention, tasks
+from .models import Bus, BusLocation, GPSTracking
+
+# Upper bound on fixes accepted in one bulk request / flushed in one INSERT
+GPS_BATCH_MAX = getattr(settings, 'GPS_BATCH_MAX', 1000)
+
+# Driver WebSocket buffering: flush every N seconds or as soon as this many fixes are queued
+GPS_FLUSH_INTERVAL = getattr(settings, 'GPS_FLUSH_INTERVAL', 1.0)
+GPS_FLUSH_SIZE = getattr(settings, 'GPS_FLUSH_SIZE', 50)
+# Fixes a driver connection may hold unsaved; beyond this, new fixes are rejected until a flush succeeds
+GPS_BUFFER_MAX = getattr(settings, 'GPS_BUFFER_MAX', 5 * GPS_BATCH_MAX)
+
+# Device clocks may run this many seconds ahead; later fixes would pin BusLocation and the retention day
+GPS_MAX_CLOCK_SKEW = getattr(settings, 'GPS_MAX_CLOCK_SKEW', 60)
+
+COORD_QUANTUM = Decimal('0.00000001')
+
+
+def _coordinate(value, limit):
+    try:
+        number = Decimal(str(value)).quantize(COORD_QUANTUM)
+    except (InvalidOperation, TypeError, ValueError):
+        return None, "A valid number is required."
+    if not number.is_finite() or abs(number) > limit:
+        return None, f"Ensure this value is between -{limit} and {limit}."
+    return number, None
+
+
+def parse_fix(item, bus_ids, default_bus=None):
+    """
+    Validate one raw GPS fix without going through a serializer.
+    Returns ``(GPSTracking, None)`` or ``(None, errors)`` with DRF-style error lists.
+    """
+    if not isinstance(item, dict):
+        return None, {"non_field_errors": ["Expected an object."]}
+    errors = {}
+    bus = item.get('bus', default_bus)
+    try:
+        bus = int(bus)
+    except (TypeError, ValueError):
+        errors['bus'] = ["This field is required."] if bus is None else ["Incorrect type. Expected pk value."]
+    else:
+        if bus not in bus_ids:
+            errors['bus'] = [f'Invalid pk "{bus}" - object does not exist.']
+    latitude, error = _coordinate(item.get('latitude'), 90)
+    if error:
+        errors['latitude'] = [error]
+    longitude, error = _coordinate(item.get('longitude'), 180)
+    if error:
+        errors['longitude'] = [error]
+    timestamp = item.get('timestamp')
+    if timestamp in (None, ''):
+        timestamp = timezone.now()
+    else:
+        try:
+            timestamp = parse_datetime(str(timestamp))
+        except ValueError:  # well-formed but impossible, e.g. month 13
+            timestamp = None
+        if timestamp is None:
+            errors['timestamp'] = ["Datetime has wrong format."]
+        else:
+            if timezone.is_naive(timestamp):
+                timestamp = timezone.make_aware(timestamp)
+            if timestamp > timezone.now() + timedelta(seconds=GPS_MAX_CLOCK_SKEW):
+                errors['timestamp'] = ["Datetime is in the future."]
+    if errors:
+        return None, errors
+    return GPSTracking(bus_id=bus, latitude=latitude, longitude=longitude, timestamp=timestamp), None
+
+
+def parse_fixes(items, default_bus=None):
+    """Validate a batch of raw fixes with a single query for the referenced buses."""
+    wanted = set()
+    for item in items:
+        try:
+            wanted.add(int(item.get('bus', default_bus)))
+        except (AttributeError, TypeError, ValueError):
+            pass
+    bus_ids = set(Bus.objects.filter(id__in=wanted).values_list('id', flat=True)) if wanted else set()
+    return [parse_fix(item, bus_ids, default_bus) for item in items]
+
+
+def _latest_per_bus(fixes):
+    latest = {}
+    for fix in fixes:
+        current = latest.get(fix.bus_id)
+        if current is None or fix.timestamp >= current.timestamp:
+            latest[fix.bus_id] = fix
+    return latest
+
+
+def update_locations(fixes):
+    """
+    Advance the BusLocation row of every bus in ``fixes`` to its newest fix.
+    Fixes older than the stored location (late uploads) leave it untouched.
+    Two statements whatever the number of buses: insert the missing rows, then one UPDATE
+    whose ``timestamp <=`` guard is evaluated by the database, so concurrent requests for
+    the same bus cannot move it backwards.
+    """
+    latest = _latest_per_bus(fixes)
+    if not latest:
+        return
+    BusLocation.objects.bulk_create(
+        [BusLocation(bus_id=f.bus_id, latitude=f.latitude, longitude=f.longitude, timestamp=f.timestamp)
+         for f in latest.values()],
+        ignore_conflicts=True,
+    )
+    guard = Q()
+    for bus_id, fix in latest.items():
+        guard |= Q(bus_id=bus_id, timestamp__lte=fix.timestamp)
+    BusLocation.objects.filter(guard).update(**{
+        name: Case(*[When(bus_id=bus_id, then=Value(getattr(fix, name))) for bus_id, fix in latest.items()],
+                   output_field=BusLocation._meta.get_field(name))
+        for name in ('latitude', 'longitude', 'timestamp')
+    })
+
+
+def backfill_locations(batch_size=GPS_BATCH_MAX):
+    """Create the BusLocation row of every bus that has GPS history but none yet. Returns the number created."""
+    newest = GPSTracking.objects.filter(bus_id=OuterRef('pk')).order_by('-timestamp', '-id')
+    buses = Bus.objects.filter(location__isnull=True, gpstracking__isnull=False).distinct() \
+        .annotate(fix_id=Subquery(newest.values('id')[:1])).values_list('fix_id', flat=True)
+    created = 0
+    for fix_ids in _batches(list(buses), batch_size):
+        fixes = GPSTracking.objects.filter(id__in=fix_ids)
+        created += len(BusLocation.objects.bulk_create(
+            [BusLocation(bus_id=f.bus_id, latitude=f.latitude, longitude=f.longitude, timestamp=f.timestamp) for f in fixes],
+            ignore_conflicts=True,
+        ))
+    return created
+
+
+def _batches(values, size):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def refresh_location(bus_id):
+    """Recompute a bus's BusLocation from its history (e.g. after its latest fix was deleted)."""
+    latest = GPSTracking.objects.filter(bus_id=bus_id).order_by('-timestamp').first()
+    if latest is None:
+        BusLocation.objects.filter(bus_id=bus_id).delete()
+        return None
+    BusLocation.objects.update_or_create(bus_id=bus_id, defaults={
+        "latitude": latest.latitude, "longitude": latest.longitude, "timestamp": latest.timestamp,
+    })
+    return latest
+
+
+def notify_fixes(fixes):
+    """
+    Store the new last-known positions, then after commit update the live position
+    layer and publish once per bus touched by ``fixes`` plus once to the fleet group.
+    """
+    update_locations(fixes)
+    retention.reopen_days(fixes)
+    latest = list(_latest_per_bus(fixes).values())
+    for fix in latest:
+        transaction.on_commit(lambda fix=fix: _fix_committed(fix), robust=True)
+    transaction.on_commit(lambda: tasks.publish_fleet.delay(live.fleet_rows(latest)), robust=True)
+
+
+def _fix_committed(fix):
+    # Cache updates stay inline so reads right after the request see them; the fan-out is a task
+    live.record_position(fix)
+    eta.record_fix(fix)
+    tasks.publish_bus.delay(fix.bus_id)
+
+
+def save_fixes(fixes):
+    """Insert validated fixes with one ``bulk_create`` per batch inside a single transaction."""
+    if not fixes:
+        return fixes
+    with transaction.atomic():
+        created = GPSTracking.objects.bulk_create(fixes, batch_size=GPS_BATCH_MAX)
+        # bulk_create skips post_save, so do what the signal handler would have done
+        notify_fixes(created)
+    return created
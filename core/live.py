@@ -0,0 +1,316 @@
+import hashlib
+import json
+from datetime import datetime
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .geometry import get_geometry
+from .models import Bus, BusLocation, Trip, BusRoute, TripStudent, Student
+
+# Snapshots depend on the clock (which trip is "current"), so they also expire on their own.
+SNAPSHOT_TIMEOUT = getattr(settings, 'LIVE_SNAPSHOT_TIMEOUT', 30)
+# Fleet map subscribers get coalesced deltas at most this often (seconds)
+FLEET_PUSH_INTERVAL = getattr(settings, 'FLEET_PUSH_INTERVAL', 1.0)
+FLEET_GROUP = "fleet"
+FLEET_FIELDS = ["bus_id", "lon", "lat", "timestamp"]
+
+
+def _generation_key(bus_id):
+    return f"live:gen:{bus_id}"
+
+
+def _static_key(bus_id, generation):
+    return f"live:static:{bus_id}:{generation}"
+
+
+def _position_key(bus_id):
+    return f"live:position:{bus_id}"
+
+
+def generation(bus_id):
+    """Counter bumped by ``invalidate()`` whenever the static data of a bus changes."""
+    return cache.get(_generation_key(bus_id), 0)
+
+
+def _dumps(data):
+    return json.dumps(data, separators=(',', ':'))
+
+
+def _version(features_json, meta):
+    payload = features_json + json.dumps(meta, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def current_trip(bus):
+    """The trip the bus is running now, else its last trip (route selected), or None."""
+    now = timezone.localtime()
+    trip = Trip.objects.select_related('route').filter(
+        bus=bus, date=now.date(), start_time__lte=now.time(), end_time__gte=now.time()
+    ).first()
+    if not trip:
+        trip = Trip.objects.select_related('route').filter(bus=bus).order_by('-date', '-start_time').first()
+    return trip
+
+
+def current_route(bus, trip):
+    return trip.route if trip else BusRoute.objects.filter(bus=bus).order_by('-id').first()
+
+
+def build_static(bus):
+    """
+    Build the static layer of the live map: route LineString, stops, student pins and meta.
+    These only change when trips, routes or assignments change, so clients fetch them once
+    per ``version`` and then follow position updates.
+    """
+    return _build_static(bus)[0]
+
+
+def _build_static(bus):
+    # Also returns the features as JSON text, reusing the route's pre-serialized fragment
+    trip = current_trip(bus)
+    route = current_route(bus, trip)
+    geometry = get_geometry(route.id) if route else None
+    # Students on the trip or assigned to the bus
+    if trip:
+        trip_students = TripStudent.objects.select_related('student').filter(trip=trip)
+        students = [ts.student for ts in trip_students]
+    else:
+        students = list(Student.objects.filter(busassignment__bus=bus).distinct())
+
+    # Route as LineString + stops, prebuilt per route
+    features = list(geometry.features) if geometry else []
+    fragments = [geometry.features_json] if geometry and geometry.features_json else []
+
+    # Students points
+    for s in students:
+        if s.latitude is not None and s.longitude is not None:
+            try:
+                lon = float(s.longitude)
+                lat = float(s.latitude)
+            except (TypeError, ValueError):
+                continue
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                "properties": {
+                    "kind": "student",
+                    "id": s.id,
+                    "name": f"{s.fname} {s.lname}".strip(),
+                    "registration_code": s.registration_code,
+                },
+            })
+            fragments.append(_dumps(features[-1]))
+
+    meta = {
+        "bus": {"id": bus.id, "title": bus.title, "number": bus.number, "status": bus.status, "bus_id": bus.bus_id},
+        "trip": ({
+            "id": trip.id,
+            "date": trip.date.isoformat(),
+            "start_time": trip.start_time.isoformat(),
+            "end_time": trip.end_time.isoformat(),
+            "route_name": trip.route.route_name if trip and trip.route else None,
+        } if trip else None),
+        "counts": {"route_points": len(geometry) if geometry else 0, "students": len(students)},
+    }
+    features_json = ','.join(fragments)
+    return {"version": _version(features_json, meta), "features": features, "meta": meta}, features_json
+
+
+def position_payload(bus_id, latitude, longitude, timestamp):
+    """The dynamic layer: where the bus is right now."""
+    try:
+        coordinates = [float(longitude), float(latitude)]
+    except (TypeError, ValueError):
+        coordinates = None
+    return {
+        "bus_id": bus_id,
+        "coordinates": coordinates,
+        "timestamp": timestamp.isoformat() if coordinates and timestamp else None,
+    }
+
+
+def build_position(bus_id):
+    latest = BusLocation.objects.filter(bus_id=bus_id).first()
+    if latest is None:
+        # History recorded before BusLocation existed: backfill it once
+        from .ingest import refresh_location
+        latest = refresh_location(bus_id)
+    if latest is None:
+        return position_payload(bus_id, None, None, None)
+    return position_payload(bus_id, latest.latitude, latest.longitude, latest.timestamp)
+
+
+def positions(bus_ids=None, status=None):
+    """Last known position of every bus (or of ``bus_ids`` / buses with ``status``) with a single query."""
+    locations = BusLocation.objects.all()
+    if bus_ids is not None:
+        locations = locations.filter(bus_id__in=bus_ids)
+    if status is not None:
+        locations = locations.filter(bus__status=status)
+    return [
+        position_payload(bus_id, latitude, longitude, timestamp)
+        for bus_id, latitude, longitude, timestamp
+        in locations.order_by('bus_id').values_list('bus_id', 'latitude', 'longitude', 'timestamp')
+    ]
+
+
+def fleet_row(position):
+    """Compact ``[bus_id, lon, lat, timestamp]`` row used by the fleet map."""
+    lon, lat = position["coordinates"] or (None, None)
+    return [position["bus_id"], lon, lat, position["timestamp"]]
+
+
+def _bus_feature(static, position):
+    if not position["coordinates"]:
+        return None
+    bus = static["meta"]["bus"]
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": position["coordinates"]},
+        "properties": {
+            "kind": "bus",
+            "bus_id": bus["id"],
+            "title": bus["title"],
+            "number": bus["number"],
+            "timestamp": position["timestamp"],
+        },
+    }
+
+
+def compose(static, position):
+    """Merge both layers back into the full FeatureCollection served by ``/live/``."""
+    bus = _bus_feature(static, position)
+    features = ([bus] if bus else []) + static["features"]
+    return {"type": "FeatureCollection", "features": features, "meta": static["meta"]}
+
+
+def compose_json(static, features_json, position):
+    """``compose()`` as JSON text, splicing in the cached ``features_json`` instead of encoding it again."""
+    bus = _bus_feature(static, position)
+    features = ','.join(([_dumps(bus)] if bus else []) + ([features_json] if features_json else []))
+    return f'{{"type":"FeatureCollection","features":[{features}],"meta":{_dumps(static["meta"])}}}'
+
+
+def get_static(bus_id):
+    """
+    Return the static layer for a bus from the cache, building it on a miss.
+    Returns None if the bus does not exist.
+    """
+    entry = _cached_static(bus_id)
+    return entry[0] if entry else None
+
+
+def _cached_static(bus_id):
+    # (static layer, its features as JSON text), or None if the bus does not exist
+    key = _static_key(bus_id, generation(bus_id))
+    entry = cache.get(key)
+    if entry is None:
+        try:
+            bus = Bus.objects.get(id=bus_id)
+        except Bus.DoesNotExist:
+            return None
+        entry = _build_static(bus)
+        cache.set(key, entry, SNAPSHOT_TIMEOUT)
+    return entry
+
+
+def get_position(bus_id):
+    """Return the dynamic layer for a bus (static ``version`` included), or None if the bus does not exist."""
+    static = get_static(bus_id)
+    if static is None:
+        return None
+    return dict(_cached_position(bus_id), version=static["version"])
+
+
+def _cached_position(bus_id):
+    position = cache.get(_position_key(bus_id))
+    if position is None:
+        position = build_position(bus_id)
+        cache.set(_position_key(bus_id), position, SNAPSHOT_TIMEOUT)
+    return position
+
+
+def get_snapshot(bus_id):
+    """
+    Return the full live FeatureCollection for a bus, or None if the bus does not exist.
+    Both layers come from the cache, so an unchanged bus costs no queries.
+    """
+    static = get_static(bus_id)
+    if static is None:
+        return None
+    return compose(static, _cached_position(bus_id))
+
+
+def invalidate(*bus_ids):
+    """
+    Drop the cached static layers of the given buses, once the change is visible to other readers.
+    Bumping the generation (instead of deleting the key) means a snapshot that was built from
+    the old rows is written under a key nobody reads anymore. Bumping before the commit would not:
+    a reader starting in between caches the old rows under the new generation.
+    """
+    transaction.on_commit(lambda: _bump(bus_ids), robust=True)
+
+
+def _bump(bus_ids):
+    for bus_id in set(bus_ids):
+        if bus_id is None:
+            continue
+        key = _generation_key(bus_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def record_position(fix):
+    """Write a new GPS fix through to the cached dynamic layer, unless a newer one is already there."""
+    key = _position_key(fix.bus_id)
+    current = cache.get(key)
+    if current and current["timestamp"] and datetime.fromisoformat(current["timestamp"]) > fix.timestamp:
+        return
+    cache.set(key, position_payload(fix.bus_id, fix.latitude, fix.longitude, fix.timestamp), SNAPSHOT_TIMEOUT)
+
+
+def forget_position(bus_id):
+    cache.delete(_position_key(bus_id))
+
+
+def group_name(bus_id):
+    return f"bus_{bus_id}"
+
+
+def publish(bus_id):
+    """
+    Push the current state of a bus to its WebSocket group.
+    The payload is built and serialized once here; consumers only forward the text,
+    so the cost per GPS fix does not grow with the number of subscribers.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    entry = _cached_static(bus_id)
+    if entry is None:
+        return
+    static, features_json = entry
+    position = _cached_position(bus_id)
+    async_to_sync(channel_layer.group_send)(group_name(bus_id), {
+        "type": "bus.update",
+        "version": static["version"],
+        "snapshot": compose_json(static, features_json, position),
+        "position": json.dumps(dict(position, version=static["version"], type="position")),
+    })
+
+
+def fleet_rows(fixes):
+    return [fleet_row(position_payload(f.bus_id, f.latitude, f.longitude, f.timestamp)) for f in fixes]
+
+
+def publish_fleet(rows):
+    """Send the new positions of a batch of fixes (``fleet_rows()``) to the fleet group as one message."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not rows:
+        return
+    async_to_sync(channel_layer.group_send)(FLEET_GROUP, {"type": "fleet.update", "rows": rows})
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from core.ingest import GPS_BATCH_MAX, backfill_locations
+
+
+class Command(BaseCommand):
+    help = "Create the last known position of buses whose GPS history predates BusLocation (run once after upgrading)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=GPS_BATCH_MAX)
+
+    def handle(self, *args, **options):
+        created = backfill_locations(options['batch'])
+        self.stdout.write(f"BusLocation: {created} rows created")
@@ -0,0 +1,43 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory
+from core import fastpath
+from core.models import Student
+from core.serializers import StudentSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare StudentSerializer against the values_list() fast path at several page sizes (data is rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='20,100,500,2000')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        request = APIRequestFactory().get('/api/students/')
+        with transaction.atomic():
+            Student.objects.bulk_create([
+                Student(fname=f"Student{i}", lname="Bench", image=f"students/{i}.png", address="1 Main Street",
+                        latitude="30.12345678", longitude="31.12345678")
+                for i in range(max(sizes))
+            ])
+            queryset = Student.objects.order_by('id')
+            plan = fastpath.get_plan(StudentSerializer, Student, {'request': request})
+            build = fastpath.row_builder(plan, request)
+            columns = fastpath.plan_columns(plan)
+            self.stdout.write(f"{'rows':>6} {'serializer ms':>14} {'fast path ms':>13} {'speedup':>8}")
+            for size in sizes:
+                slow = self._time(lambda: StudentSerializer(queryset[:size], many=True, context={'request': request}).data, options['repeat'])
+                fast = self._time(lambda: [build(row) for row in queryset.values_list(*columns, named=True)[:size]], options['repeat'])
+                self.stdout.write(f"{size:>6} {slow * 1000:>14.2f} {fast * 1000:>13.2f} {slow / fast:>7.1f}x")
+            transaction.set_rollback(True)
+
+    def _time(self, func, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        return best
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.retention import (
+    enforce_retention, GPS_RAW_DAYS, GPS_DOWNSAMPLE_SECONDS, GPS_HISTORY_DAYS, GPS_RETENTION_BATCH
+)
+
+
+class Command(BaseCommand):
+    help = "Roll up and downsample old GPS fixes (full resolution for --raw-days, then one fix per --interval seconds)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--raw-days', type=int, default=GPS_RAW_DAYS)
+        parser.add_argument('--interval', type=int, default=GPS_DOWNSAMPLE_SECONDS)
+        parser.add_argument('--history-days', type=int, default=GPS_HISTORY_DAYS,
+                            help="Drop downsampled fixes older than this many days (default: keep).")
+        parser.add_argument('--batch-size', type=int, default=GPS_RETENTION_BATCH)
+
+    def handle(self, *args, **options):
+        try:
+            stats = enforce_retention(
+                raw_days=options['raw_days'],
+                interval=options['interval'],
+                history_days=options['history_days'],
+                batch_size=options['batch_size'],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {stats['days']} bus-days, downsampled {stats['downsampled']} fixes, "
+            f"expired {stats['expired']} fixes."
+        ))
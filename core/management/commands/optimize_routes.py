@@ -0,0 +1,101 @@
+import os
+from collections import Counter, defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from core import geometry, live, optimization, versions
+from core.models import Bus, BusAssignment, BusRoute, BusRoutePoint, Student
+from core.signals import buses_for_route
+
+
+class Command(BaseCommand):
+    help = ("Suggest shorter stop orders for bus routes and (with --assign) a capacity-aware student-to-bus "
+            "assignment, reporting distances before and after. Nothing is written without --apply.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--route', type=int, action='append', help="Only this route (repeatable).")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Processes for the route search.")
+        parser.add_argument('--assign', action='store_true', help="Also suggest student-to-bus assignments.")
+        parser.add_argument('--apply', action='store_true', help="Save the suggestions.")
+
+    def handle(self, *args, **options):
+        self.optimize_stop_orders(options)
+        if options['assign']:
+            self.optimize_assignments(options)
+
+    def optimize_stop_orders(self, options):
+        points = BusRoutePoint.objects.order_by('route_id', 'order', 'id')
+        if options['route']:
+            points = points.filter(route_id__in=options['route'])
+        routes = defaultdict(list)
+        for point in points.only('id', 'route_id', 'order', 'latitude', 'longitude'):
+            routes[point.route_id].append(point)
+        route_ids = list(routes)
+        results = optimization.optimize_many(
+            [[(p.latitude, p.longitude) for p in routes[route_id]] for route_id in route_ids], options['workers'])
+
+        total_before = total_after = 0
+        changed = []
+        for route_id, (order, before, after) in zip(route_ids, results):
+            total_before += before
+            total_after += after
+            if after < before:
+                self.stdout.write(f"Route {route_id}: {before / 1000:.2f} km -> {after / 1000:.2f} km")
+                changed.append((route_id, [routes[route_id][i] for i in order]))
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(route_ids)} routes, {len(changed)} improved: "
+            f"{total_before / 1000:.2f} km -> {total_after / 1000:.2f} km"
+        ))
+        if options['apply'] and changed:
+            with transaction.atomic():
+                for route_id, stops in changed:
+                    for position, stop in enumerate(stops, start=1):
+                        stop.order = position
+                    BusRoutePoint.objects.bulk_update(stops, ['order'])
+            # bulk_update sends no signals
+            for route_id, _ in changed:
+                geometry.invalidate(route_id)
+                live.invalidate(*buses_for_route(route_id))
+            versions.bump(BusRoutePoint)
+
+    def optimize_assignments(self, options):
+        buses = list(Bus.objects.order_by('id'))
+        stops_by_bus = {}
+        for bus in buses:
+            route = BusRoute.objects.filter(bus=bus).order_by('-id').first()
+            stops_by_bus[bus.id] = list(
+                BusRoutePoint.objects.filter(route=route).values_list('latitude', 'longitude')) if route else []
+        students = list(Student.objects.exclude(latitude=None).exclude(longitude=None).only('id', 'latitude', 'longitude'))
+        current = dict(BusAssignment.objects.order_by('assigned_date', 'id').values_list('student_id', 'bus_id'))
+
+        homes = [(float(s.latitude), float(s.longitude)) for s in students]
+        # Students without a pickup location are not reassigned, but keep their seat
+        located = {s.id for s in students}
+        seated = Counter(bus_id for student_id, bus_id in current.items() if student_id not in located)
+        fleet = [(max(bus.capacity - seated[bus.id], 0), stops_by_bus[bus.id]) for bus in buses]
+        walks = optimization.walking_distances(homes, fleet)
+        bus_index = {bus.id: i for i, bus in enumerate(buses)}
+        before = [walks[i][bus_index[current[s.id]]] for i, s in enumerate(students)
+                  if current.get(s.id) in bus_index and walks[i][bus_index[current[s.id]]] != float('inf')]
+        suggested = optimization.assign_students(homes, fleet)
+        after = [distance for bus, distance in suggested if bus is not None]
+        moves = [(s, buses[bus]) for s, (bus, _) in zip(students, suggested)
+                 if bus is not None and current.get(s.id) != buses[bus].id]
+        unassigned = sum(1 for bus, _ in suggested if bus is None)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Walk to the nearest stop: {sum(before) / 1000:.2f} km for {len(before)} students -> "
+            f"{sum(after) / 1000:.2f} km for {len(after)} students; "
+            f"{len(moves)} reassignments, {unassigned} students without a seat."
+        ))
+        if options['apply'] and moves:
+            touched = set()
+            today = timezone.localdate()
+            with transaction.atomic():
+                for student, bus in moves:
+                    touched.add(current.get(student.id))
+                    touched.add(bus.id)
+                    updated = BusAssignment.objects.filter(student=student).update(bus=bus, assigned_date=today)
+                    if not updated:
+                        BusAssignment.objects.create(student=student, bus=bus, assigned_date=today)
+            live.invalidate(*touched)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from core import versions
+from core.models import BusRoutePoint, Student, sync_geohash
+
+
+class Command(BaseCommand):
+    help = "Recompute the geohash column of students and route points (after bulk imports or raw updates)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        for model in (Student, BusRoutePoint):
+            changed = []
+            updated = 0
+            for row in model.objects.only('id', 'latitude', 'longitude', 'geohash').iterator(chunk_size=options['batch']):
+                stored = row.geohash
+                sync_geohash(row, {})
+                if row.geohash != stored:
+                    changed.append(row)
+                if len(changed) >= options['batch']:
+                    model.objects.bulk_update(changed, ['geohash'])
+                    updated += len(changed)
+                    changed = []
+            if changed:
+                model.objects.bulk_update(changed, ['geohash'])
+                updated += len(changed)
+            if updated:
+                # bulk_update sends no signals: retire the cached responses (ConditionalGetMixin)
+                versions.bump(model)
+            self.stdout.write(f"{model.__name__}: {updated} geohashes updated")
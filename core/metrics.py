@@ -0,0 +1,150 @@
+import hashlib
+import json
+import threading
+from collections import defaultdict
+from django.core.cache import cache
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_ROW_FIELDS = ("kind", "count", "avg_ms", "duration_seconds", "histogram", "totals", "averages", "max")
+
+_lock = threading.Lock()
+_series = {}
+
+# Series recorded with observe_shared() live in the cache, so every process reports them
+_SHARED_INDEX = "metrics:shared"
+
+
+class Series:
+    """Latency histogram plus free-form counters for one (kind, labels) combination."""
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.counters = defaultdict(float)
+        self.maxima = defaultdict(float)
+
+    def observe(self, duration, counters):
+        self.count += 1
+        self.duration += duration
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                self.buckets[i] += 1
+                break
+        for name, value in counters.items():
+            self.counters[name] += value
+            if value > self.maxima[name]:
+                self.maxima[name] = value
+
+
+def observe(kind, labels, duration, **counters):
+    """Record one event of ``kind`` (e.g. ``request``, ``task``) that took ``duration`` seconds."""
+    key = (kind, tuple(labels.items()))
+    with _lock:
+        series = _series.get(key)
+        if series is None:
+            series = _series[key] = Series()
+        series.observe(duration, counters)
+
+
+def _shared_key(kind, labels):
+    return "metrics:" + hashlib.sha1(json.dumps([kind, labels]).encode()).hexdigest()[:16]
+
+
+def _incr(key, delta):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key, delta)
+
+
+def observe_shared(kind, labels, duration):
+    """
+    Like ``observe()``, for events that happen in other processes (Celery workers): the series
+    is kept in the cache, so the stats of the web processes include it. No free-form counters.
+    """
+    labels = list(labels.items())
+    key = _shared_key(kind, labels)
+    index = cache.get(_SHARED_INDEX) or {}
+    if key not in index:
+        # Racing first observations may drop each other's entry; the next observation adds it back
+        index[key] = [kind, labels]
+        cache.set(_SHARED_INDEX, index, None)
+    _incr(f"{key}:count", 1)
+    _incr(f"{key}:us", round(duration * 1e6))
+    for i, bound in enumerate(BUCKETS):
+        if duration <= bound:
+            _incr(f"{key}:b{i}", 1)
+            break
+
+
+def _shared_series():
+    index = cache.get(_SHARED_INDEX) or {}
+    for key, (kind, labels) in index.items():
+        values = cache.get_many([f"{key}:count", f"{key}:us"] + [f"{key}:b{i}" for i in range(len(BUCKETS))])
+        series = Series()
+        series.count = values.get(f"{key}:count", 0)
+        series.duration = values.get(f"{key}:us", 0) / 1e6
+        series.buckets = [values.get(f"{key}:b{i}", 0) for i in range(len(BUCKETS))]
+        yield (kind, tuple(tuple(label) for label in labels)), series
+
+
+def reset():
+    with _lock:
+        _series.clear()
+    index = cache.get(_SHARED_INDEX) or {}
+    cache.delete_many([f"{key}:{suffix}" for key in index
+                       for suffix in ["count", "us"] + [f"b{i}" for i in range(len(BUCKETS))]])
+    cache.delete(_SHARED_INDEX)
+
+
+def snapshot():
+    """JSON-friendly view of every series (this process's and the shared ones), slowest average first."""
+    with _lock:
+        items = list(_series.items())
+    items += list(_shared_series())
+    rows = []
+    for (kind, labels), series in items:
+        cumulative = 0
+        histogram = {}
+        for bound, value in zip(BUCKETS, series.buckets):
+            cumulative += value
+            histogram[str(bound)] = cumulative
+        histogram["+Inf"] = series.count
+        rows.append({
+            "kind": kind,
+            **dict(labels),
+            "count": series.count,
+            "avg_ms": round(series.duration / series.count * 1000, 3) if series.count else 0.0,
+            "duration_seconds": series.duration,
+            "histogram": histogram,
+            "totals": dict(series.counters),
+            "averages": {name: round(value / series.count, 6) for name, value in series.counters.items()},
+            "max": dict(series.maxima),
+        })
+    rows.sort(key=lambda row: row["avg_ms"], reverse=True)
+    return rows
+
+
+def prometheus(rows):
+    """Render ``snapshot()`` rows in the Prometheus text exposition format."""
+    families = {}  # metric name -> (type, sample lines), samples of one family must stay together
+    for row in rows:
+        kind = row["kind"]
+        labels = ','.join(f'{k}="{v}"' for k, v in row.items() if k not in _ROW_FIELDS)
+        name = f"core_{kind}_duration_seconds"
+        samples = families.setdefault(name, ("histogram", []))[1]
+        for bound, value in row["histogram"].items():
+            samples.append(f'{name}_bucket{{{labels},le="{bound}"}} {value}')
+        samples.append(f"{name}_sum{{{labels}}} {row['duration_seconds']}")
+        samples.append(f"{name}_count{{{labels}}} {row['count']}")
+        for counter, value in row["totals"].items():
+            counter_name = f"core_{kind}_{counter}_total"
+            families.setdefault(counter_name, ("counter", []))[1].append(f"{counter_name}{{{labels}}} {value}")
+    lines = []
+    for name, (metric_type, samples) in families.items():
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
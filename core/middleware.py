@@ -0,0 +1,71 @@
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from . import metrics
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - start
+
+
+class RequestStatsMiddleware:
+    """
+    Per view/action request statistics: latency histogram, DB query count and time,
+    serialization time (rows to data, see ``QueryPlanMixin.serialize``), response render
+    time (data to bytes) and size. Exposed at ``/api/stats/``.
+    Only installed when REQUEST_STATS_ENABLED is set, otherwise it costs nothing.
+    """
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_STATS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = _QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+        labels = getattr(request, '_stats_labels', None)
+        if labels is not None:
+            metrics.observe(
+                'request', labels, elapsed,
+                queries=counter.count,
+                db_seconds=counter.time,
+                serialize_seconds=getattr(request, '_stats_serialize_time', 0.0),
+                render_seconds=getattr(request, '_stats_render_time', 0.0),
+                response_bytes=0 if response.streaming else len(response.content),
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if view_class is None:
+            request._stats_labels = {"view": view_func.__name__, "action": request.method.lower()}
+            return None
+        actions = getattr(view_func, 'actions', None) or {}
+        request._stats_labels = {
+            "view": view_class.__name__,
+            "action": actions.get(request.method.lower(), request.method.lower()),
+        }
+        return None
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered (serialized to bytes) right after this hook
+        start = time.perf_counter()
+
+        def rendered(response):
+            request._stats_render_time = time.perf_counter() - start
+        response.add_post_render_callback(rendered)
+        return response
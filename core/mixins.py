@@ -0,0 +1,542 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db import IntegrityError, transaction
+from django.db.models import UniqueConstraint
+from django.db.models.fields.related import ForeignObjectRel
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+from rest_framework.validators import UniqueTogetherValidator, UniqueValidator
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.response import Response
+from . import fastpath, versions
+
+# Browser/app cache lifetime and server-side response cache lifetime for ConditionalGetMixin
+REFERENCE_MAX_AGE = getattr(settings, 'REFERENCE_MAX_AGE', 60)
+REFERENCE_CACHE_TIMEOUT = getattr(settings, 'REFERENCE_CACHE_TIMEOUT', 300)
+# Items accepted per bulk request / rows per INSERT or UPDATE statement for BulkModelViewSetMixin
+BULK_MAX_ITEMS = getattr(settings, 'BULK_MAX_ITEMS', 5000)
+BULK_BATCH_SIZE = getattr(settings, 'BULK_BATCH_SIZE', 500)
+
+_serializer_fields = {}
+
+
+class QueryPlanMixin:
+    """
+    Declarative query plan for a viewset, applied in ``get_queryset()``.
+    - ``select_related_fields`` / ``prefetch_related_fields``: relations the serializer
+      actually reads (FKs rendered as ids need neither, the id is on the row already).
+    - Columns are projected with ``only()`` to what the serializer renders.
+    - ``?fields=a,b`` / ``?exclude=c`` on list and retrieve trim both the response
+      and that projection, so narrow requests read fewer columns.
+    """
+    select_related_fields = ()
+    prefetch_related_fields = ()
+    fields_param = 'fields'
+    exclude_param = 'exclude'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.select_related_fields:
+            queryset = queryset.select_related(*self.select_related_fields)
+        if self.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*self.prefetch_related_fields)
+        if self.request is not None and self.request.method in ('GET', 'HEAD'):
+            only = self.get_only_fields(queryset.model)
+            if only is not None:
+                queryset = queryset.only(*only)
+        return queryset
+
+    def get_serializer_field_names(self):
+        serializer_class = self.get_serializer_class()
+        names = _serializer_fields.get(serializer_class)
+        if names is None:
+            names = _serializer_fields[serializer_class] = list(serializer_class().fields)
+        requested = self.get_requested_fields(names)
+        if requested is not None:
+            return [name for name in names if name in requested]
+        return names
+
+    def get_requested_fields(self, names):
+        """Field names selected with ``?fields=`` / ``?exclude=``, or None when the request does not narrow them."""
+        if getattr(self, 'action', None) not in ('list', 'retrieve') or self.request is None:
+            return None
+        params = self.request.query_params
+        if self.fields_param not in params and self.exclude_param not in params:
+            return None
+        errors = {}
+        selected = set(names)
+        for param in (self.fields_param, self.exclude_param):
+            if param not in params:
+                continue
+            given = {name.strip() for name in params[param].split(',') if name.strip()}
+            unknown = sorted(given - set(names))
+            if unknown:
+                errors[param] = [f"Unknown field(s): {', '.join(unknown)}."]
+            elif param == self.fields_param:
+                selected &= given
+            else:
+                selected -= given
+        if errors:
+            raise ValidationError(errors)
+        return selected
+
+    def list(self, request, *args, **kwargs):
+        # ListModelMixin.list, with the serialization step timed separately
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(self.serialize(lambda: serializer.data))
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(self.serialize(lambda: serializer.data))
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_object())
+        return Response(self.serialize(lambda: serializer.data))
+
+    def serialize(self, build):
+        """Run ``build()`` (turning rows into response data) and add its duration to the request statistics."""
+        start = time.perf_counter()
+        data = build()
+        request = self.request._request
+        request._stats_serialize_time = getattr(request, '_stats_serialize_time', 0.0) + time.perf_counter() - start
+        return data
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        fields = (serializer.child if kwargs.get('many') else serializer).fields
+        names = set(self.get_serializer_field_names())
+        for name in list(fields):
+            if name not in names:
+                fields.pop(name)
+        return serializer
+
+    def get_only_fields(self, model):
+        """Concrete columns behind the serialized fields, or None when that is every column."""
+        columns = {f.name: f for f in model._meta.concrete_fields}
+        wanted = {model._meta.pk.name}
+        for name in self.get_serializer_field_names():
+            field = columns.get(name)
+            if field is None:
+                try:
+                    related = model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    # Computed serializer field: we cannot know what it reads, load everything
+                    return None
+                if related.many_to_many or isinstance(related, ForeignObjectRel):
+                    continue
+                return None
+            wanted.add(name)
+        for related in self.select_related_fields:
+            wanted.add(related)
+        if wanted >= set(columns):
+            return None
+        return sorted(wanted)
+
+
+class FastListMixin:
+    """
+    Opt-in (``fast_list = True``) list path that skips model instances and per-row
+    serializers: rows come straight from ``values_list()`` and go through converters
+    compiled once per serializer. The JSON is identical to the serializer's output;
+    serializers that need instances (M2M, custom sources) fall back automatically.
+    """
+    fast_list = False
+
+    def list(self, request, *args, **kwargs):
+        if not self.fast_list:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        plan = fastpath.get_plan(self.get_serializer_class(), queryset.model, self.get_serializer_context())
+        if plan is None:
+            return super().list(request, *args, **kwargs)
+        names = set(self.get_serializer_field_names())
+        plan = [entry for entry in plan if entry[0] in names]
+        columns = fastpath.plan_columns(plan)
+        # Ordering keys are read back from the rows by the cursor paginator, even when ?fields= leaves them out;
+        # the row builder only renders the plan's columns
+        columns += [name for name in self.get_ordering_columns(request, queryset) if name not in columns]
+        rows = queryset.values_list(*columns, named=True)
+        build = fastpath.row_builder(plan, request)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.serialize(lambda: [build(row) for row in page]))
+        return Response(self.serialize(lambda: [build(row) for row in rows]))
+
+    def get_ordering_columns(self, request, queryset):
+        terms = [term for term in queryset.query.order_by if isinstance(term, str)]
+        if isinstance(self.paginator, CursorPagination):
+            terms += list(self.paginator.get_ordering(request, queryset, self))
+        columns = []
+        for term in terms:
+            name = term.lstrip('-')
+            if '__' not in name and name not in columns:
+                columns.append(name)
+        return columns
+
+
+class ConditionalGetMixin:
+    """
+    Conditional GET for rarely changing reference data (list and retrieve).
+    The ETag and Last-Modified come from the per-model version counters in ``core.versions``
+    (bumped by signals on every write) plus the request URL, so they cost no query.
+    A matching If-None-Match / If-Modified-Since gets a 304, and unchanged reads are served
+    from the cached response data without querying or serializing.
+    """
+    conditional_models = None
+
+    def get_conditional_models(self):
+        return self.conditional_models or [self.queryset.model]
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        states = [versions.current(model) for model in self.get_conditional_models()]
+        key = "|".join([request.build_absolute_uri(), request.accepted_media_type or ""] + [str(v) for v, _ in states])
+        etag = f'"{hashlib.sha1(key.encode()).hexdigest()[:16]}"'
+        last_modified = max(modified for _, modified in states)
+        response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if response is None:
+            data = cache.get(f"http:{etag}")
+            if data is None:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                cache.set(f"http:{etag}", response.data, REFERENCE_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, max_age=REFERENCE_MAX_AGE)
+        return response
+
+
+class BulkModelViewSetMixin:
+    """
+    ``/bulk/`` endpoint taking lists: POST creates, PATCH partially updates (items carry ``id``)
+    and DELETE removes (a list of ids). Items are validated by one serializer instance with
+    related objects and unique values looked up once per batch, valid items are written with
+    ``bulk_create`` / ``bulk_update`` in one transaction, and every item gets its own status.
+    Bulk writes send no model signals: override ``bulk_changed()`` for side effects.
+    With ``bulk_upsert_fields`` (a unique constraint's fields), POST updates the row that
+    already has the same values instead of failing.
+    """
+    bulk_upsert_fields = None
+
+    @action(detail=False, methods=['post', 'patch', 'delete'], url_path='bulk')
+    def bulk(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            return Response({"detail": "Expected a list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > BULK_MAX_ITEMS:
+            return Response({"detail": f"At most {BULK_MAX_ITEMS} items per request."}, status=status.HTTP_400_BAD_REQUEST)
+        if request.method == 'POST':
+            results = self.bulk_create(items)
+        elif request.method == 'PATCH':
+            results = self.bulk_update(items)
+        else:
+            results = self.bulk_destroy(items)
+        done = sum(1 for result in results if result["status"] != "error")
+        if done == len(results):
+            code = status.HTTP_201_CREATED if request.method == 'POST' else status.HTTP_200_OK
+        elif done:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response({"ok": done, "errors": len(results) - done, "results": results}, status=code)
+
+    def bulk_changed(self, instances):
+        """Called with the affected rows before (update) and after (create, update) a bulk write."""
+
+    def bulk_prepare(self, instances):
+        """Fill derived columns that ``save()`` would have set; returns the extra field names to write."""
+        return ()
+
+    def get_bulk_serializer(self, items, partial=False):
+        serializer = self.get_serializer(partial=partial)
+        self._prefetch_relations(serializer, items)
+        return serializer
+
+    def _prefetch_relations(self, serializer, items):
+        # One in_bulk() per relation instead of a get() per item and field
+        for name, field in serializer.fields.items():
+            relation = field.child_relation if isinstance(field, ManyRelatedField) else field
+            if field.read_only or not isinstance(relation, PrimaryKeyRelatedField):
+                continue
+            wanted = set()
+            for item in items:
+                values = item.get(name) if isinstance(item, dict) else None
+                for value in (values if isinstance(values, list) else [values]):
+                    if isinstance(value, (int, str)) and not isinstance(value, bool) and str(value).isdigit():
+                        wanted.add(int(value))
+            objects = relation.get_queryset().in_bulk(wanted) if wanted else {}
+            relation.to_internal_value = _cached_lookup(relation, objects)
+
+    def _unique_fields(self, serializer):
+        # Single-column unique checks are done per batch (see _validate_items) rather than per item
+        unique = []
+        for name, field in serializer.fields.items():
+            validators = [v for v in field.validators if isinstance(v, UniqueValidator)]
+            if validators:
+                field.validators = [v for v in field.validators if not isinstance(v, UniqueValidator)]
+                unique.append((name, field.source))
+        return unique
+
+    def _validate_items(self, serializer, items, instances=None):
+        unique = self._unique_fields(serializer)
+        if self.bulk_upsert_fields and instances is None:
+            # Conflicts are resolved by the upsert, not reported
+            serializer.validators = [
+                v for v in serializer.validators
+                if not (isinstance(v, UniqueTogetherValidator) and set(v.fields) == set(self.bulk_upsert_fields))
+            ]
+        validated = {}
+        errors = {}
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                errors[index] = {"non_field_errors": ["Expected an object."]}
+                continue
+            serializer.instance = instances[index] if instances else None
+            try:
+                validated[index] = serializer.run_validation(item)
+            except ValidationError as exc:
+                errors[index] = exc.detail
+        model = serializer.Meta.model
+        for name, source in unique:
+            values = {}
+            for index, data in validated.items():
+                if source in data:
+                    values.setdefault(_unique_value(data[source]), []).append(index)
+            taken = model._default_manager.filter(**{f"{source}__in": list(values)}).values_list(source, 'pk')
+            for value, pk in taken:
+                for index in values.get(value, []):
+                    if not instances or instances[index].pk != pk:
+                        errors[index] = {name: [f"{model._meta.verbose_name} with this {name} already exists."]}
+            for indexes in values.values():
+                for index in indexes[1:]:
+                    errors[index] = {name: ["Duplicate value in this request."]}
+        for fields in _unique_together(model):
+            if not instances and set(fields) == set(self.bulk_upsert_fields or ()):
+                continue  # later items win, see bulk_create
+            seen = {}
+            for index, data in validated.items():
+                if index in errors:
+                    continue
+                key = []
+                for name in fields:
+                    if name in data:
+                        key.append(_unique_value(data[name]))
+                    elif instances:
+                        key.append(getattr(instances[index], model._meta.get_field(name).attname))
+                    else:
+                        break
+                else:
+                    key = tuple(key)
+                    if key in seen:
+                        errors[index] = {"non_field_errors": [f"Duplicate {', '.join(fields)} in this request."]}
+                    else:
+                        seen[key] = index
+        for index in errors:
+            validated.pop(index, None)
+        return validated, errors
+
+    def _write(self, instances, write, errors):
+        """
+        Write ``{index: instance}`` with ``write`` in one transaction. If the database still rejects
+        the batch (a constraint the validation could not see, a concurrent write), write the items
+        one by one so only the offending ones fail. Returns the written instances.
+        """
+        try:
+            with transaction.atomic():
+                write(instances)
+            return instances
+        except IntegrityError:
+            pass
+        written = {}
+        for index, instance in instances.items():
+            try:
+                with transaction.atomic():
+                    write({index: instance})
+            except IntegrityError:
+                errors[index] = {"non_field_errors": ["This item conflicts with existing data."]}
+            else:
+                written[index] = instance
+        return written
+
+    def bulk_create(self, items):
+        serializer = self.get_bulk_serializer(items)
+        validated, errors = self._validate_items(serializer, items)
+        model = serializer.Meta.model
+        many = {field.name for field in model._meta.many_to_many}
+        instances = {}
+        relations = {}
+        for index, data in validated.items():
+            data = dict(data)
+            relations[index] = {name: data.pop(name) for name in many if name in data}
+            instances[index] = model(**data)
+        self.bulk_prepare(list(instances.values()))
+        options = {}
+        if self.bulk_upsert_fields:
+            keys = {}
+            for index, instance in instances.items():
+                key = tuple(getattr(instance, model._meta.get_field(name).attname) for name in self.bulk_upsert_fields)
+                if key in keys:
+                    errors[keys[key]] = {"non_field_errors": ["Overridden by a later item with the same "
+                                                              + ", ".join(self.bulk_upsert_fields) + "."]}
+                keys[key] = index
+            instances = {index: instance for index, instance in instances.items() if index not in errors}
+            options = {
+                "update_conflicts": True,
+                "unique_fields": list(self.bulk_upsert_fields),
+                "update_fields": [f.name for f in model._meta.concrete_fields
+                                  if not f.primary_key and f.name not in self.bulk_upsert_fields],
+            }
+
+        def write(batch):
+            for instance in batch.values():
+                instance.pk = None  # a failed batch may have assigned some
+            model._default_manager.bulk_create(list(batch.values()), batch_size=BULK_BATCH_SIZE, **options)
+            self._set_many(model, batch, {index: relations[index] for index in batch}, replace=bool(options))
+        instances = self._write(instances, write, errors)
+        self._bulk_done(model, list(instances.values()))
+        return _results(items, errors, {index: ("created", obj.pk) for index, obj in instances.items()})
+
+    def bulk_update(self, items):
+        errors = {}
+        ids = {}
+        for index, item in enumerate(items):
+            pk = item.get('id') if isinstance(item, dict) else None
+            if isinstance(pk, bool) or not isinstance(pk, int):
+                errors[index] = {"id": ["This field is required."] if pk is None else ["Expected an integer id."]}
+            else:
+                ids[index] = pk
+        existing = self.get_queryset().in_bulk(set(ids.values()))
+        for index, pk in ids.items():
+            if pk not in existing:
+                errors[index] = {"id": [f'Invalid pk "{pk}" - object does not exist.']}
+        wanted = [index for index in ids if index not in errors]
+        seen = set()
+        for index in wanted:
+            if ids[index] in seen:
+                errors[index] = {"id": ["Duplicate id in this request."]}
+            seen.add(ids[index])
+        wanted = [index for index in wanted if index not in errors]
+
+        batch = [{k: v for k, v in items[index].items() if k != 'id'} for index in wanted]
+        instances = [existing[ids[index]] for index in wanted]
+        serializer = self.get_bulk_serializer(batch, partial=True)
+        validated, batch_errors = self._validate_items(serializer, batch, instances)
+        for position, detail in batch_errors.items():
+            errors[wanted[position]] = detail
+
+        model = serializer.Meta.model
+        many = {field.name for field in model._meta.many_to_many}
+        changed = {wanted[position]: instances[position] for position in validated}
+        self.bulk_changed(list(changed.values()))
+        fields = set()
+        relations = {}
+        for position, data in validated.items():
+            instance = instances[position]
+            relations[wanted[position]] = {name: value for name, value in data.items() if name in many}
+            for name, value in data.items():
+                if name not in many:
+                    setattr(instance, name, value)
+                    fields.add(model._meta.get_field(name).name)
+        fields |= set(self.bulk_prepare(list(changed.values())))
+
+        def write(batch):
+            if fields:
+                model._default_manager.bulk_update(list(batch.values()), sorted(fields), batch_size=BULK_BATCH_SIZE)
+            self._set_many(model, batch, {index: relations[index] for index in batch}, replace=True)
+        changed = self._write(changed, write, errors)
+        self._bulk_done(model, list(changed.values()))
+        return _results(items, errors, {index: ("updated", obj.pk) for index, obj in changed.items()})
+
+    def bulk_destroy(self, items):
+        errors = {}
+        ids = {}
+        for index, pk in enumerate(items):
+            if isinstance(pk, bool) or not isinstance(pk, int):
+                errors[index] = {"id": ["Expected an integer id."]}
+            else:
+                ids[index] = pk
+        existing = self.get_queryset().in_bulk(set(ids.values()))
+        for index, pk in ids.items():
+            if pk not in existing:
+                errors[index] = {"id": [f'Invalid pk "{pk}" - object does not exist.']}
+        deleted = {index: ("deleted", pk) for index, pk in ids.items() if index not in errors}
+        model = self.get_queryset().model
+        with transaction.atomic():
+            # Deletion goes through the collector, so cascades and delete signals still happen
+            model._default_manager.filter(pk__in=[pk for _, pk in deleted.values()]).delete()
+        transaction.on_commit(lambda: versions.bump(model), robust=True)
+        return _results(items, errors, deleted)
+
+    def _set_many(self, model, instances, relations, replace):
+        for field in model._meta.many_to_many:
+            through = getattr(model, field.name).through
+            source = field.m2m_field_name()
+            target = field.m2m_reverse_field_name()
+            rows = []
+            touched = []
+            for index, values in relations.items():
+                if field.name not in values:
+                    continue
+                touched.append(instances[index].pk)
+                rows += [through(**{f"{source}_id": instances[index].pk, f"{target}_id": value.pk})
+                         for value in values[field.name]]
+            if replace and touched:
+                through.objects.filter(**{f"{source}_id__in": touched}).delete()
+            through.objects.bulk_create(rows, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+
+    def _bulk_done(self, model, instances):
+        if instances:
+            self.bulk_changed(instances)
+            transaction.on_commit(lambda: versions.bump(model), robust=True)
+
+
+def _cached_lookup(field, objects):
+    def to_internal_value(data):
+        if isinstance(data, bool) or not isinstance(data, (int, str)):
+            field.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return objects[int(data)]
+        except (KeyError, ValueError):
+            field.fail('does_not_exist', pk_value=data)
+    return to_internal_value
+
+
+def _unique_together(model):
+    """Field-name tuples of the multi-column unique constraints of ``model``."""
+    sets = [tuple(fields) for fields in model._meta.unique_together]
+    for constraint in model._meta.constraints:
+        if isinstance(constraint, UniqueConstraint) and len(constraint.fields) > 1 \
+                and constraint.condition is None and not constraint.expressions:
+            sets.append(tuple(constraint.fields))
+    return sets
+
+
+def _unique_value(value):
+    return getattr(value, 'pk', value)
+
+
+def _results(items, errors, done):
+    results = []
+    for index in range(len(items)):
+        if index in errors:
+            results.append({"index": index, "status": "error", "errors": errors[index]})
+        else:
+            state, pk = done[index]
+            results.append({"index": index, "status": state, "id": pk})
+    return results
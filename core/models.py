@@ -1,5 +1,17 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
+from .geo import geohash_encode
+
+
+def sync_geohash(instance, save_kwargs):
+    """Recompute ``instance.geohash`` from its coordinates; returns the save() kwargs to use."""
+    latitude, longitude = instance.latitude, instance.longitude
+    instance.geohash = '' if latitude is None or longitude is None else geohash_encode(float(latitude), float(longitude))
+    update_fields = save_kwargs.get('update_fields')
+    if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+        save_kwargs['update_fields'] = set(update_fields) | {'geohash'}
+    return save_kwargs
 
 # Bus Model
 class Bus(models.Model):
@@ -8,6 +20,11 @@ class Bus(models.Model):
     number = models.CharField(max_length=20)
     capacity = models.IntegerField()
     status = models.CharField(max_length=20, default='active')
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'title']),
+            models.Index(fields=['title']),
+        ]
     def __str__(self):
         return self.title
 
@@ -57,10 +74,22 @@ class Student(models.Model):
     qrcode = models.CharField(max_length=255, null=True, blank=True)
     latitude = models.DecimalField(max_digits=10, decimal_places=8, null=True, blank=True)
     longitude = models.DecimalField(max_digits=11, decimal_places=8, null=True, blank=True)
+    # Pickup location as a geohash, kept in sync by save() (see core.nearby)
+    geohash = models.CharField(max_length=12, blank=True, default='', db_index=True, editable=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['lname', 'fname']),
+            models.Index(fields=['student_class', 'lname']),
+            models.Index(fields=['reg_code_status', 'lname']),
+            models.Index(fields=['registration_code']),
+        ]
     def __str__(self):
         return f"{self.fname} {self.lname}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **sync_geohash(self, kwargs))
+
 
 # Guardian Model
 class Guardian(models.Model):
@@ -75,6 +104,15 @@ class Attendance(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     date = models.DateField()
     status = models.CharField(max_length=10)  # Present/Absent
+    class Meta:
+        constraints = [
+            # One row per student and day, so re-marking (or retrying) upserts; also serves (student, date) lookups
+            models.UniqueConstraint(fields=['student', 'date'], name='attendance_student_date_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'status']),
+            models.Index(fields=['status', 'date']),
+        ]
     def __str__(self):
         return f"{self.student} - {self.date}"
 
@@ -83,6 +121,10 @@ class Announcement(models.Model):
     title = models.CharField(max_length=100)
     message = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
     def __str__(self):
         return self.title
 
@@ -109,9 +151,17 @@ class BusRoutePoint(models.Model):
     latitude = models.FloatField(default=0.0)
     longitude = models.FloatField(default=0.0)
     order = models.IntegerField(default=0)
+    geohash = models.CharField(max_length=12, blank=True, default='', db_index=True, editable=False)
+    class Meta:
+        indexes = [
+            models.Index(fields=['route', 'order']),
+        ]
     def __str__(self):
         return self.location_name
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **sync_geohash(self, kwargs))
+
 # Trip Model
 class Trip(models.Model):
     bus = models.ForeignKey(Bus, on_delete=models.CASCADE)
@@ -119,6 +169,11 @@ class Trip(models.Model):
     date = models.DateField()
     start_time = models.TimeField()
     end_time = models.TimeField()
+    class Meta:
+        indexes = [
+            models.Index(fields=['bus', 'date', 'start_time']),
+            models.Index(fields=['date', 'start_time']),
+        ]
     def __str__(self):
         return f"{self.bus} - {self.date}"
 
@@ -134,6 +189,11 @@ class Feedback(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     message = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
     def __str__(self):
         return f"Feedback by {self.user.username}"
 
@@ -143,6 +203,12 @@ class MaintenanceLog(models.Model):
     maintenance_type = models.CharField(max_length=50)
     description = models.TextField()
     date = models.DateField()
+    class Meta:
+        indexes = [
+            models.Index(fields=['bus', 'date']),
+            models.Index(fields=['maintenance_type', 'date']),
+            models.Index(fields=['date']),
+        ]
     def __str__(self):
         return f"{self.bus} - {self.maintenance_type}"
 
@@ -152,14 +218,41 @@ class Notification(models.Model):
     message = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     bus = models.ForeignKey(Bus, on_delete=models.SET_NULL, null=True, blank=True)
+    class Meta:
+        indexes = [
+            models.Index(fields=['bus', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
     def __str__(self):
         return self.title
 
+# Per-recipient inbox row of a Notification (written in bulk by the fan-out task)
+class NotificationRecipient(models.Model):
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='recipients')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inbox')
+    read_at = models.DateTimeField(null=True, blank=True)
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['notification', 'user'], name='notification_recipient_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-id']),
+            # Unread inbox: user_id = ? AND read_at IS NULL ORDER BY id DESC
+            models.Index(fields=['user', 'read_at', '-id']),
+        ]
+    def __str__(self):
+        return f"{self.notification} -> {self.user.username}"
+
 # Reminder Model
 class Reminder(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     message = models.CharField(max_length=200)
     remind_at = models.DateTimeField()
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'remind_at']),
+            models.Index(fields=['remind_at']),
+        ]
     def __str__(self):
         return f"Reminder for {self.user.username}"
 
@@ -170,13 +263,61 @@ class GPSTracking(models.Model):
     bus = models.ForeignKey(Bus, on_delete=models.CASCADE)
     latitude = models.DecimalField(max_digits=10, decimal_places=8, default=0.0)
     longitude = models.DecimalField(max_digits=11, decimal_places=8, default=0.0)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Devices may report the fix time (batched uploads); defaults to the server time
+    timestamp = models.DateTimeField(default=timezone.now)
+    class Meta:
+        indexes = [
+            models.Index(fields=['bus', '-timestamp'], name='gps_bus_timestamp_idx'),
+            models.Index(fields=['timestamp']),
+        ]
+    def __str__(self):
+        return f"{self.bus} @ {self.timestamp}"
+
+# Bus Location Model
+# Last known position per bus, kept up to date on GPS ingest so "where is bus X"
+# never has to scan the GPSTracking history.
+class BusLocation(models.Model):
+    bus = models.OneToOneField(Bus, on_delete=models.CASCADE, primary_key=True, related_name='location')
+    latitude = models.DecimalField(max_digits=10, decimal_places=8)
+    longitude = models.DecimalField(max_digits=11, decimal_places=8)
+    timestamp = models.DateTimeField()
     def __str__(self):
         return f"{self.bus} @ {self.timestamp}"
 
+# GPS Daily Summary Model
+# Per bus and day roll-up written by the GPS retention job before raw fixes are thinned out
+class GPSDailySummary(models.Model):
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE)
+    date = models.DateField()
+    points = models.IntegerField(default=0)  # raw fixes before downsampling
+    kept = models.IntegerField(default=0)  # fixes left after downsampling
+    first_timestamp = models.DateTimeField(null=True, blank=True)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    min_latitude = models.DecimalField(max_digits=10, decimal_places=8, null=True, blank=True)
+    max_latitude = models.DecimalField(max_digits=10, decimal_places=8, null=True, blank=True)
+    min_longitude = models.DecimalField(max_digits=11, decimal_places=8, null=True, blank=True)
+    max_longitude = models.DecimalField(max_digits=11, decimal_places=8, null=True, blank=True)
+    distance = models.FloatField(default=0.0)  # meters
+    complete = models.BooleanField(default=False)  # False: late fixes arrived after the roll-up
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bus', 'date'], name='gps_summary_bus_date_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['date']),
+            # Days reopened by late fixes
+            models.Index(fields=['bus', 'complete', 'date']),
+        ]
+    def __str__(self):
+        return f"{self.bus} - {self.date}"
+
 # Class Model
 class Class(models.Model):
     name = models.CharField(max_length=50)
     grade = models.CharField(max_length=20)
+    class Meta:
+        indexes = [
+            models.Index(fields=['name']),
+        ]
     def __str__(self):
         return self.name
@@ -0,0 +1,85 @@
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db.models import Q
+from .geo import geohash_cover, haversine
+from .geometry import get_geometry
+from .live import current_route, current_trip, get_position
+from .models import Bus, BusRoutePoint, Student
+
+# Upper bound on the radius of proximity searches, in meters
+NEARBY_MAX_RADIUS = getattr(settings, 'NEARBY_MAX_RADIUS', 20000)
+
+
+def in_cells(queryset, latitude, longitude, radius):
+    """
+    Narrow ``queryset`` to the geohash cells covering the circle, as index range scans.
+    Ranges rather than ``startswith``: a ``LIKE 'cell%'`` is not served by the index on SQLite,
+    nor on PostgreSQL outside the C collation. Every geohash character sorts before ``~``.
+    """
+    cells = geohash_cover(latitude, longitude, radius)
+    if not cells:
+        return queryset
+    return queryset.filter(reduce(or_, (Q(geohash__gte=cell, geohash__lt=cell + '~') for cell in cells)))
+
+
+def _within(queryset, latitude, longitude, radius):
+    """
+    Rows of ``queryset`` (with latitude/longitude/geohash columns) within ``radius`` meters,
+    nearest first, as ``(distance, row)`` pairs. The geohash prefixes narrow the scan to
+    a few index ranges; haversine then drops the corners of those cells.
+    """
+    found = []
+    for row in in_cells(queryset, latitude, longitude, radius):
+        distance = haversine(latitude, longitude, float(row.latitude), float(row.longitude))
+        if distance <= radius:
+            found.append((distance, row))
+    found.sort(key=lambda pair: pair[0])
+    return found
+
+
+def stops_near(latitude, longitude, radius, route_id=None):
+    stops = BusRoutePoint.objects.exclude(geohash='')
+    if route_id is not None:
+        stops = stops.filter(route_id=route_id)
+    return _within(stops, latitude, longitude, radius)
+
+
+def students_near(latitude, longitude, radius, bus_id=None):
+    """Students whose pickup location is within ``radius``; only those assigned to ``bus_id`` if given."""
+    students = Student.objects.exclude(geohash='').only('id', 'fname', 'lname', 'latitude', 'longitude', 'geohash')
+    if bus_id is not None:
+        students = students.filter(busassignment__bus_id=bus_id).distinct()
+    return _within(students, latitude, longitude, radius)
+
+
+def bus_coordinates(bus_id):
+    """Last known ``(lat, lon)`` of a bus, or None."""
+    position = get_position(bus_id)
+    if not position or not position["coordinates"]:
+        return None
+    lon, lat = position["coordinates"]
+    return lat, lon
+
+
+def next_stop(bus_id):
+    """
+    The stop of the bus's current route it is heading to, as ``(stop, distance)``, or None.
+    The nearest stop counts as already served when the bus is closer to the following
+    stop than the nearest stop is.
+    """
+    coordinates = bus_coordinates(bus_id)
+    if coordinates is None:
+        return None
+    bus = Bus(id=bus_id)
+    route = current_route(bus, current_trip(bus))
+    geometry = get_geometry(route.id) if route else None
+    if not geometry:
+        return None
+    distances = geometry.distances(*coordinates)
+    nearest = min(range(len(distances)), key=distances.__getitem__)
+    if nearest + 1 < len(distances):
+        gap = geometry.cumulative[nearest + 1] - geometry.cumulative[nearest]
+        if distances[nearest + 1] < gap:
+            nearest += 1
+    return geometry.stop(nearest), distances[nearest]
@@ -0,0 +1,158 @@
+# Offline route optimization: stop ordering and student-to-bus assignment.
+# Pure functions over plain (lat, lon) tuples, no ORM, so work can be shipped to a process pool;
+# the optimize_routes management command loads the data and applies the results.
+import math
+from concurrent.futures import ProcessPoolExecutor
+from .geo import haversine
+
+# Segments of up to this many stops are tried at every other position by or-opt
+OR_OPT_SEGMENT = 3
+
+
+def distance_matrix(points, others=None):
+    """Great-circle distances in meters from every point to every point of ``others`` (default: itself)."""
+    others = points if others is None else others
+    if not points or not others:
+        return [[] for _ in points]
+    return [[haversine(lat, lon, other_lat, other_lon) for other_lat, other_lon in others] for lat, lon in points]
+
+
+def path_length(order, matrix):
+    return sum(matrix[a][b] for a, b in zip(order, order[1:]))
+
+
+def nearest_neighbour(matrix, start=0):
+    """Greedy open path from ``start``: always drive to the closest stop not visited yet."""
+    left = set(range(len(matrix))) - {start}
+    order = [start]
+    while left:
+        here = matrix[order[-1]]
+        order.append(min(left, key=here.__getitem__))
+        left.remove(order[-1])
+    return order
+
+
+def two_opt(order, matrix):
+    """Reverse sub-paths while that shortens the open path; the first stop stays first."""
+    order = list(order)
+    n = len(order)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                a, b, c = order[i - 1], order[i], order[j]
+                delta = matrix[a][c] - matrix[a][b]
+                if j + 1 < n:
+                    d = order[j + 1]
+                    delta += matrix[b][d] - matrix[c][d]
+                if delta < -1e-9:
+                    order[i:j + 1] = reversed(order[i:j + 1])
+                    improved = True
+    return order
+
+
+def or_opt(order, matrix):
+    """Move runs of 1..OR_OPT_SEGMENT stops elsewhere in the path while that shortens it."""
+    order = list(order)
+    improved = True
+    while improved:
+        improved = False
+        for size in range(1, OR_OPT_SEGMENT + 1):
+            for i in range(1, len(order) - size + 1):
+                first, last = order[i], order[i + size - 1]
+                prev = order[i - 1]
+                following = order[i + size] if i + size < len(order) else None
+                gain = matrix[prev][first]
+                if following is not None:
+                    gain += matrix[last][following] - matrix[prev][following]
+                rest = order[:i] + order[i + size:]
+                for j in range(1, len(rest) + 1):
+                    if j == i:
+                        continue
+                    p = rest[j - 1]
+                    q = rest[j] if j < len(rest) else None
+                    cost = matrix[p][first] + (matrix[last][q] - matrix[p][q] if q is not None else 0)
+                    if cost < gain - 1e-9:
+                        order = rest[:j] + order[i:i + size] + rest[j:]
+                        improved = True
+                        break
+                if improved:
+                    break
+            if improved:
+                break
+    return order
+
+
+def improve(order, matrix):
+    """Alternate 2-opt and or-opt until neither finds a shorter path."""
+    length = path_length(order, matrix)
+    while True:
+        order = or_opt(two_opt(order, matrix), matrix)
+        new_length = path_length(order, matrix)
+        if new_length >= length - 1e-9:
+            return order
+        length = new_length
+
+
+def optimize_stops(points):
+    """
+    Suggest a visiting order for ``points`` (``(lat, lon)`` in the current order; the first one is
+    the fixed start). Returns ``(order, length_before, length_after)``; never worse than the current order.
+    """
+    if len(points) < 3:
+        order = list(range(len(points)))
+        length = path_length(order, distance_matrix(points))
+        return order, length, length
+    matrix = distance_matrix(points)
+    current = list(range(len(points)))
+    before = path_length(current, matrix)
+    candidates = [improve(nearest_neighbour(matrix), matrix), improve(current, matrix)]
+    order = min(candidates, key=lambda candidate: path_length(candidate, matrix))
+    return order, before, path_length(order, matrix)
+
+
+def optimize_many(routes, workers=None):
+    """``optimize_stops`` for every list of points in ``routes``, on a process pool when ``workers`` != 1."""
+    if workers == 1 or len(routes) < 2:
+        return [optimize_stops(points) for points in routes]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(optimize_stops, routes, chunksize=max(1, len(routes) // 32)))
+
+
+def walking_distances(students, buses):
+    """For every student, the distance to the nearest stop of each bus (``math.inf`` for a bus without stops)."""
+    stops = [stop for _, bus_stops in buses for stop in bus_stops]
+    matrix = distance_matrix(students, stops)
+    rows = []
+    for distances in matrix:
+        row = []
+        offset = 0
+        for _, bus_stops in buses:
+            row.append(min(distances[offset:offset + len(bus_stops)]) if bus_stops else math.inf)
+            offset += len(bus_stops)
+        rows.append(row)
+    return rows
+
+
+def assign_students(students, buses):
+    """
+    Capacity-aware assignment of students (``(lat, lon)`` homes) to buses (``(capacity, stops)``)
+    minimizing the walk to the nearest stop. Students who would lose the most by not getting
+    their best bus (largest regret) pick first. Returns ``(bus index or None, distance)`` per student.
+    """
+    distances = walking_distances(students, buses)
+    left = [capacity for capacity, _ in buses]
+
+    def regret(i):
+        best = sorted(distances[i])[:2]
+        return (best[1] - best[0]) if len(best) == 2 and best[1] != math.inf else math.inf
+
+    result = [(None, None)] * len(students)
+    for i in sorted(range(len(students)), key=regret, reverse=True):
+        options = sorted((d, b) for b, d in enumerate(distances[i]) if left[b] > 0 and d != math.inf)
+        if options:
+            distance, bus = options[0]
+            left[bus] -= 1
+            result[i] = (bus, distance)
+    return result
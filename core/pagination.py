@@ -0,0 +1,34 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class StandardPagination(PageNumberPagination):
+    """Default pagination: ``?page=`` plus a client-selected ``?page_size=`` up to 100."""
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class TimeCursorPagination(CursorPagination):
+    """
+    Keyset pagination for large append-only tables: no COUNT(*) and no OFFSET scan,
+    so deep pages cost the same as the first one. ``?page_size=`` up to 500.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class GPSTrackingPagination(TimeCursorPagination):
+    ordering = ('-timestamp', '-id')
+
+
+class AttendancePagination(TimeCursorPagination):
+    # Many rows share a date, so the key is the insertion order rather than the date
+    ordering = '-id'
+
+
+class NotificationPagination(TimeCursorPagination):
+    ordering = ('-created_at', '-id')
+
+
+class InboxPagination(TimeCursorPagination):
+    # Inbox rows are written in notification order, so the id is the time key
+    ordering = '-id'
@@ -0,0 +1,157 @@
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .geo import haversine
+from .models import Bus, GPSTracking, GPSDailySummary
+
+# Full resolution is kept for this many days, older fixes are thinned to one per interval
+GPS_RAW_DAYS = getattr(settings, 'GPS_RAW_DAYS', 7)
+GPS_DOWNSAMPLE_SECONDS = getattr(settings, 'GPS_DOWNSAMPLE_SECONDS', 30)
+# Downsampled fixes older than this are dropped entirely (None keeps them forever)
+GPS_HISTORY_DAYS = getattr(settings, 'GPS_HISTORY_DAYS', None)
+# Rows read or deleted per statement (each bus-day is one transaction)
+GPS_RETENTION_BATCH = getattr(settings, 'GPS_RETENTION_BATCH', 5000)
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _delete_ids(ids, batch_size):
+    # GPSTracking has post_delete receivers, so QuerySet.delete() would load and signal
+    # every row. Pruned fixes are never needed by them (BusLocation keeps its own copy)
+    # and nothing references GPSTracking, so a plain DELETE is enough.
+    table = connection.ops.quote_name(GPSTracking._meta.db_table)
+    column = connection.ops.quote_name(GPSTracking._meta.pk.column)
+    # One bound parameter per id: stay under the backend's limit (999 on SQLite before 3.32)
+    batch_size = min(batch_size, connection.features.max_query_params or batch_size)
+    with connection.cursor() as cursor:
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({', '.join(['%s'] * len(batch))})", batch)
+
+
+def downsample_day(bus_id, day, interval=GPS_DOWNSAMPLE_SECONDS, batch_size=GPS_RETENTION_BATCH):
+    """
+    Roll up one bus-day into GPSDailySummary, then keep only the first fix of every
+    ``interval`` seconds. The summary and the deletes commit together, so an interrupted
+    run leaves the day untouched. Running it again on a rolled-up day (late fixes) merges
+    the new fixes into the summary.
+    """
+    start = _day_start(day)
+    fixes = GPSTracking.objects.filter(
+        bus_id=bus_id, timestamp__gte=start, timestamp__lt=start + timedelta(days=1)
+    ).order_by('timestamp', 'id').values_list('id', 'timestamp', 'latitude', 'longitude')
+
+    with transaction.atomic():
+        summary, _ = GPSDailySummary.objects.select_for_update().get_or_create(bus_id=bus_id, date=day)
+        count = 0
+        distance = 0.0
+        drop = []
+        previous = None
+        last_bucket = None
+        first_timestamp = last_timestamp = None
+        lats, lons = [], []
+        for fix_id, timestamp, latitude, longitude in fixes.iterator(chunk_size=batch_size):
+            count += 1
+            bucket = int(timestamp.timestamp()) // interval
+            if bucket == last_bucket:
+                drop.append(fix_id)
+            last_bucket = bucket
+            if previous is not None:
+                distance += haversine(float(previous[0]), float(previous[1]), float(latitude), float(longitude))
+            else:
+                first_timestamp = timestamp
+            previous = (latitude, longitude)
+            last_timestamp = timestamp
+            lats.append(latitude)
+            lons.append(longitude)
+
+        if count:
+            # Fixes dropped by earlier passes over the day are gone: add only what arrived since,
+            # and keep the longer of the recorded and the recomputed path
+            summary.points += max(count - summary.kept, 0)
+            summary.distance = max(summary.distance, distance)
+            summary.first_timestamp = _merge(min, summary.first_timestamp, first_timestamp)
+            summary.last_timestamp = _merge(max, summary.last_timestamp, last_timestamp)
+            summary.min_latitude = _merge(min, summary.min_latitude, *lats)
+            summary.max_latitude = _merge(max, summary.max_latitude, *lats)
+            summary.min_longitude = _merge(min, summary.min_longitude, *lons)
+            summary.max_longitude = _merge(max, summary.max_longitude, *lons)
+        _delete_ids(drop, batch_size)
+        summary.kept = count - len(drop)
+        summary.complete = True
+        summary.save()
+    return summary, len(drop)
+
+
+def _merge(function, *values):
+    return function(value for value in values if value is not None)
+
+
+def reopen_days(fixes):
+    """
+    Flag the days that ``fixes`` arrived late for, so the next run processes them (again):
+    rolled-up days are reopened, and days before a bus's last rolled-up day get an empty summary.
+    """
+    today = timezone.localdate()
+    late = {}
+    for fix in fixes:
+        day = timezone.localtime(fix.timestamp).date()
+        if day < today:
+            late.setdefault(fix.bus_id, set()).add(day)
+    for bus_id, days in late.items():
+        last = GPSDailySummary.objects.filter(bus_id=bus_id).order_by('-date').values_list('date', flat=True).first()
+        days = [day for day in days if last is not None and day <= last]
+        if not days:
+            continue
+        GPSDailySummary.objects.bulk_create(
+            [GPSDailySummary(bus_id=bus_id, date=day) for day in days], ignore_conflicts=True)
+        GPSDailySummary.objects.filter(bus_id=bus_id, date__in=days, complete=True).update(complete=False)
+
+
+def enforce_retention(raw_days=GPS_RAW_DAYS, interval=GPS_DOWNSAMPLE_SECONDS, history_days=GPS_HISTORY_DAYS,
+                      batch_size=GPS_RETENTION_BATCH, now=None):
+    """
+    Apply the GPS retention policy to every bus, oldest day first.
+    Returns ``{"days": <bus-days rolled up>, "downsampled": <fixes thinned>, "expired": <fixes past history_days>}``.
+    """
+    if history_days is not None and history_days < raw_days:
+        raise ValueError("history_days must not be shorter than raw_days.")
+    today = timezone.localdate(now)
+    cutoff = _day_start(today - timedelta(days=raw_days))
+    stats = {"days": 0, "downsampled": 0, "expired": 0}
+
+    for bus_id in Bus.objects.values_list('id', flat=True):
+        # Days reopened by late fixes (reopen_days), then every day after the last rolled-up one
+        reopened = GPSDailySummary.objects.filter(bus_id=bus_id, complete=False, date__lt=cutoff.date()) \
+            .order_by('date').values_list('date', flat=True)
+        for day in reopened:
+            _, dropped = downsample_day(bus_id, day, interval, batch_size)
+            stats["days"] += 1
+            stats["downsampled"] += dropped
+        last = GPSDailySummary.objects.filter(bus_id=bus_id).order_by('-date').values_list('date', flat=True).first()
+        while True:
+            pending = GPSTracking.objects.filter(bus_id=bus_id, timestamp__lt=cutoff)
+            if last:
+                pending = pending.filter(timestamp__gte=_day_start(last + timedelta(days=1)))
+            first = pending.order_by('timestamp').values_list('timestamp', flat=True).first()
+            if first is None:
+                break
+            last = timezone.localtime(first).date()
+            _, dropped = downsample_day(bus_id, last, interval, batch_size)
+            stats["days"] += 1
+            stats["downsampled"] += dropped
+
+        if history_days is not None:
+            expired = GPSTracking.objects.filter(
+                bus_id=bus_id, timestamp__lt=_day_start(today - timedelta(days=history_days))
+            )
+            while True:
+                ids = list(expired.values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                _delete_ids(ids, batch_size)
+                stats["expired"] += len(ids)
+    return stats
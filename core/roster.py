@@ -0,0 +1,250 @@
+import csv
+import io
+import tempfile
+from datetime import datetime
+from itertools import islice
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.core.files.storage import default_storage
+from django.db import models
+from django.http import FileResponse, StreamingHttpResponse
+from openpyxl import Workbook, load_workbook
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.response import Response
+from . import tasks
+
+# Rows fetched per query on export / validated and committed per transaction on import
+ROSTER_CHUNK_SIZE = getattr(settings, 'ROSTER_CHUNK_SIZE', 1000)
+# Import reports keep only this many row errors (plus the total count)
+ROSTER_MAX_ERRORS = getattr(settings, 'ROSTER_MAX_ERRORS', 100)
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# Many-to-many values share one cell
+MANY_SEPARATOR = ';'
+
+
+def roster_columns(serializer, model):
+    """
+    ``(name, model field)`` of every writable, non-file serializer field backed by a model field,
+    with ``id`` first, so an exported file can be edited and imported back.
+    """
+    columns = [('id', model._meta.pk)]
+    for name, field in serializer.fields.items():
+        if field.read_only or name == 'id':
+            continue
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            continue
+        if isinstance(model_field, models.FileField):
+            continue
+        columns.append((name, model_field))
+    return columns
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_rows(queryset, columns, chunk_size=ROSTER_CHUNK_SIZE):
+    """Yield one list of cell values per row, reading ``chunk_size`` rows per query."""
+    plain = [field.attname for _, field in columns if not field.many_to_many]
+    many = [field for _, field in columns if field.many_to_many]
+    rows = queryset.order_by('pk').values_list(*plain).iterator(chunk_size=chunk_size)
+    for chunk in _chunks(rows, chunk_size):
+        related = {}
+        for field in many:
+            through = field.remote_field.through
+            source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+            values = {}
+            pairs = through.objects.filter(**{f"{source}_id__in": [row[0] for row in chunk]}) \
+                .order_by(f"{source}_id", f"{target}_id").values_list(f"{source}_id", f"{target}_id")
+            for pk, value in pairs:
+                values.setdefault(pk, []).append(str(value))
+            related[field.name] = values
+        for row in chunk:
+            values = iter(row)
+            yield [
+                MANY_SEPARATOR.join(related[field.name].get(row[0], [])) if field.many_to_many else next(values)
+                for _, field in columns
+            ]
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def csv_response(filename, header, rows):
+    writer = csv.writer(_Echo())
+
+    def lines():
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(['' if value is None else value for value in row])
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
+
+def write_csv(fileobj, header, rows):
+    writer = csv.writer(fileobj)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+
+
+def write_xlsx(fileobj, header, rows):
+    # write_only keeps rows out of memory (openpyxl spools them to disk)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('roster')
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(fileobj)
+
+
+def xlsx_response(filename, header, rows):
+    # The zip is only complete at the end, so the finished file is streamed from a temporary file
+    spool = tempfile.TemporaryFile()
+    write_xlsx(spool, header, rows)
+    spool.seek(0)
+    return FileResponse(spool, as_attachment=True, filename=f"{filename}.xlsx", content_type=XLSX_CONTENT_TYPE)
+
+
+def read_rows(upload, encoding):
+    """Yield ``(row number, {column: value})`` from an uploaded CSV or XLSX file, one row at a time."""
+    if encoding == 'xlsx':
+        workbook = load_workbook(upload, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = [str(name).strip() if name is not None else '' for name in next(rows, [])]
+            for number, values in enumerate(rows, start=2):
+                yield number, dict(zip(header, values))
+        finally:
+            workbook.close()
+    else:
+        text = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        for number, row in enumerate(csv.DictReader(text), start=2):
+            yield number, row
+
+
+def import_item(row, columns):
+    """Turn a file row into an API item: blank cells are left out, many-to-many cells split into id lists."""
+    item = {}
+    for name, field in columns:
+        value = row.get(name)
+        if value is None or (isinstance(value, str) and not value.strip()):
+            continue
+        if field.many_to_many:
+            value = [part.strip() for part in str(value).split(MANY_SEPARATOR) if part.strip()]
+        elif isinstance(value, datetime) and isinstance(field, models.DateField) \
+                and not isinstance(field, models.DateTimeField):
+            value = value.date()  # spreadsheets store dates as datetimes
+        elif isinstance(value, float) and value.is_integer() and isinstance(field, (models.ForeignKey, models.AutoField)):
+            value = int(value)
+        item[name] = value
+    if 'id' in item:
+        try:
+            item['id'] = int(item['id'])
+        except (TypeError, ValueError):
+            pass
+    return item
+
+
+class RosterMixin:
+    """
+    CSV/XLSX export and import on top of BulkModelViewSetMixin.
+    - ``GET export/?encoding=csv|xlsx`` streams the (filtered) table in ``ROSTER_CHUNK_SIZE`` row chunks.
+    - ``POST import/`` (multipart ``file``, ``?encoding=csv|xlsx``) reads the file row by row and commits
+      every chunk with the bulk create/update path: rows with an ``id`` update, the others create.
+    - ``?background=1`` on either runs it as a task and answers 202 with a job to poll at ``/api/jobs/<id>/``.
+      Background exports always cover the whole table, so filter parameters are rejected.
+    """
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        encoding = request.query_params.get('encoding', 'csv')
+        if encoding not in ('csv', 'xlsx'):
+            return Response({"detail": "encoding must be csv or xlsx."}, status=status.HTTP_400_BAD_REQUEST)
+        if request.query_params.get('background'):
+            # The task exports the whole table: it has no request to filter with
+            unsupported = sorted(set(request.query_params) - {'encoding', 'background'})
+            if unsupported:
+                return Response({"detail": "Background exports cover the whole table; "
+                                           f"remove {', '.join(unsupported)}."}, status=status.HTTP_400_BAD_REQUEST)
+            job = tasks.start_job(request.user)
+            tasks.export_roster.delay(job, _view_path(self), encoding)
+            return tasks.job_accepted(request, job)
+        queryset = self.filter_queryset(self.get_queryset())
+        columns = roster_columns(self.get_serializer(), queryset.model)
+        header = [name for name, _ in columns]
+        rows = export_rows(queryset, columns)
+        filename = queryset.model._meta.model_name
+        if encoding == 'xlsx':
+            return xlsx_response(filename, header, rows)
+        return csv_response(filename, header, rows)
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser, FormParser])
+    def import_file(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"file": ["No file was submitted."]}, status=status.HTTP_400_BAD_REQUEST)
+        encoding = request.query_params.get('encoding') or ('xlsx' if upload.name.lower().endswith('.xlsx') else 'csv')
+        if encoding not in ('csv', 'xlsx'):
+            return Response({"detail": "encoding must be csv or xlsx."}, status=status.HTTP_400_BAD_REQUEST)
+        if request.query_params.get('background'):
+            job = tasks.start_job(request.user)
+            name = default_storage.save(f"imports/{job}.{encoding}", upload)
+            tasks.import_roster.delay(job, _view_path(self), name, encoding)
+            return tasks.job_accepted(request, job)
+        summary = self.import_rows(upload, encoding)
+        if "detail" in summary:
+            return Response(summary, status=status.HTTP_400_BAD_REQUEST)
+        return Response(summary, status=status.HTTP_200_OK if not summary["errors"] else status.HTTP_207_MULTI_STATUS)
+
+    def import_rows(self, upload, encoding):
+        """Import an uploaded file chunk by chunk; returns the summary (with ``detail`` if the file is unreadable)."""
+        columns = roster_columns(self.get_serializer(), self.get_queryset().model)
+        summary = {"rows": 0, "created": 0, "updated": 0, "errors": 0, "error_rows": []}
+        try:
+            for chunk in _chunks(read_rows(upload, encoding), ROSTER_CHUNK_SIZE):
+                self._import_chunk(chunk, columns, summary)
+        except (UnicodeDecodeError, csv.Error, KeyError, ValueError, OSError) as exc:
+            summary["detail"] = f"Could not read the file after {summary['rows']} rows: {exc}"
+        return summary
+
+    def write_export(self, fileobj, encoding):
+        """Write the whole table to ``fileobj`` (text for CSV, binary for XLSX)."""
+        queryset = self.get_queryset()
+        columns = roster_columns(self.get_serializer(), queryset.model)
+        writer = write_xlsx if encoding == 'xlsx' else write_csv
+        writer(fileobj, [name for name, _ in columns], export_rows(queryset, columns))
+
+    def _import_chunk(self, chunk, columns, summary):
+        items = [(number, import_item(row, columns)) for number, row in chunk]
+        summary["rows"] += len(items)
+        for batch, write in (
+            ([entry for entry in items if 'id' not in entry[1]], self.bulk_create),
+            ([entry for entry in items if 'id' in entry[1]], self.bulk_update),
+        ):
+            if not batch:
+                continue
+            for (number, _), result in zip(batch, write([item for _, item in batch])):
+                if result["status"] == "error":
+                    summary["errors"] += 1
+                    if len(summary["error_rows"]) < ROSTER_MAX_ERRORS:
+                        summary["error_rows"].append({"row": number, "errors": result["errors"]})
+                else:
+                    summary[result["status"]] += 1
+
+
+def _view_path(view):
+    return f"{type(view).__module__}.{type(view).__name__}"
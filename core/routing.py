@@ -1,6 +1,9 @@
 from django.urls import path
-from .consumers import BusLiveConsumer
+from .consumers import BusLiveConsumer, DriverGPSConsumer, FleetLiveConsumer, NotificationConsumer
 
 websocket_urlpatterns = [
+    path('ws/buses/live/', FleetLiveConsumer.as_asgi()),
     path('ws/buses/<int:bus_id>/live/', BusLiveConsumer.as_asgi()),
+    path('ws/buses/<int:bus_id>/gps/', DriverGPSConsumer.as_asgi()),
+    path('ws/notifications/', NotificationConsumer.as_asgi()),
 ]
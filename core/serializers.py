@@ -2,7 +2,7 @@ from rest_framework import serializers
 from .models import (
     Bus, Admin, Supervisor, Driver, Student, Guardian, Attendance, Announcement,
     BusAssignment, BusRoute, BusRoutePoint, Trip, TripStudent, Feedback,
-    MaintenanceLog, Notification, Reminder, GPSTracking, Class
+    MaintenanceLog, Notification, NotificationRecipient, Reminder, GPSTracking, GPSDailySummary, Class
 )
 
 class BusSerializer(serializers.ModelSerializer):
@@ -28,7 +28,7 @@ class DriverSerializer(serializers.ModelSerializer):
 class StudentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Student
-        fields = '__all__'
+        exclude = ['geohash']  # index column for core.nearby, not part of the API
 
     def validate_fname(self, value):
         if not value:
@@ -72,7 +72,7 @@ class BusRouteSerializer(serializers.ModelSerializer):
 class BusRoutePointSerializer(serializers.ModelSerializer):
     class Meta:
         model = BusRoutePoint
-        fields = '__all__'
+        exclude = ['geohash']  # index column for core.nearby, not part of the API
 
 class TripSerializer(serializers.ModelSerializer):
     class Meta:
@@ -99,6 +99,13 @@ class NotificationSerializer(serializers.ModelSerializer):
         model = Notification
         fields = '__all__'
 
+class NotificationRecipientSerializer(serializers.ModelSerializer):
+    notification = NotificationSerializer(read_only=True)
+    class Meta:
+        model = NotificationRecipient
+        fields = ['id', 'notification', 'read_at']
+        read_only_fields = ['read_at']
+
 class ReminderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reminder
@@ -108,6 +115,13 @@ class GPSTrackingSerializer(serializers.ModelSerializer):
     class Meta:
         model = GPSTracking
         fields = '__all__'
+        # Server time; device time is only taken by the bulk/WebSocket ingest, which bounds it
+        read_only_fields = ['timestamp']
+
+class GPSDailySummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GPSDailySummary
+        fields = '__all__'
 
 class ClassSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,123 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from . import eta, geometry, live, tasks, versions
+from .ingest import notify_fixes, refresh_location
+from .models import (
+    Bus, Student, BusAssignment, BusRoute, BusRoutePoint, Trip, TripStudent, GPSTracking, BusLocation,
+    Announcement, Class, Notification
+)
+
+
+def buses_for_route(route_id):
+    # A route belongs to a bus, but trips of other buses may also run on it
+    return list(
+        Bus.objects.filter(Q(busroute__id=route_id) | Q(trip__route_id=route_id))
+        .values_list('id', flat=True).distinct()
+    )
+
+
+def buses_for_student(student_id):
+    return buses_for_students([student_id])
+
+
+def buses_for_students(student_ids):
+    return list(
+        Bus.objects.filter(Q(busassignment__student_id__in=student_ids) | Q(trip__tripstudent__student_id__in=student_ids))
+        .values_list('id', flat=True).distinct()
+    )
+
+
+# Live snapshot invalidation
+
+@receiver([post_save, post_delete], sender=Bus)
+def bus_changed(sender, instance, **kwargs):
+    live.invalidate(instance.id)
+
+
+@receiver(pre_save, sender=Trip)
+@receiver(pre_save, sender=BusRoute)
+@receiver(pre_save, sender=BusAssignment)
+def bus_data_saving(sender, instance, raw=False, **kwargs):
+    # A row moved to another bus leaves the static layer of the old bus stale as well
+    instance._previous_bus_id = (
+        sender.objects.filter(pk=instance.pk).values_list('bus_id', flat=True).first()
+        if instance.pk is not None and not raw else None
+    )
+
+
+@receiver([post_save, post_delete], sender=Trip)
+@receiver([post_save, post_delete], sender=BusRoute)
+@receiver([post_save, post_delete], sender=BusAssignment)
+def bus_data_changed(sender, instance, **kwargs):
+    live.invalidate(instance.bus_id, getattr(instance, '_previous_bus_id', None))
+
+
+@receiver(post_save, sender=GPSTracking)
+def gps_saved(sender, instance, **kwargs):
+    # Only the dynamic layer moves; the static layer stays cached
+    notify_fixes([instance])
+
+
+@receiver(post_delete, sender=GPSTracking)
+def gps_deleted(sender, instance, **kwargs):
+    # Only deleting the newest fix moves the last known position
+    if BusLocation.objects.filter(bus_id=instance.bus_id, timestamp__lte=instance.timestamp).exists():
+        refresh_location(instance.bus_id)
+        # After commit, or a concurrent read could cache the deleted fix again
+        transaction.on_commit(lambda: _position_moved(instance.bus_id), robust=True)
+
+
+def _position_moved(bus_id):
+    live.forget_position(bus_id)
+    eta.forget(bus_id)
+    tasks.publish_bus.delay(bus_id)
+
+
+@receiver([post_save, post_delete], sender=BusRoutePoint)
+def route_point_changed(sender, instance, **kwargs):
+    _route_geometry_changed(instance.route_id)
+    live.invalidate(*buses_for_route(instance.route_id))
+
+
+@receiver([post_save, post_delete], sender=BusRoute)
+def route_changed(sender, instance, **kwargs):
+    # The route name is part of the prebuilt features
+    _route_geometry_changed(instance.id)
+
+
+def _route_geometry_changed(route_id):
+    # After commit, or a reader could cache the old points under the new generation for a day
+    transaction.on_commit(lambda: geometry.invalidate(route_id), robust=True)
+
+
+@receiver([post_save, post_delete], sender=TripStudent)
+def trip_student_changed(sender, instance, **kwargs):
+    live.invalidate(*Trip.objects.filter(id=instance.trip_id).values_list('bus_id', flat=True))
+
+
+@receiver(post_save, sender=Student)
+def student_changed(sender, instance, **kwargs):
+    # Deletions cascade to assignments and trip students, which invalidate on their own
+    live.invalidate(*buses_for_student(instance.id))
+
+
+# HTTP validators of reference data (ConditionalGetMixin)
+
+@receiver([post_save, post_delete], sender=Bus)
+@receiver([post_save, post_delete], sender=BusRoute)
+@receiver([post_save, post_delete], sender=BusRoutePoint)
+@receiver([post_save, post_delete], sender=Class)
+@receiver([post_save, post_delete], sender=Announcement)
+def reference_data_changed(sender, **kwargs):
+    # After commit, so nobody caches the old rows under the new version
+    transaction.on_commit(lambda: versions.bump(sender), robust=True)
+
+
+# Background delivery
+
+@receiver(post_save, sender=Notification)
+def notification_created(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: tasks.deliver_notification.delay(instance.id), robust=True)
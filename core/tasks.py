@@ -0,0 +1,158 @@
+# Background work that the client does not wait for. Without a broker (CELERY_TASK_ALWAYS_EAGER)
+# .delay() runs the task inline, so callers need not care which mode is active.
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from celery import shared_task
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.response import Response
+from . import inbox, live, metrics, retention
+from .models import Notification
+
+# Finished jobs can be polled for this long; export files are deleted after the same time
+JOB_TIMEOUT = getattr(settings, 'JOB_TIMEOUT', 24 * 3600)
+EXPORT_DIR = 'exports'
+
+
+@task_prerun.connect
+def _task_started(task=None, **kwargs):
+    # Kept on the request, so a task that never reaches postrun (killed, revoked) leaves nothing behind
+    task.request.started_at = time.perf_counter()
+
+
+@task_postrun.connect
+def _task_finished(task=None, state=None, **kwargs):
+    started = getattr(task.request, 'started_at', None)
+    if started is not None:
+        # No state: the exception propagated to the caller (eager mode). Workers are other
+        # processes than the web server's /api/stats/, so the series goes to the shared store
+        metrics.observe_shared('task', {"task": task.name, "state": state or "FAILURE"},
+                               time.perf_counter() - started)
+
+
+# Job status for long-running tasks started from the API
+
+def _job_key(job_id):
+    return f"job:{job_id}"
+
+
+def start_job(user):
+    job_id = uuid.uuid4().hex
+    cache.set(_job_key(job_id), {"id": job_id, "state": "pending", "user": user.pk}, JOB_TIMEOUT)
+    return job_id
+
+
+def get_job(job_id):
+    return cache.get(_job_key(job_id))
+
+
+def _finish_job(job_id, **fields):
+    job = get_job(job_id) or {"id": job_id, "user": None}
+    job.update(fields)
+    cache.set(_job_key(job_id), job, JOB_TIMEOUT)
+
+
+def job_accepted(request, job_id):
+    job = dict(get_job(job_id) or {"id": job_id, "state": "pending"})
+    job["url"] = request.build_absolute_uri(reverse('job-detail', args=[job_id]))
+    return Response(job, status=status.HTTP_202_ACCEPTED)
+
+
+def _view(view_path, action):
+    # Serializer contexts of the roster views only need the view itself
+    view = import_string(view_path)()
+    view.request = None
+    view.format_kwarg = None
+    view.action = action
+    view.kwargs = {}
+    return view
+
+
+# Tasks
+
+@shared_task
+def publish_bus(bus_id):
+    live.publish(bus_id)
+
+
+@shared_task
+def publish_fleet(rows):
+    live.publish_fleet(rows)
+
+
+@shared_task
+def deliver_notification(notification_id):
+    """Fan a new notification out to its recipients' inboxes (pushed to their NotificationConsumer)."""
+    notification = Notification.objects.filter(id=notification_id).first()
+    if notification is None:
+        return 0
+    return inbox.fan_out(notification)
+
+
+@shared_task
+def enforce_gps_retention():
+    return retention.enforce_retention()
+
+
+@shared_task
+def import_roster(job_id, view_path, name, encoding):
+    """Import a file saved to the default storage by ``RosterMixin.import_file``, then delete it."""
+    _finish_job(job_id, state="running")
+    try:
+        with default_storage.open(name, 'rb') as upload:
+            summary = _view(view_path, 'import_file').import_rows(upload, encoding)
+    except Exception as exc:
+        _finish_job(job_id, state="failed", error=str(exc))
+        raise
+    finally:
+        default_storage.delete(name)
+    if "detail" in summary:
+        _finish_job(job_id, state="failed", error=summary.pop("detail"), result=summary)
+    else:
+        _finish_job(job_id, state="done", result=summary)
+
+
+@shared_task
+def export_roster(job_id, view_path, encoding):
+    """Write the whole table of a roster view to the default storage; the job result holds its download URL."""
+    _finish_job(job_id, state="running")
+    view = _view(view_path, 'export')
+    model_name = view.get_queryset().model._meta.model_name
+    try:
+        spool = tempfile.TemporaryFile() if encoding == 'xlsx' else \
+            tempfile.TemporaryFile('w+', encoding='utf-8', newline='')
+        with spool:
+            view.write_export(spool, encoding)
+            spool.seek(0)
+            name = default_storage.save(f"{EXPORT_DIR}/{model_name}-{job_id}.{encoding}", File(spool))
+    except Exception as exc:
+        _finish_job(job_id, state="failed", error=str(exc))
+        raise
+    # Served by JobFileView to the job's owner only, never from MEDIA_URL
+    _finish_job(job_id, state="done", file_name=name, result={"file": reverse('job-file', args=[job_id])})
+
+
+@shared_task
+def delete_expired_exports():
+    """Delete export files older than ``JOB_TIMEOUT``: their jobs, and the only way to download them, are gone."""
+    cutoff = timezone.now() - timedelta(seconds=JOB_TIMEOUT)
+    try:
+        _, files = default_storage.listdir(EXPORT_DIR)
+    except FileNotFoundError:
+        return 0
+    deleted = 0
+    for file_name in files:
+        name = f"{EXPORT_DIR}/{file_name}"
+        if default_storage.get_modified_time(name) < cutoff:
+            default_storage.delete(name)
+            deleted += 1
+    return deleted
@@ -1,3 +1,1311 @@
-from django.test import TestCase
+import json
+from datetime import date, datetime, time, timedelta
+from unittest import mock
+import msgpack
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from rest_framework.test import APITestCase, APITransactionTestCase
+from .models import (
+    Bus, Admin, Supervisor, Driver, Student, Guardian, Attendance, Announcement,
+    BusAssignment, BusRoute, BusRoutePoint, Trip, TripStudent, Feedback,
+    MaintenanceLog, Notification, NotificationRecipient, Reminder, GPSTracking, GPSDailySummary, BusLocation, Class
+)
+from .checks import check_viewset_indexes
+from .routing import websocket_urlpatterns
+from .urls import router
+from .views import StudentViewSet, TripViewSet
+from .mixins import QueryPlanMixin
+from . import metrics, tasks
 
-# Create your tests here.
+
+def make_fleet(start, count):
+    """Create ``count`` complete object graphs (one of every core model, linked together)."""
+    for i in range(start, start + count):
+        users = [User.objects.create(username=f"{role}{i}") for role in ('admin', 'supervisor', 'driver', 'guardian')]
+        bus = Bus.objects.create(bus_id=f"B{i}", title=f"Bus {i}", number=str(i), capacity=40)
+        klass = Class.objects.create(name=f"Class {i}", grade="1")
+        students = [
+            Student.objects.create(fname=f"Student{i}{n}", lname="Test", student_class=klass,
+                                   latitude="30.00000000", longitude="31.00000000")
+            for n in range(2)
+        ]
+        Admin.objects.create(user=users[0])
+        Supervisor.objects.create(user=users[1], assigned_bus=bus)
+        Driver.objects.create(user=users[2], license_number=f"L{i}", assigned_bus=bus)
+        guardian = Guardian.objects.create(user=users[3], phone="1")
+        guardian.students.set(students)
+        route = BusRoute.objects.create(bus=bus, route_name=f"Route {i}")
+        BusRoutePoint.objects.create(route=route, location_name=f"Stop {i}", latitude=30.0, longitude=31.0, order=1)
+        trip = Trip.objects.create(bus=bus, route=route, date=date(2025, 1, 1), start_time=time(7), end_time=time(8))
+        for student in students:
+            BusAssignment.objects.create(bus=bus, student=student, assigned_date=date(2025, 1, 1))
+            TripStudent.objects.create(trip=trip, student=student)
+            Attendance.objects.create(student=student, date=date(2025, 1, 1), status="present")
+        Announcement.objects.create(title=f"Announcement {i}", message="Hello")
+        Feedback.objects.create(user=users[3], message="Thanks")
+        MaintenanceLog.objects.create(bus=bus, maintenance_type="oil", description="Oil change", date=date(2025, 1, 1))
+        Notification.objects.create(title=f"Notification {i}", message="Late", bus=bus)
+        Reminder.objects.create(user=users[3], message="Pickup", remind_at=timezone.now())
+        GPSTracking.objects.create(bus=bus, latitude="30.00000000", longitude="31.00000000")
+        GPSDailySummary.objects.create(bus=bus, date=date(2025, 1, 1))
+
+
+class QueryCountTests(APITestCase):
+    """List and retrieve must cost a fixed number of queries, whatever the page holds."""
+
+    # COUNT + SELECT for lists (SELECT only with cursor pagination), SELECT for retrieve;
+    # plus one per prefetched relation
+    cursor_paginated = {'attendance', 'notifications', 'gps-tracking', 'inbox'}
+    extra_queries = {'guardians': 1}
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+
+    def count_queries(self, url):
+        cache.clear()  # measure the uncached path of ConditionalGetMixin viewsets
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(ctx)
+
+    def fill_inbox(self):
+        # The fan-out only runs on commit; give the test user an inbox row per notification
+        NotificationRecipient.objects.bulk_create(
+            [NotificationRecipient(notification=n, user=self.user) for n in Notification.objects.all()],
+            ignore_conflicts=True,
+        )
+
+    def test_cursor_pagination_walks_every_row_once(self):
+        bus = Bus.objects.create(bus_id="B", title="Bus", number="1", capacity=40)
+        GPSTracking.objects.bulk_create([
+            GPSTracking(bus=bus, latitude="30.00000000", longitude="31.00000000") for _ in range(25)
+        ])
+        seen = []
+        url = '/api/gps-tracking/?page_size=10'
+        while url:
+            response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(sorted(seen), sorted(GPSTracking.objects.values_list('id', flat=True)))
+
+    def test_list_query_count_is_constant(self):
+        make_fleet(0, 2)
+        self.fill_inbox()
+        small = {prefix: self.count_queries(f'/api/{prefix}/') for prefix, _, _ in router.registry}
+        make_fleet(2, 8)
+        self.fill_inbox()
+        for prefix, _, _ in router.registry:
+            with self.subTest(prefix=prefix):
+                expected = (1 if prefix in self.cursor_paginated else 2) + self.extra_queries.get(prefix, 0)
+                self.assertEqual(small[prefix], expected)
+                self.assertEqual(self.count_queries(f'/api/{prefix}/'), expected)
+
+    def test_retrieve_query_count_is_constant(self):
+        make_fleet(0, 3)
+        self.fill_inbox()
+        for prefix, viewset, _ in router.registry:
+            with self.subTest(prefix=prefix):
+                pk = viewset.queryset.model.objects.order_by('pk').values_list('pk', flat=True).last()
+                expected = 1 + self.extra_queries.get(prefix, 0)
+                self.assertEqual(self.count_queries(f'/api/{prefix}/{pk}/'), expected)
+
+
+class RequestStatsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+        make_fleet(0, 2)
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_stats_report_queries_serialization_and_render_time(self):
+        with self.settings(REQUEST_STATS_ENABLED=True):
+            self.client.get('/api/students/')
+            self.client.get('/api/students/')
+            self.client.get(f'/api/buses/{Bus.objects.first().id}/')
+            rows = self.client.get('/api/stats/').data
+        students = next(row for row in rows if row.get('view') == 'StudentViewSet')
+        self.assertEqual((students['kind'], students['action'], students['count']), ('request', 'list', 2))
+        self.assertEqual(students['totals']['queries'], 4)
+        for name in ('db_seconds', 'serialize_seconds', 'render_seconds', 'response_bytes'):
+            self.assertGreater(students['totals'][name], 0, name)
+        self.assertEqual(students['histogram']['+Inf'], 2)
+        bus = next(row for row in rows if row.get('view') == 'BusViewSet')
+        self.assertEqual(bus['action'], 'retrieve')
+        self.assertGreater(bus['totals']['serialize_seconds'], 0)
+
+        text = self.client.get('/api/stats/?format=prometheus').content.decode()
+        self.assertIn('core_request_duration_seconds_count{view="StudentViewSet",action="list"} 2', text)
+        self.assertIn('# TYPE core_request_serialize_seconds_total counter', text)
+        self.assertEqual(self.client.delete('/api/stats/').status_code, 204)
+        # Only the DELETE itself, recorded after the reset
+        self.assertEqual([(row['view'], row['action']) for row in metrics.snapshot()], [('StatsView', 'delete')])
+
+
+class IndexedOrderingTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+        make_fleet(0, 1)
+        self.bus = Bus.objects.get()
+
+    def test_ordering_must_be_served_by_an_index(self):
+        response = self.client.get(f'/api/trips/?bus={self.bus.id}&ordering=start_time')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ordering', response.data)
+        response = self.client.get(f'/api/trips/?bus={self.bus.id}&date=2025-01-01&ordering=start_time')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/bus-route-points/?ordering=order').status_code, 400)
+        route = BusRoute.objects.get()
+        self.assertEqual(self.client.get(f'/api/bus-route-points/?route={route.id}&ordering=-order').status_code, 200)
+
+    def test_system_check_rejects_unindexed_fields(self):
+        self.assertEqual(check_viewset_indexes(None), [])
+        with mock.patch.object(TripViewSet, 'ordering_fields', ['end_time']):
+            self.assertEqual([e.id for e in check_viewset_indexes(None)], ['core.E003'])
+        with mock.patch.object(TripViewSet, 'filterset_fields', ['end_time']):
+            self.assertIn('core.E002', [e.id for e in check_viewset_indexes(None)])
+
+    def test_cursor_lists_must_lead_with_a_unique_key(self):
+        response = self.client.get('/api/attendance/?ordering=date,id')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ordering', response.data)
+        self.assertEqual(self.client.get('/api/attendance/?ordering=-id').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/gps-tracking/?bus={self.bus.id}&ordering=-timestamp').status_code, 200)
+
+    def test_gps_search_does_not_scan_coordinates(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get('/api/gps-tracking/?search=12.97').status_code, 200)
+        sql = ' '.join(query['sql'] for query in ctx.captured_queries)
+        self.assertIn('"title" LIKE', sql)
+        self.assertNotRegex(sql, r'"(latitude|longitude)" LIKE')
+
+
+class FastListTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+        make_fleet(0, 3)
+        Student.objects.filter(pk=Student.objects.first().pk).update(image='students/photo.png', dob=date(2015, 5, 1))
+
+    def test_fast_list_matches_serializer_output(self):
+        fast = [(prefix, viewset) for prefix, viewset, _ in router.registry if getattr(viewset, 'fast_list', False)]
+        self.assertTrue(fast)
+        for prefix, viewset in fast:
+            with self.subTest(prefix=prefix):
+                url = f'/api/{prefix}/?page_size=50'
+                expected = None
+                with mock.patch.object(viewset, 'fast_list', False):
+                    expected = self.client.get(url).content
+                cache.clear()
+                self.assertEqual(self.client.get(url).content, expected)
+
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+        make_fleet(0, 2)
+
+    def test_fields_trim_response_and_projection(self):
+        student = Student.objects.first()
+        for url in ('/api/students/?fields=id,fname', f'/api/students/{student.id}/?fields=id,fname',
+                    '/api/buses/?fields=id,number'):
+            with self.subTest(url=url), CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            row = response.data['results'][0] if 'results' in response.data else response.data
+            self.assertEqual(list(row), url.split('fields=')[1].split(','))
+            select = ctx.captured_queries[-1]['sql']
+            self.assertNotIn('"address"', select)
+            self.assertNotIn('"title"', select)
+
+    def test_exclude_and_unknown_fields(self):
+        row = self.client.get('/api/students/?exclude=address,image').data['results'][0]
+        self.assertNotIn('address', row)
+        self.assertIn('fname', row)
+        response = self.client.get('/api/students/?fields=id,password')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fields', response.data)
+
+    def test_fields_keep_cursor_ordering_keys(self):
+        from rest_framework.pagination import CursorPagination
+        make_fleet(2, 2)
+        NotificationRecipient.objects.bulk_create(
+            [NotificationRecipient(notification=n, user=self.user) for n in Notification.objects.all()])
+        urls = ['/api/attendance/?fields=status&ordering=id']
+        for prefix, viewset, _ in router.registry:
+            if issubclass(viewset, QueryPlanMixin) and issubclass(viewset.pagination_class or object, CursorPagination):
+                ordering = viewset.pagination_class.ordering
+                ordering = [ordering] if isinstance(ordering, str) else ordering
+                field = next(name for name in viewset.serializer_class().fields
+                             if name != 'id' and name not in {term.lstrip('-') for term in ordering})
+                urls.append(f'/api/{prefix}/?fields={field}')
+        for url in urls:
+            with self.subTest(url=url):
+                seen = 0
+                url += '&page_size=2'
+                while url:
+                    response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(len(list(response.data['results'][0])), 1)
+                    seen += len(response.data['results'])
+                    url = response.data['next']
+                self.assertGreater(seen, 2)
+
+    def test_fast_and_regular_paths_agree(self):
+        url = '/api/students/?fields=id,lname,dob'
+        with mock.patch.object(StudentViewSet, 'fast_list', False):
+            expected = self.client.get(url).content
+        self.assertEqual(self.client.get(url).content, expected)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+        make_fleet(0, 2)
+
+    def test_unchanged_reads_are_free_and_revalidate(self):
+        response = self.client.get('/api/buses/')
+        etag = response['ETag']
+        self.assertIn('max-age', response['Cache-Control'])
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get('/api/buses/').content, response.content)
+            not_modified = self.client.get('/api/buses/', HTTP_IF_NONE_MATCH=etag)
+            since = self.client.get('/api/buses/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(len(ctx), 0)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(since.status_code, 304)
+        self.assertNotEqual(self.client.get('/api/buses/?status=active')['ETag'], etag)
+
+    def test_writes_change_the_validators(self):
+        bus = Bus.objects.first()
+        etag = self.client.get(f'/api/buses/{bus.id}/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/buses/{bus.id}/', {'title': 'Renamed'})
+        response = self.client.get(f'/api/buses/{bus.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'Renamed')
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class LiveSnapshotTests(APITestCase):
+    """``/live/`` is served from the cache; every change to the data behind it must show up."""
+    def setUp(self):
+        cache.clear()
+        make_fleet(0, 1)
+        self.bus = Bus.objects.get()
+        self.client.force_authenticate(User.objects.create(username='viewer'))
+
+    def live(self):
+        response = self.client.get(f'/api/buses/{self.bus.id}/live/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def cached_live(self):
+        data = self.live()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.live(), data)
+        return data
+
+    def test_bus_change(self):
+        self.assertEqual(self.cached_live()["meta"]["bus"]["title"], "Bus 0")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bus.title = "Renamed"
+            self.bus.save()
+            # Readers before the commit still see (and cache) the old rows under the old generation
+            self.assertEqual(self.live()["meta"]["bus"]["title"], "Bus 0")
+        self.assertEqual(self.live()["meta"]["bus"]["title"], "Renamed")
+
+    def test_route_point_change(self):
+        self.assertEqual(self.cached_live()["meta"]["counts"]["route_points"], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            BusRoutePoint.objects.create(route=BusRoute.objects.get(), location_name="Stop 2", latitude=30.1, longitude=31.1, order=2)
+        self.assertEqual(self.live()["meta"]["counts"]["route_points"], 2)
+
+    def test_assignment_change(self):
+        Trip.objects.all().delete()  # without a trip the pins come from the bus assignments
+        self.assertEqual(self.cached_live()["meta"]["counts"]["students"], 2)
+        student = Student.objects.create(fname="New", lname="Rider", student_class=Class.objects.get(),
+                                         latitude="30.00000000", longitude="31.00000000")
+        with self.captureOnCommitCallbacks(execute=True):
+            BusAssignment.objects.create(bus=self.bus, student=student, assigned_date=date(2025, 1, 2))
+        self.assertEqual(self.live()["meta"]["counts"]["students"], 3)
+
+    def test_assignment_moved_to_another_bus(self):
+        make_fleet(1, 1)
+        Trip.objects.all().delete()
+        other = Bus.objects.get(bus_id="B1")
+        self.assertEqual(self.cached_live()["meta"]["counts"]["students"], 2)
+        other_live = self.client.get(f'/api/buses/{other.id}/live/').data
+        self.assertEqual(other_live["meta"]["counts"]["students"], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            assignment = BusAssignment.objects.filter(bus=self.bus).first()
+            assignment.bus = other
+            assignment.save()
+        # Both the bus it left and the bus it joined are rebuilt
+        self.assertEqual(self.live()["meta"]["counts"]["students"], 1)
+        self.assertEqual(self.client.get(f'/api/buses/{other.id}/live/').data["meta"]["counts"]["students"], 3)
+
+    def test_gps_fix(self):
+        before = self.cached_live()["features"][0]
+        self.assertEqual(before["geometry"]["coordinates"], [31.0, 30.0])
+        with self.captureOnCommitCallbacks(execute=True):
+            GPSTracking.objects.create(bus=self.bus, latitude="30.50000000", longitude="31.50000000",
+                                       timestamp=timezone.now() + timedelta(minutes=1))
+        bus = self.live()["features"][0]
+        self.assertEqual((bus["properties"]["kind"], bus["geometry"]["coordinates"]), ("bus", [31.5, 30.5]))
+
+    def test_published_snapshot_splices_the_cached_features(self):
+        from channels.layers import get_channel_layer
+        from . import live
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(live.group_name(self.bus.id), channel)
+        live.publish(self.bus.id)
+        message = async_to_sync(layer.receive)(channel)
+        self.assertEqual(json.loads(message["snapshot"]),
+                         self.client.get(f'/api/buses/{self.bus.id}/live/').json())
+
+    def test_static_layer_etag(self):
+        url = f'/api/buses/{self.bus.id}/live/static/'
+        etag = self.client.get(url)['ETag']
+        for header in (etag, f'"other", {etag}', f'W/{etag}', '*'):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=header)
+            self.assertEqual((response.status_code, response['ETag']), (304, etag), header)
+        # Unquoted or merely similar values are other tags
+        for header in ('"other"', f'"x{etag[1:-1]}x"', etag[1:-1]):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=header).status_code, 200, header)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bus.title = "Renamed"
+            self.bus.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def add_fix(self, minutes, latitude):
+        with self.captureOnCommitCallbacks(execute=True):
+            return GPSTracking.objects.create(bus=self.bus, latitude=latitude, longitude="31.00000000",
+                                              timestamp=timezone.now() + timedelta(minutes=minutes))
+
+    def position(self):
+        return self.client.get(f'/api/buses/{self.bus.id}/live/position/').data["coordinates"]
+
+    def test_deleting_the_newest_fix_moves_the_bus_back(self):
+        older = self.add_fix(1, "30.10000000")
+        newest = self.add_fix(2, "30.20000000")
+        self.assertEqual(self.position(), [31.0, 30.2])
+        with self.captureOnCommitCallbacks(execute=True):
+            newest.delete()
+        self.assertEqual(BusLocation.objects.get(bus=self.bus).timestamp, older.timestamp)
+        self.assertEqual(self.position(), [31.0, 30.1])
+        # Older fixes do not move it
+        with self.captureOnCommitCallbacks(execute=True):
+            GPSTracking.objects.exclude(id=older.id).delete()
+        self.assertEqual(self.position(), [31.0, 30.1])
+        with self.captureOnCommitCallbacks(execute=True):
+            older.delete()
+        self.assertFalse(BusLocation.objects.filter(bus=self.bus).exists())
+        self.assertIsNone(self.position())
+
+    def test_new_fix_is_published_after_commit(self):
+        self.assertEqual(self.position(), [31.0, 30.0])
+        published = []
+        with mock.patch('core.tasks.publish_bus.delay', side_effect=lambda bus_id: published.append(self.position())), \
+                mock.patch('core.tasks.publish_fleet.delay', side_effect=lambda rows: published.append(rows[0][1:3])):
+            with self.captureOnCommitCallbacks() as callbacks:
+                GPSTracking.objects.create(bus=self.bus, latitude="30.50000000", longitude="31.50000000",
+                                           timestamp=timezone.now() + timedelta(minutes=1))
+                # Nothing leaves the transaction before it commits
+                self.assertEqual(published, [])
+                self.assertEqual(self.position(), [31.0, 30.0])
+            for callback in callbacks:
+                callback()
+        # The bus group only hears about the fix once the cached position has it
+        self.assertEqual(published, [[31.5, 30.5], [31.5, 30.5]])
+
+
+class NearbyTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+        self.bus = Bus.objects.create(bus_id="B", title="Bus", number="1", capacity=40)
+        self.route = BusRoute.objects.create(bus=self.bus, route_name="Route")
+        # Stops every ~111m going north from (30, 31)
+        self.stops = [
+            BusRoutePoint.objects.create(route=self.route, location_name=f"Stop {n}", latitude=30 + n * 0.001,
+                                         longitude=31.0, order=n)
+            for n in range(10)
+        ]
+
+    def test_geohash_cover_matches_brute_force(self):
+        from .geo import geohash_encode, haversine
+        from .nearby import stops_near
+        self.assertEqual(geohash_encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        for radius in (50, 250, 1000):
+            expected = sorted(s.id for s in self.stops if haversine(30.0025, 31.0, s.latitude, s.longitude) <= radius)
+            self.assertEqual(sorted(s.id for _, s in stops_near(30.0025, 31.0, radius)), expected)
+
+    def test_proximity_queries_use_the_geohash_index(self):
+        from .nearby import in_cells
+        if connection.vendor != 'sqlite':
+            self.skipTest("EXPLAIN output checked for SQLite")
+        for model in (Student, BusRoutePoint):
+            plan = in_cells(model.objects.exclude(geohash=''), 30.0025, 31.0, 250).explain()
+            self.assertIn('geohash', plan, model)
+            self.assertNotRegex(plan, rf'SCAN {model._meta.db_table}\b', model)
+
+    def test_nearby_endpoints(self):
+        response = self.client.get('/api/bus-route-points/nearby/?lat=30.0051&lon=31.0&radius=150')
+        self.assertEqual([row['order'] for row in response.data['results']], [5, 6, 4])
+        self.assertEqual(self.client.get('/api/bus-route-points/nearby/?lat=30').status_code, 400)
+
+        student = Student.objects.create(fname="Near", lname="Test", latitude="30.00400000", longitude="31.00000000")
+        Student.objects.create(fname="Far", lname="Test", latitude="30.10000000", longitude="31.00000000")
+        BusAssignment.objects.create(bus=self.bus, student=student, assigned_date=date(2025, 1, 1))
+        GPSTracking.objects.create(bus=self.bus, latitude="30.00420000", longitude="31.00000000")
+        response = self.client.get(f'/api/buses/{self.bus.id}/students-nearby/?radius=300')
+        self.assertEqual([row['id'] for row in response.data['students']], [student.id])
+        # Past stop 4, closer to 5 than 4 is
+        self.assertEqual(self.client.get(f'/api/buses/{self.bus.id}/next-stop/').data['stop']['order'], 5)
+
+    def test_geohash_stays_out_of_the_api(self):
+        from django.core.management import call_command
+        from io import StringIO
+        from . import versions
+        Student.objects.create(fname="Near", lname="Test", latitude="30.00400000", longitude="31.00000000")
+        for url in ('/api/students/', '/api/bus-route-points/', f'/api/bus-route-points/{self.stops[0].id}/'):
+            response = self.client.get(url)
+            row = response.data['results'][0] if 'results' in response.data else response.data
+            self.assertNotIn('geohash', row, url)
+        # The command rewrites the column with bulk_update, which sends no signals
+        BusRoutePoint.objects.filter(id=self.stops[0].id).update(geohash='')
+        before = versions.current(BusRoutePoint)[0]
+        call_command('rebuild_geohashes', stdout=StringIO())
+        self.assertNotEqual(versions.current(BusRoutePoint)[0], before)
+
+    def test_eta_follows_new_fixes(self):
+        start = timezone.now() - timedelta(minutes=2)
+        GPSTracking.objects.create(bus=self.bus, latitude="30.00000000", longitude="31.00010000", timestamp=start)
+        GPSTracking.objects.create(bus=self.bus, latitude="30.00100000", longitude="31.00010000",
+                                   timestamp=start + timedelta(seconds=20))
+        data = self.client.get(f'/api/buses/{self.bus.id}/eta/').data
+        # ~111m in 20s along the route
+        self.assertAlmostEqual(data['speed'], 5.56, places=1)
+        self.assertEqual([row['order'] for row in data['stops']], list(range(1, 10)))
+        self.assertAlmostEqual(data['stops'][-1]['distance'], 8 * 111.2, delta=2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            GPSTracking.objects.create(bus=self.bus, latitude="30.00500000", longitude="31.00000000",
+                                       timestamp=start + timedelta(seconds=40))
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get(f'/api/buses/{self.bus.id}/eta/?stop={self.stops[9].id}').data
+        self.assertEqual(len(ctx), 0)
+        self.assertGreater(data['speed'], 5.56)
+        self.assertEqual([row['order'] for row in data['stops']], [9])
+
+    def test_eta_switches_route_when_the_next_trip_starts(self):
+        other = BusRoute.objects.create(bus=self.bus, route_name="Afternoon")
+        BusRoutePoint.objects.create(route=other, location_name="School", latitude=30.0, longitude=31.0, order=1)
+        Trip.objects.create(bus=self.bus, route=self.route, date=date(2025, 1, 1), start_time=time(7), end_time=time(7, 31))
+        Trip.objects.create(bus=self.bus, route=other, date=date(2025, 1, 1), start_time=time(7, 32), end_time=time(9))
+        morning = timezone.make_aware(datetime(2025, 1, 1, 7, 30))
+        url = f'/api/buses/{self.bus.id}/eta/'
+        with mock.patch('django.utils.timezone.now', return_value=morning):
+            self.assertEqual(self.client.get(url).data['route'], self.route.id)
+        # Nothing was saved, the clock alone moved the bus on to the next trip
+        with mock.patch('django.utils.timezone.now', return_value=morning + timedelta(minutes=3)):
+            with self.captureOnCommitCallbacks(execute=True):
+                GPSTracking.objects.create(bus=self.bus, latitude="30.00000000", longitude="31.00000000",
+                                           timestamp=morning + timedelta(minutes=3))
+            self.assertEqual(self.client.get(url).data['route'], other.id)
+
+    def test_route_geometry_is_cached_until_the_route_changes(self):
+        from .geometry import get_geometry
+        geometry = get_geometry(self.route.id)
+        self.assertEqual(len(geometry), 10)
+        self.assertEqual(json.loads(f'[{geometry.features_json}]'), geometry.features)
+        self.assertAlmostEqual(geometry.cumulative[-1], 9 * 111.2, delta=2)
+        self.assertAlmostEqual(geometry.project(30.0045, 31.0001), geometry.cumulative[4] + 55.6, delta=1)
+        with CaptureQueriesContext(connection) as ctx:
+            get_geometry(self.route.id)
+        self.assertEqual(len(ctx), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stops[0].location_name = "Depot"
+            self.stops[0].save()
+            # Until the change commits, readers keep (and cache) the old points under the old generation
+            self.assertEqual(get_geometry(self.route.id).features[1]['properties']['location_name'], "Stop 0")
+        self.assertEqual(get_geometry(self.route.id).features[1]['properties']['location_name'], "Depot")
+
+
+class OptimizationTests(APITestCase):
+    def test_stop_order_and_assignment(self):
+        from django.core.management import call_command
+        from io import StringIO
+        from .optimization import assign_students, optimize_stops
+        line = [(30 + n * 0.001, 31.0) for n in range(8)]
+        shuffled = [line[i] for i in (0, 5, 2, 7, 1, 4, 6, 3)]
+        order, before, after = optimize_stops(shuffled)
+        self.assertLess(after, before)
+        self.assertEqual([shuffled[i] for i in order], line)
+
+        result = assign_students([(30.0, 31.0), (30.0001, 31.0), (30.01, 31.0)], [(1, line[:1]), (5, line[-1:])])
+        self.assertEqual([bus for bus, _ in result].count(0), 1)
+        self.assertEqual(result[2][0], 1)
+
+        bus = Bus.objects.create(bus_id="B", title="Bus", number="1", capacity=40)
+        route = BusRoute.objects.create(bus=bus, route_name="Route")
+        for n, (lat, lon) in enumerate(shuffled):
+            BusRoutePoint.objects.create(route=route, location_name=f"Stop {n}", latitude=lat, longitude=lon, order=n)
+        out = StringIO()
+        call_command('optimize_routes', workers=1, assign=True, apply=True, stdout=out)
+        self.assertIn('1 improved', out.getvalue())
+        self.assertEqual(list(BusRoutePoint.objects.order_by('order').values_list('latitude', flat=True)),
+                         [lat for lat, _ in line])
+
+
+    def test_students_without_a_location_keep_their_seat(self):
+        from django.core.management import call_command
+        from io import StringIO
+        near = Bus.objects.create(bus_id="N", title="Near", number="1", capacity=1)
+        far = Bus.objects.create(bus_id="F", title="Far", number="2", capacity=5)
+        for bus, latitude in ((near, 30.0), (far, 30.05)):
+            route = BusRoute.objects.create(bus=bus, route_name=bus.title)
+            BusRoutePoint.objects.create(route=route, location_name=bus.title, latitude=latitude, longitude=31.0, order=1)
+        unlocated = Student.objects.create(fname="No", lname="Address")
+        BusAssignment.objects.create(bus=near, student=unlocated, assigned_date=date(2025, 1, 1))
+        student = Student.objects.create(fname="Next", lname="Door", latitude="30.00010000", longitude="31.00000000")
+        call_command('optimize_routes', workers=1, assign=True, apply=True, stdout=StringIO())
+        self.assertEqual(BusAssignment.objects.get(student=student).bus, far)
+        self.assertEqual(BusAssignment.objects.get(student=unlocated).bus, near)
+
+
+class TripAttendanceTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+        make_fleet(0, 1)
+        self.trip = Trip.objects.get()
+        self.students = list(TripStudent.objects.filter(trip=self.trip).values_list('student_id', flat=True))
+        Attendance.objects.all().delete()
+
+    def test_bulk_marking_is_one_idempotent_upsert(self):
+        url = f'/api/trips/{self.trip.id}/attendance/'
+        body = {"statuses": {str(self.students[0]): "absent"}, "default": "present"}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url, body, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['marked'], 2)
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]), 1)
+        self.client.post(url, body, format='json')
+        self.client.post(url, {"statuses": {str(self.students[0]): "present"}}, format='json')
+        self.assertEqual(dict(Attendance.objects.values_list('student_id', 'status')),
+                         {student: "present" for student in self.students})
+
+    def test_students_must_be_on_the_trip(self):
+        other = Student.objects.create(fname="Other", lname="Test")
+        response = self.client.post(f'/api/trips/{self.trip.id}/attendance/',
+                                    {"statuses": {str(other.id): "present", "x": "present"}}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data['statuses']), {str(other.id), "x"})
+        self.assertFalse(Attendance.objects.exists())
+
+    def test_date_must_be_an_iso_string(self):
+        for day in (20250101, "2025-13-01", "yesterday", ["2025-01-01"]):
+            response = self.client.post(f'/api/trips/{self.trip.id}/attendance/', {"date": day}, format='json')
+            self.assertEqual(response.status_code, 400, day)
+            self.assertIn('date', response.data)
+
+
+class BulkViewSetTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+        self.klass = Class.objects.create(name="Class", grade="1")
+
+    def test_create_validates_per_item_with_constant_queries(self):
+        items = [{"fname": f"Student{n}", "lname": "Bulk", "student_class": self.klass.id,
+                  "latitude": "30.00000000", "longitude": "31.00000000"} for n in range(200)]
+        items[3] = {"fname": "X", "lname": "Bulk"}
+        items[7]["student_class"] = 999
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/students/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.data['ok'], response.data['errors']), (198, 2))
+        self.assertIn('fname', response.data['results'][3]['errors'])
+        self.assertIn('student_class', response.data['results'][7]['errors'])
+        self.assertLess(len(ctx), 10)
+        self.assertEqual(Student.objects.filter(lname="Bulk").exclude(geohash='').count(), 198)
+
+    def test_update_and_delete(self):
+        students = [Student.objects.create(fname=f"Student{n}", lname="Bulk") for n in range(3)]
+        response = self.client.patch('/api/students/bulk/', [
+            {"id": students[0].id, "lname": "Renamed", "latitude": "30.00000000", "longitude": "31.00000000"},
+            {"id": students[1].id, "fname": "X"},
+            {"id": 999, "lname": "Missing"},
+        ], format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r['status'] for r in response.data['results']], ["updated", "error", "error"])
+        students[0].refresh_from_db()
+        self.assertEqual(students[0].lname, "Renamed")
+        self.assertNotEqual(students[0].geohash, '')
+
+        response = self.client.delete('/api/students/bulk/', [students[1].id, students[2].id], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Student.objects.values_list('id', flat=True)), [students[0].id])
+
+    def test_guardians_with_many_to_many_and_unique_user(self):
+        students = [Student.objects.create(fname=f"Student{n}", lname="Bulk") for n in range(2)]
+        users = [User.objects.create(username=f"guardian{n}") for n in range(2)]
+        ids = [s.id for s in students]
+        response = self.client.post('/api/guardians/bulk/', [
+            {"user": users[0].id, "phone": "1", "students": ids},
+            {"user": users[0].id, "phone": "2", "students": ids},
+            {"user": users[1].id, "phone": "3", "students": ids[:1]},
+        ], format='json')
+        self.assertEqual([r['status'] for r in response.data['results']], ["created", "error", "created"])
+        guardian = Guardian.objects.get(user=users[1])
+        self.assertEqual(list(guardian.students.values_list('id', flat=True)), ids[:1])
+        response = self.client.patch('/api/guardians/bulk/', [{"id": guardian.id, "students": ids}], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(guardian.students.values_list('id', flat=True)), ids)
+        response = self.client.post('/api/guardians/bulk/', [{"user": users[1].id, "phone": "4", "students": []}], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_update_reports_multi_column_duplicates_per_item(self):
+        student = Student.objects.create(fname="Student", lname="Bulk")
+        rows = [Attendance.objects.create(student=student, date=date(2025, 1, day), status="present") for day in (1, 2, 3)]
+        items = [{"id": rows[0].id, "date": "2025-01-10"}, {"id": rows[1].id, "date": "2025-01-10"},
+                 {"id": rows[2].id, "status": "absent"}]
+        response = self.client.patch('/api/attendance/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r['status'] for r in response.data['results']], ["updated", "error", "updated"])
+        self.assertIn('non_field_errors', response.data['results'][1]['errors'])
+        self.assertEqual(sorted(Attendance.objects.values_list('date__day', flat=True)), [2, 3, 10])
+
+        # Whatever validation misses, the database rejects per item instead of failing the request
+        with mock.patch('core.mixins._unique_together', return_value=[]):
+            items = [{"id": rows[1].id, "date": "2025-01-20"}, {"id": rows[2].id, "date": "2025-01-20"}]
+            response = self.client.patch('/api/attendance/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r['status'] for r in response.data['results']], ["updated", "error"])
+        self.assertEqual(sorted(Attendance.objects.values_list('date__day', flat=True)), [3, 10, 20])
+
+
+class RosterTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+        make_fleet(0, 2)
+
+    def upload(self, prefix, name, content):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return self.client.post(f'/api/{prefix}/import/', {"file": SimpleUploadedFile(name, content)}, format='multipart')
+
+    def test_csv_round_trip(self):
+        response = self.client.get('/api/guardians/export/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,phone,user,students')
+        guardian = Guardian.objects.order_by('id').first()
+        student_ids = sorted(guardian.students.values_list('id', flat=True))
+        self.assertEqual(lines[1], f'{guardian.id},1,{guardian.user_id},' + ';'.join(map(str, student_ids)))
+
+        new_user = User.objects.create(username='new')
+        content = lines[1].replace(',1,', ',555,') + f'\n,777,{new_user.id},{student_ids[0]}\n,888,{new_user.id},\n'
+        response = self.upload('guardians', 'guardians.csv', (lines[0] + '\n' + content).encode())
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['errors']), (1, 1, 1))
+        self.assertEqual(response.data['error_rows'][0]['row'], 4)
+        guardian.refresh_from_db()
+        self.assertEqual(guardian.phone, '555')
+        self.assertEqual(list(Guardian.objects.get(user=new_user).students.values_list('id', flat=True)), student_ids[:1])
+
+    def test_xlsx_round_trip_upserts_attendance(self):
+        from io import BytesIO
+        from openpyxl import load_workbook
+        response = self.client.get('/api/attendance/export/?encoding=xlsx')
+        self.assertEqual(response.status_code, 200)
+        workbook = load_workbook(BytesIO(b''.join(response.streaming_content)))
+        sheet = workbook.active
+        self.assertEqual([c.value for c in sheet[1]], ['id', 'date', 'status', 'student'])
+        self.assertEqual(sheet.max_row, Attendance.objects.count() + 1)
+        # Same (student, date) without id: updates instead of failing on the unique constraint
+        sheet.delete_cols(1)
+        for row in sheet.iter_rows(min_row=2):
+            row[1].value = 'absent'
+        buffer = BytesIO()
+        workbook.save(buffer)
+        response = self.upload('attendance', 'attendance.xlsx', buffer.getvalue())
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(set(Attendance.objects.values_list('status', flat=True)), {'absent'})
+        self.assertEqual(Attendance.objects.count(), 4)
+
+
+class TaskTests(APITestCase):
+    def setUp(self):
+        import tempfile
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = self.settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+        make_fleet(0, 1)
+        metrics.reset()
+
+    def test_gps_fan_out_runs_as_timed_tasks(self):
+        bus = Bus.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/gps-tracking/', {"bus": bus.id, "latitude": 30.1, "longitude": 31.1})
+        self.assertEqual(response.status_code, 201)
+        tasks_seen = {row["task"] for row in metrics.snapshot() if row["kind"] == 'task'}
+        self.assertEqual(tasks_seen, {'core.tasks.publish_bus', 'core.tasks.publish_fleet'})
+
+    def test_failed_tasks_are_timed_and_retention_runs_nightly(self):
+        from celery.schedules import crontab
+        from django.conf import settings
+        with mock.patch('core.retention.enforce_retention', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            tasks.enforce_gps_retention.delay()
+        self.assertEqual([(row["task"], row["state"]) for row in metrics.snapshot() if row["kind"] == 'task'],
+                         [("core.tasks.enforce_gps_retention", "FAILURE")])
+        self.assertEqual(settings.CELERY_BEAT_SCHEDULE['enforce-gps-retention']['schedule'], crontab(hour=3, minute=0))
+
+    def test_worker_task_timings_reach_the_stats_of_every_process(self):
+        import time
+        from celery.contrib.testing.worker import start_worker
+        from config.celery import app
+        previous = app.conf.CELERY_BROKER_URL, app.conf.CELERY_TASK_ALWAYS_EAGER
+        app.conf.CELERY_BROKER_URL, app.conf.CELERY_TASK_ALWAYS_EAGER = 'memory://', False
+        self.addCleanup(lambda: setattr(app.conf, 'CELERY_BROKER_URL', previous[0]))
+        self.addCleanup(lambda: setattr(app.conf, 'CELERY_TASK_ALWAYS_EAGER', previous[1]))
+        rows = []
+        with start_worker(app, pool='solo', perform_ping_check=False), app.connection_for_write() as connection:
+            # An explicit connection: the app's producer pool may still point at the default broker
+            tasks.publish_fleet.apply_async(([],), connection=connection)
+            for _ in range(100):
+                rows = [row for row in self.client.get('/api/stats/').data if row['kind'] == 'task']
+                if rows:
+                    break
+                time.sleep(0.05)
+        self.assertEqual([(row['task'], row['state'], row['count']) for row in rows],
+                         [('core.tasks.publish_fleet', 'SUCCESS', 1)])
+        # Read back from the shared store, not from this process's series
+        self.assertFalse([key for key in metrics._series if key[0] == 'task'])
+
+        from .checks import check_shared_cache
+        self.assertEqual(check_shared_cache(None), [])
+        with self.settings(CELERY_TASK_ALWAYS_EAGER=False):
+            self.assertEqual([e.id for e in check_shared_cache(None)], ['core.E004'])
+
+    def test_notification_is_delivered_to_inboxes_only(self):
+        import asyncio
+        from channels.layers import get_channel_layer
+        from .inbox import group_name
+        bus = Bus.objects.get()
+        guardian = Guardian.objects.get(user__username='guardian0')
+        layer = get_channel_layer()
+        inbox_channel = async_to_sync(layer.new_channel)()
+        bus_channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(group_name(guardian.user_id), inbox_channel)
+        # The live map group is unauthenticated: notifications must not reach it
+        async_to_sync(layer.group_add)(f"bus_{bus.id}", bus_channel)
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(title="Delay", message="10 minutes late", bus=bus)
+        message = async_to_sync(layer.receive)(inbox_channel)
+        self.assertEqual(message["type"], "notification")
+        self.assertEqual(json.loads(message["text"])["title"], "Delay")
+
+        async def nothing_for_the_bus():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(bus_channel), 0.1)
+        async_to_sync(nothing_for_the_bus)()
+
+    def test_background_import_and_export_jobs(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        user = User.objects.create(username='new')
+        content = f'phone,user,students\n777,{user.id},{Student.objects.first().id}\n'.encode()
+        response = self.client.post('/api/guardians/import/?background=1',
+                                    {"file": SimpleUploadedFile('guardians.csv', content)}, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        job = self.client.get(response.data['url']).data
+        self.assertEqual(job['state'], 'done')
+        self.assertEqual(job['result']['created'], 1)
+        self.assertTrue(Guardian.objects.filter(user=user, phone='777').exists())
+
+        response = self.client.get('/api/guardians/export/?background=1')
+        self.assertEqual(response.status_code, 202)
+        job = self.client.get(response.data['url']).data
+        self.assertEqual(job['state'], 'done')
+        self.assertNotIn('file_name', job)
+        download = self.client.get(job['result']['file'])
+        self.assertEqual(download.status_code, 200)
+        lines = b''.join(download.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,phone,user,students')
+        self.assertEqual(len(lines), Guardian.objects.count() + 1)
+
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get(response.data['url']).status_code, 404)
+        self.assertEqual(self.client.get(job['result']['file']).status_code, 404)
+
+    def test_background_exports_reject_filters_and_expire(self):
+        self.assertEqual(self.client.get('/api/guardians/export/?background=1&search=x').status_code, 400)
+        response = self.client.get('/api/guardians/export/?background=1&encoding=xlsx')
+        file_url = self.client.get(response.data['url']).data['result']['file']
+        self.assertEqual(tasks.delete_expired_exports(), 0)
+        download = self.client.get(file_url)
+        download.close()
+        self.assertEqual(download.status_code, 200)
+        later = timezone.now() + timedelta(seconds=tasks.JOB_TIMEOUT + 1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(tasks.delete_expired_exports(), 1)
+        self.assertEqual(self.client.get(file_url).status_code, 404)
+
+
+class InboxTests(APITestCase):
+    def setUp(self):
+        make_fleet(0, 2)
+        self.bus = Bus.objects.order_by('id').first()
+        self.guardian = Guardian.objects.get(user__username='guardian0')
+        self.client.force_authenticate(self.guardian.user)
+
+    def test_fan_out_reaches_guardians_of_the_bus(self):
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f"user_{self.guardian.user_id}", channel)
+        with self.captureOnCommitCallbacks(execute=True):
+            notification = Notification.objects.create(title="Delay", message="10 minutes late", bus=self.bus)
+        self.assertEqual(list(notification.recipients.values_list('user_id', flat=True)), [self.guardian.user_id])
+        message = json.loads(async_to_sync(layer.receive)(channel)["text"])
+        self.assertEqual((message["id"], message["inbox_id"]), (notification.id, notification.recipients.get().id))
+        # Running the task again neither duplicates rows nor pushes again
+        self.assertEqual(tasks.deliver_notification(notification.id), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(title="Closed", message="No school tomorrow")
+        self.assertEqual(NotificationRecipient.objects.filter(notification__bus=None).count(), Guardian.objects.count())
+
+    def test_fan_out_batches_once_per_recipient(self):
+        from .inbox import fan_out
+        notification = Notification.objects.create(title="Closed", message="No school tomorrow")
+        NotificationRecipient.objects.create(notification=notification, user=self.guardian.user)
+        # Rows written by an earlier (or concurrent) run are skipped batch by batch
+        with mock.patch('core.inbox.async_to_sync') as push:
+            self.assertEqual(fan_out(notification, batch_size=1), Guardian.objects.count() - 1)
+            self.assertEqual(fan_out(notification, batch_size=1), 0)
+        self.assertEqual(push.call_count, Guardian.objects.count() - 1)
+        self.assertEqual(notification.recipients.count(), Guardian.objects.count())
+
+    def test_inbox_lists_and_marks_read(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Notification.objects.create(title="One", message="1", bus=self.bus)
+            Notification.objects.create(title="Two", message="2", bus=self.bus)
+        response = self.client.get('/api/inbox/?unread=1')
+        self.assertEqual([row['notification']['title'] for row in response.data['results']], ["Two", "One"])
+        entry = first.recipients.get()
+        self.assertIsNotNone(self.client.post(f'/api/inbox/{entry.id}/read/').data['read_at'])
+        self.assertEqual(self.client.get('/api/inbox/unread-count/').data, {"unread": 1})
+        self.assertEqual(self.client.post('/api/inbox/read-all/').data, {"updated": 1})
+        self.assertEqual(self.client.get('/api/inbox/?unread=1').data['results'], [])
+        # Other users' rows are not visible
+        self.client.force_authenticate(User.objects.get(username='guardian1'))
+        self.assertEqual(self.client.post(f'/api/inbox/{entry.id}/read/').status_code, 404)
+
+
+class GPSIngestTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+        make_fleet(0, 1)
+        self.bus = Bus.objects.get()
+
+    def test_bulk_reports_bad_timestamps_per_item(self):
+        points = [
+            {"latitude": 30.1, "longitude": 31.1, "timestamp": "2024-13-45T10:00:00"},
+            {"latitude": 30.1, "longitude": 31.1, "timestamp": "yesterday"},
+            {"latitude": 30.1, "longitude": 31.1, "timestamp": "2024-05-01T10:00:00Z"},
+        ]
+        response = self.client.post('/api/gps-tracking/bulk/', {"bus": self.bus.id, "points": points}, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r['status'] for r in response.data['results']], ['error', 'error', 'created'])
+        self.assertEqual(response.data['results'][0]['errors'], {"timestamp": ["Datetime has wrong format."]})
+
+    def test_fixes_from_the_future_are_rejected(self):
+        future = (timezone.now() + timedelta(hours=1)).isoformat()
+        response = self.client.post('/api/gps-tracking/bulk/', {"bus": self.bus.id, "points": [
+            {"latitude": 30.1, "longitude": 31.1, "timestamp": future},
+            {"latitude": 30.1, "longitude": 31.1, "timestamp": (timezone.now() + timedelta(seconds=5)).isoformat()},
+        ]}, format='json')
+        self.assertEqual([r['status'] for r in response.data['results']], ['error', 'created'])
+        self.assertEqual(response.data['results'][0]['errors'], {"timestamp": ["Datetime is in the future."]})
+        # The single-fix endpoint stamps fixes with the server time
+        response = self.client.post('/api/gps-tracking/', {"bus": self.bus.id, "latitude": 30.1, "longitude": 31.1,
+                                                           "timestamp": future}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertLess(GPSTracking.objects.get(id=response.data['id']).timestamp, timezone.now())
+
+    def post_fixes(self, *points):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/gps-tracking/bulk/', {"points": list(points)}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_location_follows_newest_fix_only(self):
+        other = Bus.objects.create(bus_id="X", title="Other", number="99", capacity=40)
+        BusLocation.objects.all().delete()
+        self.post_fixes(
+            {"bus": self.bus.id, "latitude": 30.1, "longitude": 31.1, "timestamp": "2024-05-01T10:00:00Z"},
+            {"bus": self.bus.id, "latitude": 30.2, "longitude": 31.2, "timestamp": "2024-05-01T10:01:00Z"},
+            {"bus": other.id, "latitude": 29.5, "longitude": 30.5, "timestamp": "2024-05-01T09:00:00Z"},
+        )
+        # A late upload must not move the bus back
+        self.post_fixes({"bus": self.bus.id, "latitude": 30.0, "longitude": 31.0, "timestamp": "2024-05-01T09:59:00Z"})
+        locations = {l.bus_id: (str(l.latitude), str(l.longitude), l.timestamp.isoformat())
+                     for l in BusLocation.objects.all()}
+        self.assertEqual(locations, {
+            self.bus.id: ("30.20000000", "31.20000000", "2024-05-01T10:01:00+00:00"),
+            other.id: ("29.50000000", "30.50000000", "2024-05-01T09:00:00+00:00"),
+        })
+
+        response = self.client.get('/api/buses/fleet/', {"status": "all"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual([row[:3] for row in response.data["buses"]],
+                         [[self.bus.id, 31.2, 30.2], [other.id, 30.5, 29.5]])
+        response = self.client.get('/api/buses/fleet/', {"ids": str(other.id)})
+        self.assertEqual([row[0] for row in response.data["buses"]], [other.id])
+        self.assertEqual(self.client.get('/api/buses/fleet/', {"ids": "a,b"}).status_code, 400)
+
+    def test_backfill_command_fills_buses_with_history(self):
+        from io import StringIO
+        from django.core.management import call_command
+        BusLocation.objects.all().delete()
+        Bus.objects.create(bus_id="N", title="No history", number="98", capacity=40)
+        # History written without signals, as before BusLocation existed
+        newest, = GPSTracking.objects.bulk_create([GPSTracking(
+            bus=self.bus, latitude="30.50000000", longitude="31.50000000", timestamp=timezone.now() + timedelta(minutes=1))])
+        out = StringIO()
+        call_command('backfill_bus_locations', stdout=out)
+        self.assertIn("1 rows created", out.getvalue())
+        location = BusLocation.objects.get()
+        self.assertEqual((location.bus_id, location.timestamp, str(location.latitude)), (self.bus.id, newest.timestamp, "30.50000000"))
+        self.assertEqual(self.client.get('/api/buses/fleet/').data["buses"][0][:3], [self.bus.id, 31.5, 30.5])
+
+        call_command('backfill_bus_locations', stdout=out)
+        self.assertEqual(BusLocation.objects.count(), 1)
+
+
+class RetentionTests(APITestCase):
+    def setUp(self):
+        from datetime import datetime
+        self.bus = Bus.objects.create(bus_id="R", title="Retention", number="9", capacity=40)
+        self.today = timezone.localdate()
+        self.day = self.today - timedelta(days=10)
+        start = timezone.make_aware(datetime.combine(self.day, time(7)))
+        # 30 fixes 10 s apart moving north: 10 survive one-per-30-s downsampling
+        GPSTracking.objects.bulk_create([
+            GPSTracking(bus=self.bus, latitude=f"{30 + n / 10000:.8f}", longitude="31.00000000",
+                        timestamp=start + timedelta(seconds=10 * n))
+            for n in range(30)
+        ])
+        GPSTracking.objects.create(bus=self.bus, latitude="30.00000000", longitude="31.00000000")
+        self.start = start
+
+    def day_fixes(self):
+        return GPSTracking.objects.filter(bus=self.bus, timestamp__date=self.day)
+
+    def test_roll_up_and_downsample(self):
+        from .retention import enforce_retention
+        stats = enforce_retention(raw_days=7, interval=30)
+        self.assertEqual(stats, {"days": 1, "downsampled": 20, "expired": 0})
+        self.assertEqual(self.day_fixes().count(), 10)
+        self.assertEqual(GPSTracking.objects.filter(bus=self.bus).count(), 11)  # today's fix is untouched
+        summary = GPSDailySummary.objects.get(bus=self.bus)
+        self.assertEqual((summary.date, summary.points, summary.kept, summary.complete), (self.day, 30, 10, True))
+        self.assertEqual((summary.first_timestamp, summary.last_timestamp),
+                         (self.start, self.start + timedelta(seconds=290)))
+        self.assertEqual((str(summary.min_latitude), str(summary.max_latitude)), ("30.00000000", "30.00290000"))
+        self.assertAlmostEqual(summary.distance, 322.5, delta=1)
+        # Kept: the first fix of every 30 s bucket
+        self.assertEqual(sorted(self.day_fixes().values_list('timestamp', flat=True)),
+                         [self.start + timedelta(seconds=30 * n) for n in range(10)])
+
+        self.assertEqual(enforce_retention(raw_days=7, interval=30), {"days": 0, "downsampled": 0, "expired": 0})
+        self.assertEqual(self.day_fixes().count(), 10)
+        self.assertEqual(GPSDailySummary.objects.get(bus=self.bus).points, 30)
+
+    def test_interrupted_day_is_rolled_back_and_retried(self):
+        from .retention import enforce_retention
+        with mock.patch('core.retention._delete_ids', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                enforce_retention(raw_days=7, interval=30)
+        self.assertFalse(GPSDailySummary.objects.exists())
+        self.assertEqual(self.day_fixes().count(), 30)
+        self.assertEqual(enforce_retention(raw_days=7, interval=30)["downsampled"], 20)
+        self.assertEqual(GPSDailySummary.objects.get(bus=self.bus).points, 30)
+
+    def test_late_fixes_reopen_their_day(self):
+        from .retention import enforce_retention
+        enforce_retention(raw_days=7, interval=30)
+        # Two late fixes: one into a rolled-up bucket, one into a new bucket
+        GPSTracking.objects.create(bus=self.bus, latitude="30.00100000", longitude="31.00000000",
+                                   timestamp=self.start + timedelta(seconds=35))
+        GPSTracking.objects.create(bus=self.bus, latitude="29.99000000", longitude="31.00000000",
+                                   timestamp=self.start - timedelta(minutes=5))
+        self.assertFalse(GPSDailySummary.objects.get(bus=self.bus).complete)
+        self.assertEqual(enforce_retention(raw_days=7, interval=30), {"days": 1, "downsampled": 1, "expired": 0})
+        summary = GPSDailySummary.objects.get(bus=self.bus)
+        self.assertEqual((summary.points, summary.kept, summary.complete), (32, 11, True))
+        self.assertEqual((summary.first_timestamp, str(summary.min_latitude)),
+                         (self.start - timedelta(minutes=5), "29.99000000"))
+
+        # A late fix for an earlier day that had no fixes at all gets its own roll-up
+        GPSTracking.objects.create(bus=self.bus, latitude="30.00000000", longitude="31.00000000",
+                                   timestamp=self.start - timedelta(days=2))
+        self.assertEqual(enforce_retention(raw_days=7, interval=30)["days"], 1)
+        self.assertEqual(GPSDailySummary.objects.get(bus=self.bus, date=self.day - timedelta(days=2)).points, 1)
+
+    def test_history_days_expire_old_fixes(self):
+        from .retention import enforce_retention
+        stats = enforce_retention(raw_days=7, interval=30, history_days=9)
+        self.assertEqual(stats["expired"], 10)
+        self.assertFalse(self.day_fixes().exists())
+        with self.assertRaises(ValueError):
+            enforce_retention(raw_days=7, history_days=3)
+
+    def test_deletes_stay_under_the_bound_parameter_limit(self):
+        from .retention import enforce_retention
+        with mock.patch.object(connection.features, 'max_query_params', 8), \
+                CaptureQueriesContext(connection) as ctx:
+            stats = enforce_retention(raw_days=7, interval=30, batch_size=5000)
+        self.assertEqual(stats["downsampled"], 20)
+        self.assertEqual(sum(1 for query in ctx if query['sql'].startswith('DELETE')), 3)
+
+
+class FleetLiveConsumerTests(APITransactionTestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.buses = [Bus.objects.create(bus_id=f"F{n}", title=f"Fleet {n}", number=str(n), capacity=40) for n in range(2)]
+        self.parked = Bus.objects.create(bus_id="P", title="Parked", number="9", capacity=40, status="inactive")
+        BusLocation.objects.bulk_create([
+            BusLocation(bus=bus, latitude="30.00000000", longitude="31.00000000", timestamp=now)
+            for bus in self.buses + [self.parked]
+        ])
+        self.stamp = now.isoformat()
+        self.user = User.objects.create(username='dispatcher')
+
+    def row(self, bus, n):
+        return [bus.id, 31 + n, 30 + n, self.stamp]
+
+    def test_rejects_anonymous_users(self):
+        from django.contrib.auth.models import AnonymousUser
+
+        async def run():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/buses/live/')
+            communicator.scope['user'] = AnonymousUser()
+            self.assertEqual(await communicator.connect(), (False, 4003))
+        async_to_sync(run)()
+
+    def test_full_frame_then_coalesced_deltas(self):
+        from channels.layers import get_channel_layer
+        from .live import FLEET_FIELDS, FLEET_GROUP
+
+        async def run():
+            layer = get_channel_layer()
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/buses/live/')
+            communicator.scope['user'] = self.user
+            self.assertEqual((await communicator.connect())[0], True)
+            frame = await communicator.receive_json_from()
+            self.assertEqual((frame["type"], frame["fields"]), ("fleet", FLEET_FIELDS))
+            self.assertEqual([row[:3] for row in frame["buses"]], [[bus.id, 31.0, 30.0] for bus in self.buses])
+
+            # The first update goes out at once and opens the push window
+            await layer.group_send(FLEET_GROUP, {"type": "fleet.update", "rows": [self.row(self.buses[0], 1)]})
+            self.assertEqual(await communicator.receive_json_from(),
+                             {"type": "delta", "fields": FLEET_FIELDS, "buses": [self.row(self.buses[0], 1)]})
+            # Updates inside the window: one delta with the latest row per bus, other statuses left out
+            for n in (2, 3):
+                await layer.group_send(FLEET_GROUP, {"type": "fleet.update", "rows": [
+                    self.row(self.buses[0], n), self.row(self.buses[1], n), self.row(self.parked, n)]})
+            self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+            self.assertEqual(await communicator.receive_json_from(timeout=2),
+                             {"type": "delta", "fields": FLEET_FIELDS,
+                              "buses": [self.row(self.buses[0], 3), self.row(self.buses[1], 3)]})
+            self.assertTrue(await communicator.receive_nothing(timeout=0.5))
+            await communicator.disconnect()
+        with mock.patch('core.consumers.FLEET_PUSH_INTERVAL', 0.4):
+            async_to_sync(run)()
+
+
+class DriverGPSConsumerTests(APITransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='driver')
+        self.bus = Bus.objects.create(bus_id="D", title="Driver bus", number="7", capacity=40)
+
+    def communicator(self, user=None, bus_id=None):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/buses/{bus_id or self.bus.id}/gps/')
+        communicator.scope['user'] = user or self.user
+        return communicator
+
+    def fix(self, n):
+        return {"latitude": 30 + n / 1000, "longitude": 31,
+                "timestamp": (timezone.now() - timedelta(minutes=10) + timedelta(seconds=n)).isoformat()}
+
+    def test_rejects_anonymous_users_and_unknown_buses(self):
+        from django.contrib.auth.models import AnonymousUser
+
+        async def run():
+            for communicator in (self.communicator(AnonymousUser()), self.communicator(bus_id=999)):
+                self.assertEqual(await communicator.connect(), (False, 4003))
+        async_to_sync(run)()
+
+    def test_acks_flushed_fixes_and_reports_invalid_ones(self):
+        async def run():
+            communicator = self.communicator()
+            self.assertEqual((await communicator.connect())[0], True)
+            await communicator.send_json_to({"points": [self.fix(0), {"latitude": 100}, self.fix(1)]})
+            error = await communicator.receive_json_from()
+            self.assertEqual([item["index"] for item in error["rejected"]], [1])
+            self.assertEqual(await communicator.receive_json_from(timeout=2), {"type": "ack", "saved": 2})
+            await communicator.disconnect()
+        with mock.patch('core.consumers.GPS_FLUSH_INTERVAL', 0.05):
+            async_to_sync(run)()
+        self.assertEqual(GPSTracking.objects.filter(bus=self.bus).count(), 2)
+
+    def test_flushes_everything_on_disconnect_and_applies_back_pressure(self):
+        async def run():
+            communicator = self.communicator()
+            await communicator.connect()
+            await communicator.send_json_to([self.fix(n) for n in range(7)])
+            error = await communicator.receive_json_from()
+            self.assertEqual([item["index"] for item in error["rejected"]], [5, 6])
+            await communicator.disconnect()
+        with mock.patch('core.consumers.GPS_FLUSH_INTERVAL', 60), mock.patch('core.consumers.GPS_BATCH_MAX', 2), \
+                mock.patch('core.consumers.GPS_BUFFER_MAX', 5), mock.patch('core.consumers.GPS_FLUSH_SIZE', 100):
+            async_to_sync(run)()
+        self.assertEqual(GPSTracking.objects.filter(bus=self.bus).count(), 5)
+
+    def test_keeps_fixes_when_the_database_fails(self):
+        from django.db import DatabaseError
+        from .ingest import save_fixes
+        calls = []
+
+        def flaky(fixes):
+            calls.append(len(fixes))
+            if len(calls) == 1:
+                raise DatabaseError("down")
+            return save_fixes(fixes)
+
+        async def run():
+            communicator = self.communicator()
+            await communicator.connect()
+            await communicator.send_json_to([self.fix(n) for n in range(3)])
+            self.assertEqual(await communicator.receive_json_from(timeout=2), {"type": "ack", "saved": 3})
+            await communicator.disconnect()
+        with mock.patch('core.consumers.GPS_FLUSH_INTERVAL', 0.05), mock.patch('core.consumers.save_fixes', flaky), \
+                mock.patch('core.consumers.logger'):
+            async_to_sync(run)()
+        self.assertEqual(calls, [3, 3])
+        self.assertEqual(GPSTracking.objects.filter(bus=self.bus).count(), 3)
+
+
+def decode_polyline(encoded, precision=5):
+    values, value, shift = [], 0, 0
+    for char in encoded:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1f) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    points, lat, lon = [], 0, 0
+    for dlat, dlon in zip(values[::2], values[1::2]):
+        lat, lon = lat + dlat, lon + dlon
+        points.append((lat / 10 ** precision, lon / 10 ** precision))
+    return points
+
+
+class TrackExportTests(APITestCase):
+    def setUp(self):
+        from datetime import datetime
+        self.user = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+        self.bus = Bus.objects.create(bus_id="T", title="Track", number="3", capacity=40)
+        self.start = timezone.make_aware(datetime(2025, 3, 1, 7, 0))
+        # East along a street, then a right-angle turn north
+        coordinates = [(30.0, 31.0 + n * 0.001) for n in range(5)] + [(30.0 + n * 0.001, 31.004) for n in range(1, 5)]
+        GPSTracking.objects.bulk_create([
+            GPSTracking(bus=self.bus, latitude=f"{lat:.8f}", longitude=f"{lon:.8f}",
+                        timestamp=self.start + timedelta(seconds=15 * n))
+            for n, (lat, lon) in enumerate(coordinates)
+        ])
+        self.coordinates = coordinates
+        self.times = [int((self.start + timedelta(seconds=15 * n)).timestamp() * 1000) for n in range(len(coordinates))]
+
+    def url(self, **params):
+        from urllib.parse import urlencode
+        query = {"start": self.start.isoformat(), "end": (self.start + timedelta(hours=1)).isoformat(), **params}
+        return f'/api/buses/{self.bus.id}/track/?{urlencode(query)}'
+
+    def test_milliseconds_are_exact(self):
+        from datetime import timezone as tz
+        from .tracks import load_track
+        # 1082227707817 / 1000 has no exact float: timestamp() * 1000 gives ...816.99
+        timestamp = datetime(2004, 4, 17, 18, 48, 27, 817000, tzinfo=tz.utc)
+        self.assertEqual(load_track([(timestamp, 30, 31)])[0].tolist(), [1082227707817])
+
+    def test_polyline_round_trip(self):
+        from itertools import accumulate
+        data = self.client.get(self.url()).data
+        self.assertEqual(data['count'], 9)
+        self.assertEqual(list(accumulate(data['times'])), self.times)
+        for decoded, source in zip(decode_polyline(data['polyline']), self.coordinates):
+            self.assertAlmostEqual(decoded[0], source[0], places=5)
+            self.assertAlmostEqual(decoded[1], source[1], places=5)
+
+    def test_msgpack_round_trip(self):
+        from itertools import accumulate
+        response = self.client.get(self.url(encoding='msgpack'))
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        data = msgpack.unpackb(response.content)
+        self.assertEqual((data['bus'], data['count']), (self.bus.id, 9))
+        self.assertEqual(list(accumulate(data['times'])), self.times)
+        self.assertEqual(list(zip(data['lat'], data['lon'])), self.coordinates)
+
+    def test_binary_round_trip(self):
+        import struct
+        body = self.client.get(self.url(encoding='binary')).content
+        self.assertEqual(body[:4], b'TRK1')
+        (count,) = struct.unpack_from('<I', body, 4)
+        self.assertEqual(count, 9)
+        times = struct.unpack_from(f'<{count}q', body, 8)
+        lats = struct.unpack_from(f'<{count}d', body, 8 + 8 * count)
+        lons = struct.unpack_from(f'<{count}d', body, 8 + 16 * count)
+        self.assertEqual(list(times), self.times)
+        self.assertEqual(list(zip(lats, lons)), self.coordinates)
+
+    def test_simplify_keeps_the_corner(self):
+        data = msgpack.unpackb(self.client.get(self.url(encoding='msgpack', tolerance=5)).content)
+        self.assertEqual(list(zip(data['lat'], data['lon'])), [self.coordinates[0], self.coordinates[4], self.coordinates[-1]])
+
+    def test_bad_ranges_and_parameters(self):
+        for params in ({"end": self.start.isoformat()}, {"start": "yesterday"}, {"tolerance": "far"},
+                       {"end": (self.start + timedelta(days=8)).isoformat()}, {"encoding": "xml"}):
+            with self.subTest(params=params):
+                response = self.client.get(self.url(**params))
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('detail', response.data)
@@ -0,0 +1,100 @@
+import math
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta, timezone
+from .geo import EARTH_RADIUS_M
+
+TRACK_MAGIC = b'TRK1'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def load_track(fixes):
+    """Turn ``(timestamp, latitude, longitude)`` rows into columns: epoch milliseconds, lats, lons."""
+    times, lats, lons = array('q'), array('d'), array('d')
+    for timestamp, latitude, longitude in fixes:
+        # Integer arithmetic: timestamp() * 1000 goes through a float and can land 1 ms low
+        times.append((timestamp - EPOCH) // timedelta(milliseconds=1))
+        lats.append(float(latitude))
+        lons.append(float(longitude))
+    return times, lats, lons
+
+
+def simplify(times, lats, lons, tolerance):
+    """
+    Douglas-Peucker simplification with a tolerance in meters.
+    Uses an equirectangular projection around the track, which is accurate enough at city scale.
+    """
+    n = len(lats)
+    if n < 3 or tolerance <= 0:
+        return times, lats, lons
+    k = math.pi / 180 * EARTH_RADIUS_M
+    kx = k * math.cos(math.radians(sum(lats) / n))
+    xs = [lon * kx for lon in lons]
+    ys = [lat * k for lat in lats]
+    keep = bytearray(n)
+    keep[0] = keep[-1] = 1
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xs[first], ys[first]
+        dx, dy = xs[last] - ax, ys[last] - ay
+        length = math.hypot(dx, dy)
+        worst, worst_distance = None, tolerance
+        for i in range(first + 1, last):
+            if length:
+                distance = abs(dy * (xs[i] - ax) - dx * (ys[i] - ay)) / length
+            else:
+                distance = math.hypot(xs[i] - ax, ys[i] - ay)
+            if distance > worst_distance:
+                worst, worst_distance = i, distance
+        if worst is not None:
+            keep[worst] = 1
+            stack.append((first, worst))
+            stack.append((worst, last))
+    index = [i for i in range(n) if keep[i]]
+    return (
+        array('q', (times[i] for i in index)),
+        array('d', (lats[i] for i in index)),
+        array('d', (lons[i] for i in index)),
+    )
+
+
+def deltas(values):
+    """Delta-encode a sequence of integers (first value kept as is)."""
+    out = []
+    previous = 0
+    for value in values:
+        out.append(value - previous)
+        previous = value
+    return out
+
+
+def encode_polyline(lats, lons, precision=5):
+    """Encoded Polyline Algorithm Format (as used by Google Maps / Mapbox)."""
+    factor = 10 ** precision
+    chunks = []
+    previous_lat = previous_lon = 0
+    for lat, lon in zip(lats, lons):
+        lat_e5 = int(round(lat * factor))
+        lon_e5 = int(round(lon * factor))
+        for delta in (lat_e5 - previous_lat, lon_e5 - previous_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        previous_lat, previous_lon = lat_e5, lon_e5
+    return ''.join(chunks)
+
+
+def pack_columns(times, lats, lons):
+    """
+    Little-endian columnar buffer: ``b'TRK1'``, uint32 count, then int64 epoch-ms
+    timestamps, float64 latitudes and float64 longitudes, one column after the other.
+    """
+    columns = [array(c.typecode, c) for c in (times, lats, lons)]
+    if sys.byteorder != 'little':
+        for column in columns:
+            column.byteswap()
+    return TRACK_MAGIC + struct.pack('<I', len(times)) + b''.join(c.tobytes() for c in columns)
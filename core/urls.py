@@ -4,7 +4,7 @@ from .views import (
     BusViewSet, AdminViewSet, SupervisorViewSet, DriverViewSet, StudentViewSet, GuardianViewSet,
     AttendanceViewSet, AnnouncementViewSet, BusAssignmentViewSet, BusRouteViewSet, BusRoutePointViewSet,
     TripViewSet, TripStudentViewSet, FeedbackViewSet, MaintenanceLogViewSet, NotificationViewSet,
-    ReminderViewSet, GPSTrackingViewSet, ClassViewSet, health
+    InboxViewSet, ReminderViewSet, GPSTrackingViewSet, GPSDailySummaryViewSet, ClassViewSet, JobFileView, JobView, StatsView, health
 )
 
 router = DefaultRouter()
@@ -24,11 +24,16 @@ router.register(r'trip-students', TripStudentViewSet)
 router.register(r'feedback', FeedbackViewSet)
 router.register(r'maintenance-logs', MaintenanceLogViewSet)
 router.register(r'notifications', NotificationViewSet)
+router.register(r'inbox', InboxViewSet)
 router.register(r'reminders', ReminderViewSet)
 router.register(r'gps-tracking', GPSTrackingViewSet)
+router.register(r'gps-daily-summaries', GPSDailySummaryViewSet)
 router.register(r'classes', ClassViewSet)
 
 urlpatterns = [
     path('health/', health, name='health'),
+    path('stats/', StatsView.as_view(), name='stats'),
+    path('jobs/<str:job_id>/', JobView.as_view(), name='job-detail'),
+    path('jobs/<str:job_id>/file/', JobFileView.as_view(), name='job-file'),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,36 @@
+import time
+from django.core.cache import cache
+
+
+def _key(model):
+    return f"version:{model._meta.label_lower}"
+
+
+def _modified_key(model):
+    return f"version:{model._meta.label_lower}:modified"
+
+
+def current(model):
+    """
+    Return ``(version, last_modified)`` of a model's table: a counter bumped on every write
+    and the Unix time of that write. Neither costs a query.
+    """
+    version = cache.get(_key(model))
+    if version is None:
+        # Cold cache: start from the clock so a counter lost to eviction never repeats an old value
+        now = int(time.time())
+        cache.add(_key(model), time.time_ns(), None)
+        cache.add(_modified_key(model), now, None)
+        version = cache.get(_key(model))
+    return version, cache.get(_modified_key(model)) or int(time.time())
+
+
+def bump(*models):
+    """Mark the tables of ``models`` as changed."""
+    now = int(time.time())
+    for model in set(models):
+        try:
+            cache.incr(_key(model))
+        except ValueError:
+            cache.set(_key(model), time.time_ns(), None)
+        cache.set(_modified_key(model), now, None)
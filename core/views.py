@@ -1,21 +1,110 @@
+import json
+import os
+from datetime import timedelta
+import msgpack
 from django.shortcuts import render
-from django.http import HttpResponse, JsonResponse
-from rest_framework import viewsets
+from django.http import FileResponse, HttpResponse, JsonResponse, Http404
+from rest_framework import mixins, viewsets, status, renderers
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date, parse_datetime
 from .models import (
     Bus, Admin, Supervisor, Driver, Student, Guardian, Attendance, Announcement,
     BusAssignment, BusRoute, BusRoutePoint, Trip, TripStudent, Feedback,
-    MaintenanceLog, Notification, Reminder, GPSTracking, Class
+    MaintenanceLog, Notification, NotificationRecipient, Reminder, GPSTracking, GPSDailySummary, Class, sync_geohash
 )
 from .serializers import (
     BusSerializer, AdminSerializer, SupervisorSerializer, DriverSerializer, StudentSerializer, GuardianSerializer,
     AttendanceSerializer, AnnouncementSerializer, BusAssignmentSerializer, BusRouteSerializer, BusRoutePointSerializer,
     TripSerializer, TripStudentSerializer, FeedbackSerializer, MaintenanceLogSerializer, NotificationSerializer,
-    ReminderSerializer, GPSTrackingSerializer, ClassSerializer
+    NotificationRecipientSerializer, ReminderSerializer, GPSTrackingSerializer, GPSDailySummarySerializer, ClassSerializer
 )
+from . import metrics
+from .mixins import BulkModelViewSetMixin, ConditionalGetMixin, FastListMixin, QueryPlanMixin
+from .roster import RosterMixin
+from .pagination import AttendancePagination, InboxPagination, NotificationPagination, GPSTrackingPagination
+from .live import get_snapshot, get_static, get_position, positions, fleet_row, FLEET_FIELDS
+from .ingest import GPS_BATCH_MAX, parse_fixes, save_fixes
+from .tracks import load_track, simplify, deltas, encode_polyline, pack_columns
+from .eta import get_eta
+from .nearby import NEARBY_MAX_RADIUS, bus_coordinates, next_stop, stops_near, students_near
+from .signals import buses_for_students
+from . import live, tasks
+
+TRACK_EXPORT_MAX_DAYS = getattr(settings, 'TRACK_EXPORT_MAX_DAYS', 7)
+
+
+def radius_param(request, default=500):
+    """``?radius=`` in meters, capped at NEARBY_MAX_RADIUS; raises ValueError when invalid."""
+    radius = float(request.query_params.get('radius', default))
+    if not 0 < radius <= NEARBY_MAX_RADIUS:
+        raise ValueError(f"radius must be between 0 and {NEARBY_MAX_RADIUS} meters.")
+    return radius
+
+
+def stop_row(stop, distance):
+    return {"id": stop.id, "route": stop.route_id, "order": stop.order, "location_name": stop.location_name,
+            "latitude": stop.latitude, "longitude": stop.longitude, "distance": round(distance, 1)}
+
+class PrometheusRenderer(renderers.BaseRenderer):
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):  # errors (e.g. 403) are not metric rows
+            return json.dumps(data)
+        return metrics.prometheus(data)
+
+
+class StatsView(APIView):
+    """
+    Request statistics collected by RequestStatsMiddleware (REQUEST_STATS_ENABLED), per process,
+    and Celery task timings, which every worker records in the shared cache.
+    - JSON by default, Prometheus text with ``?format=prometheus``.
+    - DELETE resets the counters.
+    """
+    permission_classes = [IsAdminUser]
+    renderer_classes = [renderers.JSONRenderer, PrometheusRenderer]
+
+    def get(self, request):
+        return Response(metrics.snapshot())
+
+    def delete(self, request):
+        metrics.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+def _user_job(request, job_id):
+    job = tasks.get_job(job_id)
+    if job is None or (job.get("user") != request.user.pk and not request.user.is_staff):
+        raise Http404
+    return job
+
+class JobView(APIView):
+    """Status of a background job (``?background=1`` imports/exports); visible to its owner and staff."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = _user_job(request, job_id)
+        return Response({key: value for key, value in job.items() if key not in ("user", "file_name")})
+
+class JobFileView(APIView):
+    """Download of a finished export job, with the same access rule as JobView."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        name = _user_job(request, job_id).get("file_name")
+        if not name or not default_storage.exists(name):
+            raise Http404
+        return FileResponse(default_storage.open(name, 'rb'), as_attachment=True, filename=os.path.basename(name))
 
 # Create your views here.
 def index(request):
@@ -25,7 +114,7 @@ def index(request):
 def health(request):
     return JsonResponse({"status": "ok"})
 
-class BusViewSet(viewsets.ModelViewSet):
+class BusViewSet(ConditionalGetMixin, FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing buses.
     - Filtering, searching, ordering enabled.
@@ -35,269 +124,495 @@ class BusViewSet(viewsets.ModelViewSet):
     queryset = Bus.objects.all()
     serializer_class = BusSerializer
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = ['status']
     search_fields = ['title', 'number', 'bus_id', 'status']
-    ordering_fields = '__all__'
+    ordering_fields = ['id', 'title']
     def get_serializer_context(self):
         return {'request': self.request}
 
-    @action(detail=True, methods=['get'], url_path='live')
-    def live(self, request, pk=None):
+    @action(detail=False, methods=['get'], url_path='fleet')
+    def fleet(self, request):
+        """
+        Last known position of all active buses in one compact payload.
+        - ``?status=`` picks another bus status (``all`` for every bus).
+        - ``?ids=1,2,3`` restricts the result to those buses.
+        """
+        status_filter = request.query_params.get('status', 'active')
+        ids = request.query_params.get('ids')
+        try:
+            bus_ids = [int(i) for i in ids.split(',') if i] if ids else None
+        except ValueError:
+            return Response({"detail": "ids must be a comma separated list of integers."}, status=status.HTTP_400_BAD_REQUEST)
+        rows = [fleet_row(p) for p in positions(bus_ids, None if status_filter == 'all' else status_filter)]
+        return Response({"fields": FLEET_FIELDS, "count": len(rows), "buses": rows})
+
+    @action(detail=True, methods=['get'], url_path='track')
+    def track(self, request, pk=None):
+        """
+        GPS track of a bus between ``?start=`` and ``?end=`` (ISO datetimes, default: today so far).
+        - ``?encoding=polyline`` (default): JSON with an encoded polyline and delta-encoded epoch-ms times.
+        - ``?encoding=msgpack``: msgpack map with delta-encoded times and lat/lon arrays.
+        - ``?encoding=binary``: packed columns, see ``core.tracks.pack_columns``.
+        - ``?tolerance=`` simplifies the track (Douglas-Peucker, meters).
+        """
         bus = self.get_object()
-        now = timezone.localtime()
-        today = now.date()
-        # Latest GPS for this bus
-        latest = GPSTracking.objects.filter(bus=bus).order_by('-timestamp').first()
-        # Current or last trip
-        trip = Trip.objects.select_related('route').filter(
-            bus=bus, date=today, start_time__lte=now.time(), end_time__gte=now.time()
-        ).first()
-        if not trip:
-            trip = Trip.objects.select_related('route').filter(bus=bus).order_by('-date', '-start_time').first()
-        route = trip.route if trip else BusRoute.objects.filter(bus=bus).order_by('-id').first()
-        route_points = list(BusRoutePoint.objects.filter(route=route).order_by('order')) if route else []
-        # Students on the trip or assigned to the bus
-        if trip:
-            trip_students = TripStudent.objects.select_related('student').filter(trip=trip)
-            students = [ts.student for ts in trip_students]
-        else:
-            students = list(Student.objects.filter(busassignment__bus=bus).distinct())
+        now = timezone.now()
+        try:
+            start = self._track_datetime(request, 'start', timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0))
+            end = self._track_datetime(request, 'end', now)
+            tolerance = float(request.query_params.get('tolerance', 0))
+        except ValueError as exc:
+            return Response({"detail": str(exc) or "Invalid tolerance."}, status=status.HTTP_400_BAD_REQUEST)
+        if end <= start:
+            return Response({"detail": "end must be after start."}, status=status.HTTP_400_BAD_REQUEST)
+        if end - start > timedelta(days=TRACK_EXPORT_MAX_DAYS):
+            return Response({"detail": f"At most {TRACK_EXPORT_MAX_DAYS} days per export."}, status=status.HTTP_400_BAD_REQUEST)
+        encoding = request.query_params.get('encoding', 'polyline')
+        if encoding not in ('polyline', 'msgpack', 'binary'):
+            return Response({"detail": "encoding must be polyline, msgpack or binary."}, status=status.HTTP_400_BAD_REQUEST)
 
-        features = []
-        # Bus current position
-        if latest:
-            try:
-                bus_lon = float(latest.longitude)
-                bus_lat = float(latest.latitude)
-                features.append({
-                    "type": "Feature",
-                    "geometry": {"type": "Point", "coordinates": [bus_lon, bus_lat]},
-                    "properties": {
-                        "kind": "bus",
-                        "bus_id": bus.id,
-                        "title": bus.title,
-                        "number": bus.number,
-                        "timestamp": latest.timestamp.isoformat(),
-                    },
-                })
-            except (TypeError, ValueError):
-                pass
-
-        # Route as LineString + stops
-        if route_points:
-            coords = []
-            for p in route_points:
-                try:
-                    coords.append([float(p.longitude), float(p.latitude)])
-                except (TypeError, ValueError):
-                    continue
-            if coords:
-                features.append({
-                    "type": "Feature",
-                    "geometry": {"type": "LineString", "coordinates": coords},
-                    "properties": {"kind": "route", "route_name": route.route_name if route else None},
-                })
-            for p in route_points:
-                try:
-                    lon = float(p.longitude)
-                    lat = float(p.latitude)
-                except (TypeError, ValueError):
-                    continue
-                features.append({
-                    "type": "Feature",
-                    "geometry": {"type": "Point", "coordinates": [lon, lat]},
-                    "properties": {"kind": "stop", "order": p.order, "location_name": p.location_name},
-                })
-
-        # Students points
-        for s in students:
-            if s.latitude is not None and s.longitude is not None:
-                try:
-                    lon = float(s.longitude)
-                    lat = float(s.latitude)
-                except (TypeError, ValueError):
-                    continue
-                features.append({
-                    "type": "Feature",
-                    "geometry": {"type": "Point", "coordinates": [lon, lat]},
-                    "properties": {
-                        "kind": "student",
-                        "id": s.id,
-                        "name": f"{s.fname} {s.lname}".strip(),
-                        "registration_code": s.registration_code,
-                    },
-                })
-
-        data = {
-            "type": "FeatureCollection",
-            "features": features,
-            "meta": {
-                "bus": {"id": bus.id, "title": bus.title, "number": bus.number, "status": bus.status, "bus_id": bus.bus_id},
-                "trip": ({
-                    "id": trip.id,
-                    "date": trip.date.isoformat(),
-                    "start_time": trip.start_time.isoformat(),
-                    "end_time": trip.end_time.isoformat(),
-                    "route_name": trip.route.route_name if trip and trip.route else None,
-                } if trip else None),
-                "counts": {"route_points": len(route_points) if route_points else 0, "students": len(students)},
-            },
-        }
+        fixes = GPSTracking.objects.filter(bus=bus, timestamp__gte=start, timestamp__lt=end).order_by('timestamp')
+        times, lats, lons = load_track(fixes.values_list('timestamp', 'latitude', 'longitude').iterator(chunk_size=2000))
+        times, lats, lons = simplify(times, lats, lons, tolerance)
+
+        if encoding == 'binary':
+            return HttpResponse(pack_columns(times, lats, lons), content_type='application/octet-stream')
+        if encoding == 'msgpack':
+            body = msgpack.packb({"bus": bus.id, "count": len(times), "times": deltas(times), "lat": list(lats), "lon": list(lons)})
+            return HttpResponse(body, content_type='application/msgpack')
+        return Response({
+            "bus": bus.id,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "count": len(times),
+            "times": deltas(times),
+            "polyline": encode_polyline(lats, lons),
+        })
+
+    def _track_datetime(self, request, name, default):
+        value = request.query_params.get(name)
+        if not value:
+            return default
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"{name} must be an ISO 8601 datetime.")
+        return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+    @action(detail=True, methods=['get'], url_path='next-stop')
+    def next_stop(self, request, pk=None):
+        """The stop of the current route the bus is heading to, with its distance in meters."""
+        bus = self.get_object()
+        found = next_stop(bus.id)
+        if found is None:
+            return Response({"bus": bus.id, "stop": None})
+        stop, distance = found
+        return Response({"bus": bus.id, "stop": dict(stop, distance=round(distance, 1))})
+
+    @action(detail=True, methods=['get'], url_path='students-nearby')
+    def students_nearby(self, request, pk=None):
+        """
+        Students whose pickup location is within ``?radius=`` meters (default 500) of the bus.
+        Only students assigned to the bus, unless ``?scope=all``.
+        """
+        bus = self.get_object()
+        try:
+            radius = radius_param(request)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        coordinates = bus_coordinates(bus.id)
+        if coordinates is None:
+            return Response({"detail": "The bus has no known position."}, status=status.HTTP_409_CONFLICT)
+        found = students_near(*coordinates, radius, None if request.query_params.get('scope') == 'all' else bus.id)
+        return Response({"bus": bus.id, "radius": radius, "students": [
+            {"id": s.id, "name": f"{s.fname} {s.lname}".strip(), "latitude": s.latitude, "longitude": s.longitude,
+             "distance": round(distance, 1)}
+            for distance, s in found
+        ]})
+
+    @action(detail=True, methods=['get'], url_path='eta')
+    def eta(self, request, pk=None):
+        """
+        Distance and ETA of every stop still ahead of the bus on its current route.
+        ``?stop=<id>`` returns only that stop. Served from a per-bus cache advanced by each GPS fix.
+        """
+        data = self._live_layer(get_eta, pk)
+        stop = request.query_params.get('stop')
+        if stop:
+            data["stops"] = [row for row in data["stops"] if str(row["id"]) == stop]
         return Response(data)
 
-class AdminViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'], url_path='live')
+    def live(self, request, pk=None):
+        return Response(self._live_layer(get_snapshot, pk))
+
+    @action(detail=True, methods=['get'], url_path='live/static')
+    def live_static(self, request, pk=None):
+        """
+        Route, stops and student pins for the live map.
+        Changes rarely; send the ETag back as If-None-Match to get a 304.
+        """
+        data = self._live_layer(get_static, pk)
+        etag = f'"{data["version"]}"'
+        # Parses the If-None-Match list (``*``, weak tags) like ConditionalGetMixin
+        response = get_conditional_response(request._request, etag=etag) or Response(data)
+        response['ETag'] = etag
+        return response
+
+    @action(detail=True, methods=['get'], url_path='live/position')
+    def live_position(self, request, pk=None):
+        """Current bus position plus the static layer version it belongs to."""
+        return Response(self._live_layer(get_position, pk))
+
+    def _live_layer(self, getter, pk):
+        try:
+            data = getter(int(pk))
+        except (TypeError, ValueError):
+            data = None
+        if data is None:
+            raise Http404
+        return data
+
+class AdminViewSet(FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Admin.objects.all()
     serializer_class = AdminSerializer
     permission_classes = [IsAdminUser]
-    filterset_fields = '__all__'
+    filterset_fields = ['user']
     search_fields = ['user__username', 'user__email', 'phone']
-    ordering_fields = '__all__'
+    ordering_fields = ['id']
 
-class SupervisorViewSet(viewsets.ModelViewSet):
+class SupervisorViewSet(FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Supervisor.objects.all()
     serializer_class = SupervisorSerializer
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = ['user', 'assigned_bus']
     search_fields = ['user__username', 'assigned_bus__title', 'assigned_bus__number']
-    ordering_fields = '__all__'
+    ordering_fields = ['id']
 
-class DriverViewSet(viewsets.ModelViewSet):
+class DriverViewSet(FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Driver.objects.all()
     serializer_class = DriverSerializer
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = ['user', 'assigned_bus']
     search_fields = ['user__username', 'license_number', 'assigned_bus__title', 'assigned_bus__number']
-    ordering_fields = '__all__'
+    ordering_fields = ['id']
 
-class StudentViewSet(viewsets.ModelViewSet):
+class StudentViewSet(RosterMixin, BulkModelViewSetMixin, FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing students.
     - Filtering, searching, ordering enabled.
     - Pagination enabled.
     - Example request/response in Swagger.
     """
-    queryset = Student.objects.select_related('student_class').all()
+    queryset = Student.objects.all()
     serializer_class = StudentSerializer
+    fast_list = True
     permission_classes = [IsAuthenticated]
-    # Avoid ImageField in auto filter generation (breaks django-filter schema for Swagger)
-    filterset_fields = [
-        'fname', 'lname', 'father', 'gender', 'student_class', 'section',
-        'dob', 'phone', 'email', 'address', 'city', 'registration_code', 'reg_code_status',
-        'request_date', 'request_time', 'request', 'qrcode', 'latitude', 'longitude'
-    ]
+    filterset_fields = ['student_class', 'reg_code_status', 'registration_code']
     search_fields = ['fname', 'lname', 'registration_code']
-    ordering_fields = '__all__'
+    ordering_fields = ['id', 'lname']
     def get_serializer_context(self):
         return {'request': self.request}
 
-class GuardianViewSet(viewsets.ModelViewSet):
+    def bulk_prepare(self, instances):
+        for student in instances:
+            sync_geohash(student, {})
+        return ['geohash']
+
+    def bulk_changed(self, instances):
+        live.invalidate(*buses_for_students([s.pk for s in instances if s.pk]))
+
+class GuardianViewSet(RosterMixin, BulkModelViewSetMixin, FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Guardian.objects.all()
+    prefetch_related_fields = [Prefetch('students', queryset=Student.objects.only('id'))]
     serializer_class = GuardianSerializer
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = ['user']
     search_fields = ['user__username', 'user__email', 'phone']
-    ordering_fields = '__all__'
+    ordering_fields = ['id']
 
-class AttendanceViewSet(viewsets.ModelViewSet):
+class AttendanceViewSet(RosterMixin, BulkModelViewSetMixin, FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Attendance.objects.all()
     serializer_class = AttendanceSerializer
+    fast_list = True
+    bulk_upsert_fields = ('student', 'date')
+    pagination_class = AttendancePagination
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = ['student', 'date', 'status']
     search_fields = ['student__fname', 'student__lname', 'date']
-    ordering_fields = '__all__'
+    ordering_fields = ['id']
 
-class AnnouncementViewSet(viewsets.ModelViewSet):
+class AnnouncementViewSet(ConditionalGetMixin, FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Announcement.objects.all()
     serializer_class = AnnouncementSerializer
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = []
     search_fields = ['title', 'message']
-    ordering_fields = '__all__'
+    ordering_fields = ['id', 'created_at']
 
-class BusAssignmentViewSet(viewsets.ModelViewSet):
-    queryset = BusAssignment.objects.select_related('bus', 'student').all()
+class BusAssignmentViewSet(RosterMixin, BulkModelViewSetMixin, FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
+    queryset = BusAssignment.objects.all()
     serializer_class = BusAssignmentSerializer
+    fast_list = True
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = ['bus', 'student']
     search_fields = ['student__fname', 'student__lname', 'bus__title', 'bus__number']
-    ordering_fields = '__all__'
+    ordering_fields = ['id']
 
-class BusRouteViewSet(viewsets.ModelViewSet):
+    def bulk_changed(self, instances):
+        live.invalidate(*{assignment.bus_id for assignment in instances})
+
+class BusRouteViewSet(ConditionalGetMixin, FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = BusRoute.objects.all()
     serializer_class = BusRouteSerializer
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = ['bus']
     search_fields = ['route_name', 'bus__title', 'bus__number']
-    ordering_fields = '__all__'
+    ordering_fields = ['id']
 
-class BusRoutePointViewSet(viewsets.ModelViewSet):
-    queryset = BusRoutePoint.objects.select_related('route', 'route__bus').all()
+class BusRoutePointViewSet(ConditionalGetMixin, FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
+    queryset = BusRoutePoint.objects.all()
     serializer_class = BusRoutePointSerializer
+    fast_list = True
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = ['route']
     search_fields = ['location_name', 'route__route_name', 'route__bus__title']
-    ordering_fields = '__all__'
+    ordering_fields = ['id', 'order']
+
+    @action(detail=False, methods=['get'], url_path='nearby')
+    def nearby(self, request):
+        """Stops within ``?radius=`` meters (default 500) of ``?lat=&lon=``, nearest first; ``?route=`` narrows to one route."""
+        try:
+            latitude = float(request.query_params['lat'])
+            longitude = float(request.query_params['lon'])
+            radius = radius_param(request)
+            route = int(request.query_params['route']) if request.query_params.get('route') else None
+        except KeyError:
+            return Response({"detail": "lat and lon are required."}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as exc:
+            return Response({"detail": str(exc) or "Invalid coordinates."}, status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return Response({"detail": "Invalid coordinates."}, status=status.HTTP_400_BAD_REQUEST)
+        stops = [stop_row(stop, distance) for distance, stop in stops_near(latitude, longitude, radius, route)]
+        return Response({"count": len(stops), "results": stops})
 
-class TripViewSet(viewsets.ModelViewSet):
-    queryset = Trip.objects.select_related('bus', 'route').all()
+class TripViewSet(FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
+    queryset = Trip.objects.all()
     serializer_class = TripSerializer
+    fast_list = True
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = ['bus', 'route', 'date']
     search_fields = ['bus__title', 'bus__number', 'route__route_name', 'date']
-    ordering_fields = '__all__'
+    ordering_fields = ['id', 'date', 'start_time']
+
+    @action(detail=True, methods=['post'], url_path='attendance')
+    def attendance(self, request, pk=None):
+        """
+        Mark attendance for the students of a trip in one request.
+        Body: ``{"statuses": {"<student id>": "present", ...}, "default": "absent", "date": "YYYY-MM-DD"}``;
+        ``default`` (optional) applies to trip students missing from ``statuses``, ``date`` defaults to the trip's.
+        Rows are upserted on (student, date), so retries are idempotent.
+        """
+        trip = self.get_object()
+        if not isinstance(request.data, dict):
+            return Response({"detail": "Expected an object."}, status=status.HTTP_400_BAD_REQUEST)
+        statuses = request.data.get('statuses', {})
+        default = request.data.get('default')
+        if not isinstance(statuses, dict):
+            return Response({"statuses": ["Expected an object of student id -> status."]}, status=status.HTTP_400_BAD_REQUEST)
+        day = request.data.get('date')
+        if not day:
+            day = trip.date
+        elif not isinstance(day, str):
+            day = None  # parse_date() raises TypeError on numbers
+        else:
+            try:
+                day = parse_date(day)
+            except ValueError:
+                day = None
+        if day is None:
+            return Response({"date": ["Date has wrong format. Use YYYY-MM-DD."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_length = Attendance._meta.get_field('status').max_length
+        students = set(TripStudent.objects.filter(trip=trip).values_list('student_id', flat=True))
+        errors = {}
+        marks = {}
+        for key, value in statuses.items():
+            try:
+                student = int(key)
+            except (TypeError, ValueError):
+                errors[key] = ["Expected a student id."]
+                continue
+            if student not in students:
+                errors[key] = ["Student is not on this trip."]
+            elif not isinstance(value, str) or not value or len(value) > max_length:
+                errors[key] = [f"Expected a status of 1 to {max_length} characters."]
+            else:
+                marks[student] = value
+        if default is not None and (not isinstance(default, str) or not default or len(default) > max_length):
+            errors['default'] = [f"Expected a status of 1 to {max_length} characters."]
+        if errors:
+            return Response({"statuses": errors}, status=status.HTTP_400_BAD_REQUEST)
+        if default is not None:
+            for student in students - set(marks):
+                marks[student] = default
 
-class TripStudentViewSet(viewsets.ModelViewSet):
-    queryset = TripStudent.objects.select_related('trip', 'student').all()
+        with transaction.atomic():
+            Attendance.objects.bulk_create(
+                [Attendance(student_id=student, date=day, status=value) for student, value in marks.items()],
+                update_conflicts=True,
+                unique_fields=['student', 'date'],
+                update_fields=['status'],
+            )
+        return Response({
+            "trip": trip.id,
+            "date": day.isoformat(),
+            "marked": len(marks),
+            "results": [{"student": student, "status": marks[student]} for student in sorted(marks)],
+        })
+
+class TripStudentViewSet(BulkModelViewSetMixin, FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
+    queryset = TripStudent.objects.all()
     serializer_class = TripStudentSerializer
+    fast_list = True
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = ['trip', 'student']
     search_fields = ['trip__date', 'trip__bus__title', 'student__fname', 'student__lname']
-    ordering_fields = '__all__'
+    ordering_fields = ['id']
+
+    def bulk_changed(self, instances):
+        live.invalidate(*Trip.objects.filter(id__in={ts.trip_id for ts in instances}).values_list('bus_id', flat=True))
 
-class FeedbackViewSet(viewsets.ModelViewSet):
+class FeedbackViewSet(FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Feedback.objects.all()
     serializer_class = FeedbackSerializer
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = ['user']
     search_fields = ['user__username', 'message']
-    ordering_fields = '__all__'
+    ordering_fields = ['id', 'created_at']
 
-class MaintenanceLogViewSet(viewsets.ModelViewSet):
+class MaintenanceLogViewSet(FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = MaintenanceLog.objects.all()
     serializer_class = MaintenanceLogSerializer
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = ['bus', 'maintenance_type']
     search_fields = ['bus__title', 'bus__number', 'maintenance_type', 'description']
-    ordering_fields = '__all__'
+    ordering_fields = ['id', 'date']
 
-class NotificationViewSet(viewsets.ModelViewSet):
+class NotificationViewSet(FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
+    fast_list = True
+    pagination_class = NotificationPagination
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = ['bus']
     search_fields = ['title', 'message', 'bus__title']
-    ordering_fields = '__all__'
+    ordering_fields = ['id', 'created_at']
+
+class InboxViewSet(FastListMixin, QueryPlanMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    The current user's notifications, newest first, from the per-recipient rows the fan-out writes.
+    - ``?unread=1`` lists only unread ones; ``unread-count/`` counts them.
+    - ``POST <id>/read/`` and ``POST read-all/`` mark them read.
+    """
+    queryset = NotificationRecipient.objects.all()
+    serializer_class = NotificationRecipientSerializer
+    select_related_fields = ('notification',)
+    pagination_class = InboxPagination
+    permission_classes = [IsAuthenticated]
+    ordering_fields = ['id']
+
+    def get_queryset(self):
+        queryset = super().get_queryset().filter(user=self.request.user)
+        if self.request.query_params.get('unread') in ('1', 'true'):
+            queryset = queryset.filter(read_at__isnull=True)
+        return queryset
+
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        entry = self.get_object()
+        if entry.read_at is None:
+            entry.read_at = timezone.now()
+            entry.save(update_fields=['read_at'])
+        return Response(self.get_serializer(entry).data)
 
-class ReminderViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'], url_path='read-all')
+    def read_all(self, request):
+        updated = NotificationRecipient.objects.filter(user=request.user, read_at__isnull=True).update(read_at=timezone.now())
+        return Response({"updated": updated})
+
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        return Response({"unread": NotificationRecipient.objects.filter(user=request.user, read_at__isnull=True).count()})
+
+class ReminderViewSet(FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Reminder.objects.all()
     serializer_class = ReminderSerializer
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = ['user']
     search_fields = ['user__username', 'message', 'remind_at']
-    ordering_fields = '__all__'
+    ordering_fields = ['id', 'remind_at']
 
-class GPSTrackingViewSet(viewsets.ModelViewSet):
-    queryset = GPSTracking.objects.select_related('bus').all()
+class GPSTrackingViewSet(FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
+    queryset = GPSTracking.objects.all()
     serializer_class = GPSTrackingSerializer
+    fast_list = True
+    pagination_class = GPSTrackingPagination
+    permission_classes = [IsAuthenticated]
+    filterset_fields = ['bus']
+    search_fields = ['bus__title', 'bus__number']
+    ordering_fields = ['id', 'timestamp']
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """
+        Ingest many GPS fixes in one request.
+        Body: a list of ``{bus, latitude, longitude, timestamp?}`` objects, or
+        ``{"bus": id, "points": [...]}`` for a batch from a single bus.
+        Returns a per-item status; valid items are written even if others fail.
+        """
+        payload = request.data
+        default_bus = None
+        if isinstance(payload, dict):
+            default_bus = payload.get('bus')
+            payload = payload.get('points')
+        if not isinstance(payload, list):
+            return Response({"detail": "Expected a list of points."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(payload) > GPS_BATCH_MAX:
+            return Response(
+                {"detail": f"At most {GPS_BATCH_MAX} points per request."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        parsed = parse_fixes(payload, default_bus)
+        created = iter(save_fixes([fix for fix, errors in parsed if fix is not None]))
+        results = []
+        for index, (fix, errors) in enumerate(parsed):
+            if fix is None:
+                results.append({"index": index, "status": "error", "errors": errors})
+            else:
+                results.append({"index": index, "status": "created", "id": next(created).pk})
+        created_count = sum(1 for fix, errors in parsed if fix is not None)
+        if created_count == len(parsed):
+            code = status.HTTP_201_CREATED
+        elif created_count:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response({"created": created_count, "errors": len(parsed) - created_count, "results": results}, status=code)
+
+class GPSDailySummaryViewSet(FastListMixin, QueryPlanMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Per bus and day GPS roll-ups written by the retention job (enforce_gps_retention).
+    """
+    queryset = GPSDailySummary.objects.order_by('-date', 'bus')
+    serializer_class = GPSDailySummarySerializer
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
-    search_fields = ['bus__title', 'bus__number', 'latitude', 'longitude']
-    ordering_fields = '__all__'
+    filterset_fields = ['bus', 'date']
+    ordering_fields = ['date']
 
-class ClassViewSet(viewsets.ModelViewSet):
+class ClassViewSet(ConditionalGetMixin, FastListMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Class.objects.all()
     serializer_class = ClassSerializer
     permission_classes = [IsAuthenticated]
-    filterset_fields = '__all__'
+    filterset_fields = []
     search_fields = ['name']
-    ordering_fields = '__all__'
+    ordering_fields = ['id', 'name']